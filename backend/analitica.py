@@ -0,0 +1,248 @@
+# =============================================================================
+# ANALÍTICA - Almacén columnar en memoria del historial de consultas
+# =============================================================================
+# Representa las consultas como columnas (array/NumPy) en lugar de dicts
+# anidados, para responder agregaciones por rango de fechas sin recorrer
+# consultas.json:
+#
+#   fecha (epoch), mes, estado, tipo_consulta, doctor, especie,
+#   cobro.total, cobro.medicamentos y pagado
+#
+# Las columnas de texto se codifican con un diccionario (valor -> código).
+# El almacén es propio de cada proceso: las escrituras locales se aplican con
+# escrito(), bajo el bloqueo de consultas.json (ver versiones.al_escribir), y
+# los cambios hechos por otros workers se detectan por la fecha de
+# modificación de consultas.json, lo que provoca una recarga completa.
+#
+# escrito() solo aplica los registros cambiados si el contenido anterior a
+# la escritura es el que el almacén ya tenía (mismo 'seq_cambios'); si otro
+# worker escribió en medio, recarga desde lo escrito en vez de darlo por visto.
+# =============================================================================
+
+import os
+import threading
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # Sin NumPy se usa el recorrido en Python puro
+    np = None
+
+try:
+    from .persistencia import leer_json, ruta_datos
+    from .tiempos import a_epoch, desde_epoch, SEGUNDOS_DIA
+except ImportError:
+    from persistencia import leer_json, ruta_datos
+    from tiempos import a_epoch, desde_epoch, SEGUNDOS_DIA
+
+COLUMNAS_TEXTO = ('estado', 'tipo_consulta', 'doctor', 'especie')
+AGRUPACIONES = ('dia', 'mes') + COLUMNAS_TEXTO
+
+
+def _valores_consulta(consulta):
+    fecha = consulta.get('fecha_registro_ts')
+    if fecha is None:
+        try:
+            fecha = a_epoch(consulta.get('fecha_registro'))
+        except ValueError:
+            return None
+
+    cobro = consulta.get('cobro') or {}
+    paciente = consulta.get('paciente') or {}
+    fecha_dt = desde_epoch(fecha)
+    return {
+        'fecha': fecha,
+        'mes': fecha_dt.year * 12 + fecha_dt.month - 1,
+        'estado': consulta.get('estado'),
+        'tipo_consulta': consulta.get('tipo_consulta'),
+        'doctor': consulta.get('atendido_por'),
+        'especie': (paciente.get('especie') or '').capitalize() or None,
+        'total': float(cobro.get('total') or 0),
+        'medicamentos': float(cobro.get('medicamentos') or 0),
+        'pagado': 1 if cobro.get('pagado') else 0
+    }
+
+
+class AlmacenColumnar:
+    """Columnas de consultas con agregaciones por grupo y rango de fechas."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._mtime = None
+        self._seq = None   # 'seq_cambios' del contenido cargado
+        self._vaciar()
+
+    def _vaciar(self):
+        self.fecha = array('q')
+        self.mes = array('q')
+        self.total = array('d')
+        self.medicamentos = array('d')
+        self.pagado = array('b')
+        self.codigos = {col: array('q') for col in COLUMNAS_TEXTO}
+        self.diccionarios = {col: ([], {}) for col in COLUMNAS_TEXTO}
+        self.filas = {}
+
+    def __len__(self):
+        return len(self.fecha)
+
+    def _codificar(self, columna, valor):
+        valores, indice = self.diccionarios[columna]
+        if valor not in indice:
+            indice[valor] = len(valores)
+            valores.append(valor)
+        return indice[valor]
+
+    def _escribir_fila(self, consulta):
+        valores = _valores_consulta(consulta)
+        if valores is None:
+            return
+        fila = self.filas.get(consulta.get('id'))
+        if fila is None:
+            self.filas[consulta.get('id')] = len(self.fecha)
+            self.fecha.append(valores['fecha'])
+            self.mes.append(valores['mes'])
+            self.total.append(valores['total'])
+            self.medicamentos.append(valores['medicamentos'])
+            self.pagado.append(valores['pagado'])
+            for col in COLUMNAS_TEXTO:
+                self.codigos[col].append(self._codificar(col, valores[col]))
+        else:
+            self.fecha[fila] = valores['fecha']
+            self.mes[fila] = valores['mes']
+            self.total[fila] = valores['total']
+            self.medicamentos[fila] = valores['medicamentos']
+            self.pagado[fila] = valores['pagado']
+            for col in COLUMNAS_TEXTO:
+                self.codigos[col][fila] = self._codificar(col, valores[col])
+
+    def _mtime_actual(self):
+        try:
+            return os.stat(ruta_datos('consultas.json')).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def cargar(self, consultas):
+        """Reconstruye todas las columnas desde una lista de consultas."""
+        with self._lock:
+            self._vaciar()
+            for consulta in consultas:
+                self._escribir_fila(consulta)
+
+    def sincronizar(self):
+        """Recarga desde disco si consultas.json cambió fuera de este proceso."""
+        with self._lock:
+            mtime = self._mtime_actual()
+            if mtime != self._mtime:
+                data = leer_json('consultas.json', default={})
+                self.cargar(data.get('consultas', []))
+                self._mtime = mtime
+                self._seq = data.get('seq_cambios', 0)
+
+    def escrito(self, anterior, data):
+        """Aplica una escritura de consultas.json de este proceso (bajo su bloqueo)."""
+        with self._lock:
+            if self._mtime is None:
+                return  # Aún no cargado: la primera consulta lo hará completo
+            seq = anterior.get('seq_cambios', 0)
+            if seq == self._seq:
+                for consulta in data.get('consultas', []):
+                    if consulta.get('seq_cambio', 0) > seq:
+                        self._escribir_fila(consulta)
+            else:
+                # Otro worker escribió desde la última carga: recargar lo escrito
+                self.cargar(data.get('consultas', []))
+            self._seq = data.get('seq_cambios', 0)
+            self._mtime = self._mtime_actual()
+
+    # ------------------------------------------------------------------
+    # Agregaciones
+    # ------------------------------------------------------------------
+
+    def _etiqueta(self, agrupar_por, clave):
+        if agrupar_por == 'dia':
+            return desde_epoch(clave * SEGUNDOS_DIA).strftime('%Y-%m-%d')
+        if agrupar_por == 'mes':
+            return f"{clave // 12:04d}-{clave % 12 + 1:02d}"
+        return self.diccionarios[agrupar_por][0][clave]
+
+    def _claves(self, agrupar_por):
+        if agrupar_por == 'mes':
+            return self.mes
+        if agrupar_por == 'dia':
+            return None  # Se derivan de la columna fecha
+        return self.codigos[agrupar_por]
+
+    def agregar(self, agrupar_por, desde=None, hasta=None):
+        """Agrupa las consultas con fecha en [desde, hasta) (epoch)."""
+        if agrupar_por not in AGRUPACIONES:
+            raise ValueError(f"Agrupación no válida: {agrupar_por}")
+        with self._lock:
+            if np is not None:
+                grupos = self._agregar_numpy(agrupar_por, desde, hasta)
+            else:
+                grupos = self._agregar_python(agrupar_por, desde, hasta)
+            return [self._resumen(agrupar_por, clave, *metricas) for clave, metricas in grupos]
+
+    def _agregar_numpy(self, agrupar_por, desde, hasta):
+        if not len(self):
+            return []
+        fecha = np.frombuffer(self.fecha, dtype=np.int64)
+        mascara = np.ones(len(fecha), dtype=bool)
+        if desde is not None:
+            mascara &= fecha >= desde
+        if hasta is not None:
+            mascara &= fecha < hasta
+
+        if agrupar_por == 'dia':
+            claves = fecha[mascara] // SEGUNDOS_DIA
+        else:
+            claves = np.frombuffer(self._claves(agrupar_por), dtype=np.int64)[mascara]
+        if not len(claves):
+            return []
+
+        base = int(claves.min())
+        indices = claves - base
+        pagado = np.frombuffer(self.pagado, dtype=np.int8)[mascara].astype(np.float64)
+        total = np.frombuffer(self.total, dtype=np.float64)[mascara] * pagado
+        meds = np.frombuffer(self.medicamentos, dtype=np.float64)[mascara] * pagado
+
+        consultas = np.bincount(indices)
+        pagadas = np.bincount(indices, weights=pagado)
+        ingresos = np.bincount(indices, weights=total)
+        ingresos_meds = np.bincount(indices, weights=meds)
+
+        return [
+            (base + int(i), (int(consultas[i]), int(pagadas[i]), float(ingresos[i]), float(ingresos_meds[i])))
+            for i in np.nonzero(consultas)[0]
+        ]
+
+    def _agregar_python(self, agrupar_por, desde, hasta):
+        claves = self._claves(agrupar_por)
+        grupos = {}
+        for fila, fecha in enumerate(self.fecha):
+            if desde is not None and fecha < desde:
+                continue
+            if hasta is not None and fecha >= hasta:
+                continue
+            clave = fecha // SEGUNDOS_DIA if claves is None else claves[fila]
+            metricas = grupos.setdefault(clave, [0, 0, 0.0, 0.0])
+            metricas[0] += 1
+            if self.pagado[fila]:
+                metricas[1] += 1
+                metricas[2] += self.total[fila]
+                metricas[3] += self.medicamentos[fila]
+        return sorted(grupos.items())
+
+    def _resumen(self, agrupar_por, clave, consultas, pagadas, ingresos, ingresos_meds):
+        return {
+            'grupo': self._etiqueta(agrupar_por, clave),
+            'consultas': consultas,
+            'pagadas': pagadas,
+            'ingresos': round(ingresos, 2),
+            'ingresos_medicamentos': round(ingresos_meds, 2),
+            'promedio_ticket': round(ingresos / pagadas, 2) if pagadas else 0,
+            'participacion_medicamentos': round(ingresos_meds * 100 / ingresos, 1) if ingresos else 0
+        }
+
+
+almacen = AlmacenColumnar()
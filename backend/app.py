@@ -1,15 +1,15 @@
-from flask import Flask, request, jsonify, session, send_from_directory, send_file
+from flask import Flask, Response, request, jsonify, session, send_file
 from flask_cors import CORS
-import json
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+import math
 import os
 import unicodedata
 from datetime import datetime
 from functools import wraps
-import zipfile
-import io
 import shutil
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import time
 
 # Import del Blueprint bot_api (compatible con local y producción)
 try:
@@ -17,79 +17,146 @@ try:
 except ImportError:
     from bot_api import bot_api  # Cuando se ejecuta directamente (py backend/app.py)
 
+try:
+    from . import calentamiento, cambios, diario, estadisticas, eventos, liderazgo, migraciones, reservas, respaldos, secuencias, trabajos, versiones
+    from .analitica import almacen as almacen_analitico, AGRUPACIONES
+    from .cache_http import con_etag
+    from .compresion import comprimir_respuesta, compilar_frontend, enviar_pagina
+    from . import exportacion, instantanea, json_rapido
+    from .paginacion import leer_paginacion, paginar
+    from .persistencia import bloqueo, escribir_json, leer_json
+    from .proyeccion import leer_campos, proyectar
+    from .tiempos import a_epoch, epoch_ahora, sellar, SEGUNDOS_DIA
+except ImportError:
+    import calentamiento, cambios, diario, estadisticas, eventos, liderazgo, migraciones, reservas, respaldos, secuencias, trabajos, versiones
+    from analitica import almacen as almacen_analitico, AGRUPACIONES
+    from cache_http import con_etag
+    from compresion import comprimir_respuesta, compilar_frontend, enviar_pagina
+    import exportacion, instantanea, json_rapido
+    from paginacion import leer_paginacion, paginar
+    from persistencia import bloqueo, escribir_json, leer_json
+    from proyeccion import leer_campos, proyectar
+    from tiempos import a_epoch, epoch_ahora, sellar, SEGUNDOS_DIA
+
 # Configurar ruta del frontend
 FRONTEND_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend')
 
 app = Flask(__name__, static_folder=FRONTEND_FOLDER)
 app.secret_key = 'betterdoctor_secret_key_2024'
+app.json = json_rapido.ProveedorJSON(app)
 CORS(app, supports_credentials=True)
 
 app.register_blueprint(bot_api)
 
+# Aplicar migraciones de esquema pendientes (idempotente, bajo bloqueo)
+migraciones.migrar_todo()
+
+# Cada petición carga cada archivo JSON una sola vez (ver instantanea.py)
+app.before_request(instantanea.activar)
+app.after_request(instantanea.revisar_lecturas)
+
+# Comprimir respuestas JSON grandes y precomprimir las páginas del frontend
+app.after_request(comprimir_respuesta)
+compilar_frontend()
+
 # ==================== FUNCIONES DE CARGA DE DATOS ====================
 
+@instantanea.memorizar('data_simulada.json')
 def cargar_datos():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'data_simulada.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
+@instantanea.memorizar('users.json')
 def cargar_usuarios():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'users.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
+@instantanea.memorizar('inventario.json')
 def cargar_inventario():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'inventario.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
-def guardar_inventario(inventario):
-    ruta_archivo = os.path.join(os.path.dirname(__file__), 'inventario.json')
-    with open(ruta_archivo, 'w', encoding='utf-8') as f:
-        json.dump(inventario, f, ensure_ascii=False, indent=2)
+def guardar_inventario(inventario, modificados=None):
+    versiones.guardar_versionado('inventario.json', inventario, 'medicamentos', modificados)
+    instantanea.actualizar('inventario.json', inventario)
 
+@instantanea.memorizar('consultas.json')
 def cargar_consultas():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'consultas.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
-def guardar_consultas(consultas):
-    ruta_archivo = os.path.join(os.path.dirname(__file__), 'consultas.json')
-    with open(ruta_archivo, 'w', encoding='utf-8') as f:
-        json.dump(consultas, f, ensure_ascii=False, indent=2)
+def guardar_consultas(consultas, modificados=None):
+    versiones.guardar_versionado('consultas.json', consultas, 'consultas', modificados)
+    instantanea.actualizar('consultas.json', consultas)
 
+@instantanea.memorizar('pacientes.json')
 def cargar_pacientes():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'pacientes.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
-def guardar_pacientes(pacientes):
-    ruta_archivo = os.path.join(os.path.dirname(__file__), 'pacientes.json')
-    with open(ruta_archivo, 'w', encoding='utf-8') as f:
-        json.dump(pacientes, f, ensure_ascii=False, indent=2)
+def guardar_pacientes(pacientes, modificados=None):
+    versiones.guardar_versionado('pacientes.json', pacientes, 'pacientes', modificados)
+    instantanea.actualizar('pacientes.json', pacientes)
 
+@instantanea.memorizar('razas.json')
 def cargar_razas():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'razas.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
+@instantanea.memorizar('diagnosticos_veterinarios.json')
 def cargar_diagnosticos_completos():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'diagnosticos_veterinarios.json')
-    with open(ruta_archivo, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ruta_archivo, 'rb') as f:
+        return json_rapido.load(f)
 
+@instantanea.memorizar('clientes.json')
 def cargar_clientes():
     ruta_archivo = os.path.join(os.path.dirname(__file__), 'clientes.json')
     try:
-        with open(ruta_archivo, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(ruta_archivo, 'rb') as f:
+            return json_rapido.load(f)
     except FileNotFoundError:
         return {"clientes": [], "ultimo_id": 0}
 
 def guardar_clientes(clientes):
-    ruta_archivo = os.path.join(os.path.dirname(__file__), 'clientes.json')
-    with open(ruta_archivo, 'w', encoding='utf-8') as f:
-        json.dump(clientes, f, ensure_ascii=False, indent=2)
+    with bloqueo('clientes.json'):
+        escribir_json('clientes.json', clientes)
+    instantanea.actualizar('clientes.json', clientes)
+
+# ==================== CONTROL DE VERSIONES ====================
+
+def version_esperada(req_data=None):
+    """Versión que el cliente está editando: cabecera If-Match o 'version' del body."""
+    valor = request.headers.get('If-Match')
+    if valor is None and isinstance(req_data, dict):
+        valor = req_data.get('version')
+    return versiones.leer_version(valor)
+
+def con_version(respuesta, registro):
+    """Expone la versión del registro como ETag (para enviarla luego en If-Match)."""
+    respuesta.headers['ETag'] = f'"{registro.get("version", 1)}"'
+    return respuesta
+
+@app.errorhandler(versiones.ConflictoVersion)
+def conflicto_version(e):
+    print(f"[VERSIONES] ⚠️ Conflicto en {request.method} {request.path}: versión vigente {e.version_actual}")
+    return jsonify({
+        'exito': False,
+        'mensaje': str(e),
+        'conflicto': True,
+        'version_actual': e.version_actual,
+        'registro': e.registro
+    }), 409
+
+@app.errorhandler(versiones.VersionInvalida)
+def version_invalida(e):
+    return jsonify({'exito': False, 'mensaje': str(e)}), 400
 
 # ==================== FUNCIONES DE UTILIDAD ====================
 
@@ -162,12 +229,17 @@ def calcular_coincidencia(sintomas_entrada, sintomas_diagnostico):
     porcentaje = (coincidencias / len(sintomas_entrada)) * 100 if len(sintomas_entrada) > 0 else 0
     return porcentaje, sintomas_coincidentes
 
-def generar_ticket():
-    data = cargar_consultas()
-    data['ultimo_ticket'] = data.get('ultimo_ticket', 0) + 1
-    numero = data['ultimo_ticket']
-    guardar_consultas(data)
-    return f"BD-{datetime.now().year}-{str(numero).zfill(4)}"
+def fecha_registro_ts(consulta):
+    """Clave de orden numérica por fecha de registro de una consulta."""
+    return consulta.get('fecha_registro_ts') or 0
+
+def clave_consulta_reciente(consulta):
+    """Clave de paginación: más recientes primero, desempate por id."""
+    return (-fecha_registro_ts(consulta), -consulta.get('id', 0))
+
+def clave_id(registro):
+    """Clave de paginación por id ascendente."""
+    return (registro.get('id', 0),)
 
 def calcular_edad(fecha_nacimiento):
     """Calcula la edad a partir de la fecha de nacimiento."""
@@ -505,6 +577,7 @@ def obtener_historial_mascota_cliente(mascota_id):
             historial.append({
                 'id': consulta.get('id'),
                 'fecha': consulta.get('fecha_registro', ''),
+                'fecha_ts': fecha_registro_ts(consulta),
                 'motivo': consulta.get('motivo_consulta', consulta.get('sintomas_texto', '')),
                 'diagnostico': consulta.get('diagnostico', ''),
                 'tratamiento': consulta.get('tratamiento', ''),
@@ -514,7 +587,7 @@ def obtener_historial_mascota_cliente(mascota_id):
             })
     
     # Ordenar por fecha más reciente
-    historial.sort(key=lambda x: x['fecha'], reverse=True)
+    historial.sort(key=lambda x: x['fecha_ts'], reverse=True)
     
     return jsonify({
         'exito': True,
@@ -570,12 +643,10 @@ def solicitar_cita_cliente():
         return jsonify({'exito': False, 'mensaje': 'Mascota no encontrada'}), 404
     
     # Crear la cita
-    ultimo_ticket = consultas_data.get('ultimo_ticket', 0) + 1
-    año = datetime.now().year
-    numero_ticket = f"WEB-{año}-{str(ultimo_ticket).zfill(4)}"
+    numero_ticket = secuencias.nuevo_ticket('WEB')
     
     nueva_cita = {
-        'id': len(consultas_data.get('consultas', [])) + 1,
+        'id': secuencias.nuevo_id_consulta(),
         'numero_ticket': numero_ticket,
         'fecha_registro': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
         'estado': 'en_espera',
@@ -600,10 +671,11 @@ def solicitar_cita_cliente():
         'atendido_por': None,
         'cliente_id': cliente_id
     }
+    sellar(nueva_cita, 'fecha_registro')
     
     consultas_data['consultas'].append(nueva_cita)
-    consultas_data['ultimo_ticket'] = ultimo_ticket
-    guardar_consultas(consultas_data)
+    guardar_consultas(consultas_data, modificados={nueva_cita['id']})
+    cambios.consulta_guardada(nueva_cita, evento='cita_portal')
     
     return jsonify({
         'exito': True,
@@ -649,6 +721,7 @@ def obtener_citas_cliente():
                 'id': consulta.get('id'),
                 'numero_ticket': consulta.get('numero_ticket'),
                 'fecha': consulta.get('fecha_registro'),
+                'fecha_ts': fecha_registro_ts(consulta),
                 'mascota': consulta.get('paciente', {}).get('nombre', ''),
                 'motivo': consulta.get('motivo_consulta', ''),
                 'estado': consulta.get('estado'),
@@ -657,7 +730,7 @@ def obtener_citas_cliente():
             })
     
     # Ordenar por fecha más reciente
-    citas.sort(key=lambda x: x['fecha'], reverse=True)
+    citas.sort(key=lambda x: x['fecha_ts'], reverse=True)
     
     return jsonify({
         'exito': True,
@@ -672,51 +745,153 @@ def obtener_citas_cliente():
 def obtener_consultas():
     """Obtiene las consultas según filtros."""
     estado = request.args.get('estado', None)
+    try:
+        paginacion = leer_paginacion(request.args)
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     data = cargar_consultas()
     consultas = data.get('consultas', [])
     
     if estado:
         consultas = [c for c in consultas if c['estado'] == estado]
     
+    if paginacion:
+        try:
+            pagina, siguiente = paginar(consultas, clave_consulta_reciente, *paginacion)
+        except ValueError as e:
+            return jsonify({'exito': False, 'mensaje': str(e)}), 400
+        return jsonify({
+            'exito': True,
+            'consultas': proyectar(pagina, campos),
+            'total': len(consultas),
+            'siguiente_cursor': siguiente
+        })
+    
     # Ordenar por fecha más reciente
-    consultas.sort(key=lambda x: x.get('fecha_registro', ''), reverse=True)
+    consultas = sorted(consultas, key=fecha_registro_ts, reverse=True)
     
     return jsonify({
         'exito': True,
-        'consultas': consultas,
+        'consultas': proyectar(consultas, campos),
         'total': len(consultas)
     })
 
 @app.route('/api/consultas/todas', methods=['GET'])
 def todas_las_consultas():
     """Obtiene todas las consultas."""
+    try:
+        paginacion = leer_paginacion(request.args)
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     data = cargar_consultas()
     consultas = data.get('consultas', [])
+    
+    if paginacion:
+        try:
+            pagina, siguiente = paginar(consultas, clave_consulta_reciente, *paginacion)
+        except ValueError as e:
+            return jsonify({'exito': False, 'mensaje': str(e)}), 400
+        return jsonify({
+            'exito': True,
+            'consultas': proyectar(pagina, campos),
+            'total': len(consultas),
+            'siguiente_cursor': siguiente
+        })
+    
     # Ordenar por fecha más reciente
-    consultas_ordenadas = sorted(consultas, key=lambda x: x.get('fecha_registro', ''), reverse=True)
+    consultas_ordenadas = sorted(consultas, key=fecha_registro_ts, reverse=True)
     return jsonify({
         'exito': True,
-        'consultas': consultas_ordenadas,
+        'consultas': proyectar(consultas_ordenadas, campos),
         'total': len(consultas_ordenadas)
     })
 
+# Long-poll de /api/consultas/pendientes (segundos)
+TIMEOUT_LONG_POLL = 25
+TIMEOUT_LONG_POLL_MAXIMO = 55
+
+def sin_lugar_para_esperar():
+    """Respuesta cuando este worker ya tiene eventos.MAX_ESPERAS conexiones en espera."""
+    return jsonify({
+        'exito': False,
+        'mensaje': 'Demasiadas conexiones en espera, reintente más tarde'
+    }), 503, {'Retry-After': str(TIMEOUT_LONG_POLL)}
+
+@app.route('/api/consultas/stream', methods=['GET'])
+def stream_consultas():
+    """Stream SSE con los cambios de estado de las consultas."""
+    ultimo = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    try:
+        desde = int(ultimo) if ultimo else eventos.version_actual()
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Last-Event-ID inválido'}), 400
+    
+    if not eventos.tomar_espera():
+        return sin_lugar_para_esperar()
+    respuesta = Response(eventos.flujo_sse(desde), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Evitar que un proxy nginx acumule los eventos
+    })
+    respuesta.call_on_close(eventos.soltar_espera)
+    return respuesta
+
 @app.route('/api/consultas/pendientes', methods=['GET'])
 def consultas_pendientes():
-    """Obtiene consultas pendientes para el doctor."""
+    """
+    Obtiene consultas pendientes para el doctor.
+    
+    Long-poll: con ?esperar_version=<v> la petición espera (hasta ?timeout=
+    segundos) a que la versión de la cola deje de ser v. Si vence sin cambios
+    responde actualizado=False sin la lista, para que el cliente vuelva a
+    esperar. La versión es el seq del último evento de consultas.
+    """
+    try:
+        campos = leer_campos(request.args)
+        esperar_version = request.args.get('esperar_version')
+        esperar_version = int(esperar_version) if esperar_version not in (None, '') else None
+        timeout = float(request.args.get('timeout', TIMEOUT_LONG_POLL))
+        if not math.isfinite(timeout) or timeout <= 0:
+            raise ValueError('timeout debe ser un número de segundos mayor que 0')
+        timeout = max(0, min(timeout, TIMEOUT_LONG_POLL_MAXIMO))
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
+    version = eventos.version_actual()
+    if esperar_version is not None and version == esperar_version:
+        if not eventos.tomar_espera():
+            return sin_lugar_para_esperar()
+        try:
+            version = eventos.esperar(esperar_version, timeout)
+        finally:
+            eventos.soltar_espera()
+        if version == esperar_version:
+            return jsonify({'exito': True, 'version': version, 'actualizado': False})
+    
     data = cargar_consultas()
     consultas = data.get('consultas', [])
     pendientes = [c for c in consultas if c['estado'] in ['en_espera', 'en_atencion']]
-    pendientes.sort(key=lambda x: x.get('fecha_registro', ''))
+    pendientes.sort(key=fecha_registro_ts)
     
     return jsonify({
         'exito': True,
-        'consultas': pendientes,
+        'version': version,
+        'actualizado': True,
+        'consultas': proyectar(pendientes, campos),
         'total': len(pendientes)
     })
 
 @app.route('/api/consultas/por-cobrar', methods=['GET'])
 def consultas_por_cobrar():
     """Obtiene consultas atendidas pendientes de cobro."""
+    try:
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     data = cargar_consultas()
     consultas = data.get('consultas', [])
     # Buscar consultas completadas o atendidas que no estén pagadas
@@ -728,68 +903,26 @@ def consultas_por_cobrar():
     
     return jsonify({
         'exito': True,
-        'consultas': por_cobrar,
+        'consultas': proyectar(por_cobrar, campos),
         'total': len(por_cobrar)
     })
 
 
 @app.route('/api/dashboard/estadisticas', methods=['GET'])
 def obtener_estadisticas_dashboard():
-    """Obtiene estadísticas reales para el dashboard."""
-    from datetime import datetime, timedelta
-    
-    data = cargar_consultas()
-    consultas = data.get('consultas', [])
+    """Obtiene estadísticas reales para el dashboard (desde contadores incrementales)."""
+    stats = estadisticas.cargar_estadisticas()
     
-    # Fecha actual y del mes
     hoy = datetime.now()
-    primer_dia_mes = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # Calcular ingresos del mes (consultas pagadas)
-    cobrado_mes = 0
-    consultas_hoy = 0
-    consultas_mes = 0
-    consultas_pagadas_mes = 0
-    total_tickets = []
-    
-    for c in consultas:
-        fecha_str = c.get('fecha_registro', '')
-        cobro = c.get('cobro', {})
-        if fecha_str:
-            try:
-                fecha = datetime.fromisoformat(fecha_str.replace('Z', '+00:00'))
-                
-                # Consultas del mes
-                if fecha >= primer_dia_mes:
-                    consultas_mes += 1
-                    # Sumar ingresos si está pagada
-                    if cobro and cobro.get('pagado', False):
-                        monto = cobro.get('total', 0)
-                        cobrado_mes += monto
-                        consultas_pagadas_mes += 1
-                        if monto > 0:
-                            total_tickets.append(monto)
-                
-                # Consultas de hoy
-                if fecha.date() == hoy.date():
-                    consultas_hoy += 1
-            except:
-                pass
+    dia = stats['por_dia'].get(hoy.strftime('%Y-%m-%d'), {})
+    mes = stats['por_mes'].get(hoy.strftime('%Y-%m'), {})
     
-    # Consultas pendientes de pago (todas, no solo del mes)
-    estados_validos = ['atendida', 'completada']
-    pendientes = [c for c in consultas 
-                  if c.get('estado') in estados_validos 
-                  and c.get('cobro') is not None 
-                  and not c.get('cobro', {}).get('pagado', True)]
-    
-    total_pendiente = sum(c.get('cobro', {}).get('total', 0) for c in pendientes)
+    cobrado_mes = mes.get('cobrado', 0)
+    consultas_hoy = dia.get('consultas', 0)
     
     # Promedio ticket
-    promedio_ticket = int(sum(total_tickets) / len(total_tickets)) if total_tickets else 0
-    
-    # Consultas en espera hoy
-    en_espera = [c for c in consultas if c.get('estado') == 'en_espera']
+    tickets = mes.get('tickets', 0)
+    promedio_ticket = int(mes.get('suma_tickets', 0) / tickets) if tickets else 0
     
     # Peluquería (simulado por ahora)
     peluqueria_hoy = 3
@@ -799,17 +932,28 @@ def obtener_estadisticas_dashboard():
         'estadisticas': {
             'cobrado_mes': cobrado_mes,
             'ingresos_mes': cobrado_mes,
-            'consultas_mes': consultas_mes,
-            'consultas_pagadas_mes': consultas_pagadas_mes,
+            'consultas_mes': mes.get('consultas', 0),
+            'consultas_pagadas_mes': mes.get('pagadas', 0),
             'consultas_hoy': consultas_hoy,
-            'citas_hoy': len(en_espera) + consultas_hoy,
-            'pagos_pendientes': len(pendientes),
-            'total_pendiente': total_pendiente,
+            'citas_hoy': stats['en_espera'] + consultas_hoy,
+            'pagos_pendientes': stats['pendientes']['cantidad'],
+            'total_pendiente': stats['pendientes']['total'],
             'promedio_ticket': promedio_ticket,
             'peluqueria_hoy': peluqueria_hoy
         }
     })
 
+@app.route('/api/dashboard/estadisticas/reconstruir', methods=['POST'])
+def reconstruir_estadisticas_dashboard():
+    """Recalcula los contadores del dashboard y las series de ingresos."""
+    stats = estadisticas.reconstruir()
+    return jsonify({
+        'exito': True,
+        'mensaje': 'Estadísticas reconstruidas',
+        'dias': len(stats['por_dia']),
+        'meses': len(stats['por_mes'])
+    })
+
 @app.route('/api/consultas/nueva', methods=['POST'])
 def nueva_consulta():
     """Registra una nueva consulta (recepcionista)."""
@@ -817,10 +961,9 @@ def nueva_consulta():
     
     consultas_data = cargar_consultas()
     
-    # Generar nuevo ID y ticket de forma atómica
-    nuevo_id = max([c['id'] for c in consultas_data['consultas']], default=0) + 1
-    consultas_data['ultimo_ticket'] = consultas_data.get('ultimo_ticket', 0) + 1
-    numero_ticket = f"BD-{datetime.now().year}-{str(consultas_data['ultimo_ticket']).zfill(4)}"
+    # Generar nuevo ID y ticket de forma atómica (ver secuencias.py)
+    nuevo_id = secuencias.nuevo_id_consulta()
+    numero_ticket = secuencias.nuevo_ticket('BD')
     
     nueva = {
         'id': nuevo_id,
@@ -849,9 +992,11 @@ def nueva_consulta():
         'fecha_atencion': None,
         'fecha_cierre': None
     }
+    sellar(nueva, 'fecha_registro')
     
     consultas_data['consultas'].append(nueva)
-    guardar_consultas(consultas_data)
+    guardar_consultas(consultas_data, modificados={nuevo_id})
+    cambios.consulta_guardada(nueva, evento='nueva')
     
     return jsonify({
         'exito': True,
@@ -863,11 +1008,16 @@ def nueva_consulta():
 @app.route('/api/consultas/<int:consulta_id>', methods=['GET'])
 def obtener_consulta(consulta_id):
     """Obtiene una consulta específica."""
+    try:
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     data = cargar_consultas()
     consulta = next((c for c in data['consultas'] if c['id'] == consulta_id), None)
     
     if consulta:
-        return jsonify({'exito': True, 'consulta': consulta})
+        return con_version(jsonify({'exito': True, 'consulta': proyectar(consulta, campos)}), consulta)
     return jsonify({'exito': False, 'mensaje': 'Consulta no encontrada'}), 404
 
 @app.route('/api/consultas/<int:consulta_id>/atender', methods=['POST'])
@@ -878,10 +1028,12 @@ def iniciar_atencion(consulta_id):
     
     for consulta in data['consultas']:
         if consulta['id'] == consulta_id:
+            versiones.verificar_version(consulta, version_esperada(req_data))
             consulta['estado'] = 'en_atencion'
             consulta['atendido_por'] = req_data.get('doctor', '')
             consulta['fecha_atencion'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-            guardar_consultas(data)
+            guardar_consultas(data, modificados={consulta_id})
+            cambios.consulta_guardada(consulta, evento='atender')
             return jsonify({'exito': True, 'mensaje': 'Atención iniciada', 'consulta': consulta})
     
     return jsonify({'exito': False, 'mensaje': 'Consulta no encontrada'}), 404
@@ -894,13 +1046,32 @@ def guardar_diagnostico(consulta_id):
     
     for consulta in data['consultas']:
         if consulta['id'] == consulta_id:
+            versiones.verificar_version(consulta, version_esperada(req_data))
             consulta['diagnostico'] = req_data.get('diagnostico')
             consulta['tratamiento'] = req_data.get('tratamiento')
             
             # Procesar medicamentos con estructura mejorada
-            medicamentos_raw = req_data.get('medicamentos', [])
             inventario = cargar_inventario()
             meds_inventario = inventario.get('medicamentos', [])
+            ids_inventario = {m['id'] for m in meds_inventario}
+            
+            # Solo productos del inventario (id entero) y cantidades enteras positivas
+            medicamentos_raw = []
+            for med_rec in req_data.get('medicamentos') or []:
+                if not isinstance(med_rec, dict):
+                    return jsonify({'exito': False, 'mensaje': 'Medicamento inválido'}), 400
+                cantidad = med_rec.get('cantidad', 1)
+                if type(cantidad) is not int or cantidad <= 0:
+                    return jsonify({'exito': False, 'mensaje': f"Cantidad inválida para el medicamento {med_rec.get('id')}"}), 400
+                if type(med_rec.get('id')) is int and med_rec['id'] in ids_inventario:
+                    medicamentos_raw.append(med_rec)
+            
+            # Reservar el stock recetado (reemplaza la reserva de una receta anterior)
+            cantidades = {}
+            for med_rec in medicamentos_raw:
+                cantidades[med_rec['id']] = cantidades.get(med_rec['id'], 0) + med_rec.get('cantidad', 1)
+            anteriores = [m['id'] for m in consulta.get('medicamentos_recetados') or []]
+            reservado = reservas.reservar(consulta_id, cantidades, anteriores)
             
             medicamentos_procesados = []
             total_meds = 0
@@ -908,9 +1079,10 @@ def guardar_diagnostico(consulta_id):
             for med_rec in medicamentos_raw:
                 med_info = next((m for m in meds_inventario if m['id'] == med_rec['id']), None)
                 if med_info:
-                    # Verificar disponibilidad de stock
+                    # Verificar disponibilidad de stock (descontando lo reservado por otras consultas)
                     cantidad_solicitada = med_rec.get('cantidad', 1)
-                    stock_disponible = med_info.get('stock', 0)
+                    reserva = reservado.get(med_info['id'], {'disponible': med_info.get('stock', 0), 'reservado': 0})
+                    stock_disponible = reserva['disponible']
                     estado_stock = 'disponible'
                     
                     if stock_disponible == 0:
@@ -938,6 +1110,7 @@ def guardar_diagnostico(consulta_id):
                         'subtotal': round(subtotal, 2),
                         'stock_al_recetar': stock_disponible,
                         'estado_stock': estado_stock,
+                        'cantidad_reservada': reserva['reservado'],
                         'recetado_por': req_data.get('doctor', consulta.get('atendido_por', '')),
                         'fecha_receta': datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
                     }
@@ -965,7 +1138,15 @@ def guardar_diagnostico(consulta_id):
                 } for m in medicamentos_procesados]
             }
             
-            guardar_consultas(data)
+            try:
+                guardar_consultas(data, modificados={consulta_id})
+            except versiones.ConflictoVersion as e:
+                # La receta no se guardó: dejar la reserva como la indica la versión vigente
+                vigentes = {m['id']: m['cantidad_reservada'] for m in e.registro.get('medicamentos_recetados') or []
+                            if m.get('cantidad_reservada')}
+                reservas.reservar(consulta_id, vigentes, set(cantidades) | set(anteriores))
+                raise
+            cambios.consulta_guardada(consulta, evento='diagnostico')
             return jsonify({'exito': True, 'mensaje': 'Diagnóstico guardado', 'consulta': consulta})
     
     return jsonify({'exito': False, 'mensaje': 'Consulta no encontrada'}), 404
@@ -977,10 +1158,13 @@ def devolver_a_cola(consulta_id):
     
     for consulta in data['consultas']:
         if consulta['id'] == consulta_id:
+            versiones.verificar_version(consulta, version_esperada(request.get_json(silent=True)))
             if consulta['estado'] == 'en_atencion':
                 consulta['estado'] = 'en_espera'
                 consulta['atendido_por'] = None
-                guardar_consultas(data)
+                guardar_consultas(data, modificados={consulta_id})
+                reservas.liberar(consulta_id, [m['id'] for m in consulta.get('medicamentos_recetados') or []])
+                cambios.consulta_guardada(consulta, evento='devolver')
                 return jsonify({'exito': True, 'mensaje': 'Consulta devuelta a cola de espera'})
             else:
                 return jsonify({'exito': False, 'mensaje': f"La consulta está en estado '{consulta['estado']}', no se puede devolver"}), 400
@@ -995,9 +1179,22 @@ def cobrar_consulta(consulta_id):
     
     for consulta in data['consultas']:
         if consulta['id'] == consulta_id:
-            # Si se enviaron medicamentos actualizados, usarlos
+            versiones.verificar_version(consulta, version_esperada(req_data))
+            reservados = [m['id'] for m in consulta.get('medicamentos_recetados') or []]
+            
+            # Si se enviaron medicamentos actualizados, usarlos (id y cantidad
+            # enteros: se validan antes de marcar la consulta como pagada)
             meds_actualizados = req_data.get('medicamentos_actualizados')
             if meds_actualizados is not None:
+                if not isinstance(meds_actualizados, list):
+                    return jsonify({'exito': False, 'mensaje': 'medicamentos_actualizados debe ser una lista'}), 400
+                for med_rec in meds_actualizados:
+                    if not isinstance(med_rec, dict) or type(med_rec.get('id')) is not int or med_rec['id'] < 0:
+                        return jsonify({'exito': False, 'mensaje': 'Medicamento inválido'}), 400
+                    cantidad = med_rec.get('cantidad', 1)
+                    if type(cantidad) is not int or cantidad <= 0:
+                        return jsonify({'exito': False, 'mensaje': f"Cantidad inválida para el medicamento {med_rec['id']}"}), 400
+                
                 # Actualizar lista de medicamentos recetados
                 consulta['medicamentos_recetados'] = meds_actualizados
                 
@@ -1011,17 +1208,18 @@ def cobrar_consulta(consulta_id):
             consulta['estado'] = 'completada'
             consulta['fecha_cierre'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
             
-            # Descontar medicamentos del inventario (solo los que se vendieron)
-            inventario = cargar_inventario()
+            # Guardar primero la consulta: si otro usuario la modificó (409)
+            # el stock no se descuenta
+            guardar_consultas(data, modificados={consulta_id})
+            
+            # Convertir la reserva en venta: descontar del inventario solo lo que se vendió
+            vendidos = {}
             for med_rec in consulta.get('medicamentos_recetados', []):
-                for med in inventario['medicamentos']:
-                    if med['id'] == med_rec['id']:
-                        cantidad = med_rec.get('cantidad', 1)
-                        med['stock'] = max(0, med['stock'] - cantidad)
-                        break
-            guardar_inventario(inventario)
+                vendidos[med_rec['id']] = vendidos.get(med_rec['id'], 0) + med_rec.get('cantidad', 1)
+            inventario = reservas.vender(consulta_id, vendidos, reservados)
+            instantanea.actualizar('inventario.json', inventario)
             
-            guardar_consultas(data)
+            cambios.consulta_guardada(consulta, evento='cobrar')
             return jsonify({'exito': True, 'mensaje': 'Cobro registrado', 'consulta': consulta})
     
     return jsonify({'exito': False, 'mensaje': 'Consulta no encontrada'}), 404
@@ -1059,9 +1257,9 @@ def generar_boleta(consulta_id):
     }
     
     # Detalle de medicamentos
+    inventario_por_id = {m['id']: m for m in cargar_inventario()['medicamentos']}
     for med in consulta.get('medicamentos_recetados', []):
-        inventario = cargar_inventario()
-        med_info = next((m for m in inventario['medicamentos'] if m['id'] == med['id']), None)
+        med_info = inventario_por_id.get(med['id'])
         if med_info:
             boleta['detalle'].append({
                 'descripcion': med_info['nombre'],
@@ -1135,6 +1333,183 @@ def generar_receta(consulta_id):
     
     return jsonify({'exito': True, 'receta': receta})
 
+# ==================== SINCRONIZACIÓN ====================
+
+@app.route('/api/changes', methods=['GET'])
+def obtener_cambios():
+    """
+    Cambios de una colección (consultas, inventario, pacientes) desde un seq.
+    
+    Sin ?desde= devuelve la colección completa y el seq actual, que el
+    cliente usa en la siguiente llamada para recibir solo lo nuevo.
+    """
+    coleccion = request.args.get('coleccion', '')
+    desde = request.args.get('desde')
+    
+    if coleccion not in versiones.COLECCIONES:
+        return jsonify({'exito': False, 'mensaje': f"Colección no válida. Use: {', '.join(versiones.COLECCIONES)}"}), 400
+    try:
+        desde = int(desde) if desde not in (None, '') else None
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'El parámetro desde debe ser un entero'}), 400
+    
+    return jsonify({
+        'exito': True,
+        'coleccion': coleccion,
+        **versiones.cambios_desde(coleccion, desde)
+    })
+
+# ==================== PETICIONES EN LOTE ====================
+
+# Máximo de sub-peticiones por lote
+MAX_PETICIONES_LOTE = 20
+
+# Endpoints que no terminan o que no tiene sentido anidar
+ENDPOINTS_FUERA_DE_LOTE = {'api_lote', 'stream_consultas', 'exportar_coleccion',
+                           'api_descargar_backup', 'api_descargar_backup_instantaneo'}
+
+@app.route('/api/batch', methods=['POST'])
+def api_lote():
+    """
+    Ejecuta varias lecturas (GET) en una sola petición.
+    
+    Body: {"peticiones": [{"id": "stats", "ruta": "/api/dashboard/estadisticas"}, ...]}
+    
+    Todas las sub-peticiones comparten la instantánea de esta petición, así
+    cada archivo JSON se lee una sola vez por lote. Cada respuesta incluye su código
+    de estado, su cuerpo y su duración en milisegundos.
+    """
+    datos = request.get_json(silent=True) or {}
+    peticiones = datos.get('peticiones')
+    
+    if not isinstance(peticiones, list) or not peticiones:
+        return jsonify({'exito': False, 'mensaje': 'Debe enviar una lista de peticiones'}), 400
+    if len(peticiones) > MAX_PETICIONES_LOTE:
+        return jsonify({'exito': False, 'mensaje': f'Máximo {MAX_PETICIONES_LOTE} peticiones por lote'}), 400
+    
+    # Validar todas las rutas antes de ejecutar ninguna
+    adaptador = app.url_map.bind('')
+    for i, peticion in enumerate(peticiones):
+        ruta = peticion.get('ruta', '') if isinstance(peticion, dict) else ''
+        if not ruta.startswith('/api/'):
+            return jsonify({'exito': False, 'mensaje': f'Petición {i + 1}: ruta inválida'}), 400
+        try:
+            endpoint, _ = adaptador.match(ruta.split('?', 1)[0], method='GET')
+        except MethodNotAllowed:
+            return jsonify({'exito': False, 'mensaje': f'Petición {i + 1}: solo se admiten lecturas GET ({ruta})'}), 400
+        except NotFound:
+            return jsonify({'exito': False, 'mensaje': f'Petición {i + 1}: ruta no encontrada ({ruta})'}), 400
+        if endpoint in ENDPOINTS_FUERA_DE_LOTE or 'esperar_version=' in ruta:
+            return jsonify({'exito': False, 'mensaje': f'Petición {i + 1}: {ruta} no se puede usar en un lote'}), 400
+    
+    cabeceras = {'Cookie': request.headers.get('Cookie', '')}
+    inicio_lote = time.perf_counter()
+    
+    respuestas = []
+    for i, peticion in enumerate(peticiones):
+        inicio = time.perf_counter()
+        with app.test_request_context(peticion['ruta'], method='GET', headers=cabeceras):
+            respuesta = app.full_dispatch_request()
+        cuerpo = respuesta.get_json(silent=True)
+        respuestas.append({
+            'id': peticion.get('id', i),
+            'ruta': peticion['ruta'],
+            'estado': respuesta.status_code,
+            'cuerpo': cuerpo if cuerpo is not None else respuesta.get_data(as_text=True),
+            'duracion_ms': round((time.perf_counter() - inicio) * 1000, 2)
+        })
+    
+    return jsonify({
+        'exito': True,
+        'respuestas': respuestas,
+        'duracion_ms': round((time.perf_counter() - inicio_lote) * 1000, 2)
+    })
+
+# ==================== ANALÍTICA ====================
+
+@app.route('/api/analytics/consultas', methods=['GET'])
+def analitica_consultas():
+    """
+    Agregaciones del historial de consultas desde el almacén columnar.
+    
+    Query params:
+        agrupar_por: dia, mes, estado, tipo_consulta, doctor o especie
+        desde / hasta (YYYY-MM-DD, opcionales, ambos inclusive)
+    """
+    agrupar_por = request.args.get('agrupar_por', 'dia')
+    desde = request.args.get('desde', '')
+    hasta = request.args.get('hasta', '')
+    
+    if agrupar_por not in AGRUPACIONES:
+        return jsonify({'exito': False, 'mensaje': f"agrupar_por debe ser uno de: {', '.join(AGRUPACIONES)}"}), 400
+    
+    try:
+        desde_ts = a_epoch(desde) if desde else None
+        hasta_ts = a_epoch(hasta) + SEGUNDOS_DIA if hasta else None
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fechas inválidas, use YYYY-MM-DD'}), 400
+    
+    almacen_analitico.sincronizar()
+    grupos = almacen_analitico.agregar(agrupar_por, desde_ts, hasta_ts)
+    
+    return jsonify({
+        'exito': True,
+        'agrupar_por': agrupar_por,
+        'desde': desde or None,
+        'hasta': hasta or None,
+        'grupos': grupos,
+        'total_consultas': sum(g['consultas'] for g in grupos),
+        'total_ingresos': round(sum(g['ingresos'] for g in grupos), 2)
+    })
+
+@app.route('/api/analytics/ingresos', methods=['GET'])
+def analitica_ingresos():
+    """
+    Serie de ingresos cobrados desde los rollups precalculados.
+    
+    Query params:
+        granularidad: hora, dia o mes (por defecto dia)
+        desde / hasta (YYYY-MM-DD o YYYY-MM-DDTHH:MM, opcionales, inclusive)
+    """
+    granularidad = request.args.get('granularidad', 'dia')
+    desde = request.args.get('desde', '')
+    hasta = request.args.get('hasta', '')
+    
+    if granularidad not in estadisticas.GRANULARIDADES:
+        return jsonify({'exito': False, 'mensaje': 'granularidad debe ser hora, dia o mes'}), 400
+    
+    try:
+        desde_dt = datetime.fromisoformat(desde) if desde else None
+        hasta_dt = datetime.fromisoformat(hasta) if hasta else None
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fechas inválidas, use YYYY-MM-DD'}), 400
+    
+    # Una fecha sin hora como límite superior incluye el día completo
+    if hasta_dt and len(hasta) <= 10:
+        hasta_dt = hasta_dt.replace(hour=23, minute=59, second=59)
+    
+    serie = estadisticas.serie_ingresos(granularidad, desde_dt, hasta_dt)
+    
+    por_metodo = {}
+    for tramo in serie:
+        for metodo, monto in tramo['por_metodo'].items():
+            por_metodo[metodo] = round(por_metodo.get(metodo, 0) + monto, 2)
+    
+    return jsonify({
+        'exito': True,
+        'granularidad': granularidad,
+        'desde': desde or None,
+        'hasta': hasta or None,
+        'serie': serie,
+        'totales': {
+            'cobros': sum(t['cobros'] for t in serie),
+            'consulta': round(sum(t['consulta'] for t in serie), 2),
+            'medicamentos': round(sum(t['medicamentos'] for t in serie), 2),
+            'total': round(sum(t['total'] for t in serie), 2),
+            'por_metodo': por_metodo
+        }
+    })
+
 # ==================== DIAGNÓSTICO ====================
 
 def simular_diagnostico_por_sintomas(sintomas_entrada, especie=None, limite=5):
@@ -1276,6 +1651,12 @@ def diagnosticar():
 
 @app.route('/api/inventario', methods=['GET'])
 def obtener_inventario():
+    try:
+        paginacion = leer_paginacion(request.args)
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     inventario = cargar_inventario()
     medicamentos = inventario.get('medicamentos', [])
     
@@ -1291,11 +1672,24 @@ def obtener_inventario():
     agotados = sum(1 for m in medicamentos if m['estado_stock'] == 'agotado')
     bajo_stock = sum(1 for m in medicamentos if m['estado_stock'] == 'bajo')
     disponibles = total - agotados - bajo_stock
+    estadisticas_stock = {'total': total, 'disponibles': disponibles, 'bajo_stock': bajo_stock, 'agotados': agotados}
+    
+    if paginacion:
+        try:
+            pagina, siguiente = paginar(medicamentos, clave_id, *paginacion)
+        except ValueError as e:
+            return jsonify({'exito': False, 'mensaje': str(e)}), 400
+        return jsonify({
+            'exito': True,
+            'medicamentos': proyectar(pagina, campos),
+            'estadisticas': estadisticas_stock,
+            'siguiente_cursor': siguiente
+        })
     
     return jsonify({
         'exito': True,
-        'medicamentos': medicamentos,
-        'estadisticas': {'total': total, 'disponibles': disponibles, 'bajo_stock': bajo_stock, 'agotados': agotados}
+        'medicamentos': proyectar(medicamentos, campos),
+        'estadisticas': estadisticas_stock
     })
 
 @app.route('/api/inventario/<int:med_id>/actualizar-stock', methods=['POST'])
@@ -1303,32 +1697,41 @@ def actualizar_stock(med_id):
     data = request.get_json()
     cantidad = data.get('cantidad', 0)
     tipo = data.get('tipo', 'agregar')
+    version = version_esperada(data)
+    
+    if type(cantidad) is not int or cantidad < 0:
+        return jsonify({'exito': False, 'mensaje': 'Cantidad inválida'}), 400
+    
+    # Cambio relativo: se aplica sobre el stock en disco, bajo su bloqueo
+    resultado = {}
+    def aplicar(med):
+        versiones.verificar_version(med, version)
+        if tipo == 'agregar':
+            med['stock'] += cantidad
+        elif tipo == 'restar':
+            if med['stock'] < cantidad:
+                raise ValueError(f'Stock insuficiente. Disponible: {med["stock"]}')
+            med['stock'] -= cantidad
+        elif tipo == 'establecer':
+            med['stock'] = cantidad
+        resultado['stock'] = med['stock']
     
-    inventario = cargar_inventario()
-    
-    for med in inventario['medicamentos']:
-        if med['id'] == med_id:
-            if tipo == 'agregar':
-                med['stock'] += cantidad
-            elif tipo == 'restar':
-                if med['stock'] >= cantidad:
-                    med['stock'] -= cantidad
-                else:
-                    return jsonify({'exito': False, 'mensaje': f'Stock insuficiente. Disponible: {med["stock"]}'}), 400
-            elif tipo == 'establecer':
-                med['stock'] = cantidad
-            
-            guardar_inventario(inventario)
-            return jsonify({'exito': True, 'mensaje': 'Stock actualizado', 'nuevo_stock': med['stock']})
+    try:
+        inventario = versiones.actualizar_registros('inventario.json', 'medicamentos', {med_id: aplicar})
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    instantanea.actualizar('inventario.json', inventario)
     
-    return jsonify({'exito': False, 'mensaje': 'Medicamento no encontrado'}), 404
+    if not resultado:
+        return jsonify({'exito': False, 'mensaje': 'Medicamento no encontrado'}), 404
+    return jsonify({'exito': True, 'mensaje': 'Stock actualizado', 'nuevo_stock': resultado['stock']})
 
 @app.route('/api/inventario/agregar', methods=['POST'])
 def agregar_medicamento():
     data = request.get_json()
     inventario = cargar_inventario()
     
-    nuevo_id = max([m['id'] for m in inventario['medicamentos']], default=0) + 1
+    nuevo_id = secuencias.nuevo_id_producto()
     
     nuevo_med = {
         'id': nuevo_id,
@@ -1346,7 +1749,7 @@ def agregar_medicamento():
     }
     
     inventario['medicamentos'].append(nuevo_med)
-    guardar_inventario(inventario)
+    guardar_inventario(inventario, modificados={nuevo_id})
     
     return jsonify({'exito': True, 'mensaje': 'Medicamento agregado', 'medicamento': nuevo_med})
 
@@ -1356,7 +1759,7 @@ def obtener_alertas():
     medicamentos = inventario.get('medicamentos', [])
     
     alertas = {'stock_bajo': [], 'agotados': [], 'proximos_vencer': []}
-    fecha_actual = datetime.now()
+    ahora_ts = epoch_ahora()
     
     for med in medicamentos:
         if med['stock'] == 0:
@@ -1364,13 +1767,10 @@ def obtener_alertas():
         elif med['stock'] <= med['stock_minimo']:
             alertas['stock_bajo'].append({'id': med['id'], 'nombre': med['nombre'], 'stock_actual': med['stock'], 'stock_minimo': med['stock_minimo']})
         
-        try:
-            fecha_venc = datetime.strptime(med['vencimiento'], '%Y-%m-%d')
-            dias = (fecha_venc - fecha_actual).days
+        if med.get('fecha_vencimiento_ts') is not None:
+            dias = (med['fecha_vencimiento_ts'] - ahora_ts) // SEGUNDOS_DIA
             if 0 < dias <= 30:
-                alertas['proximos_vencer'].append({'id': med['id'], 'nombre': med['nombre'], 'vencimiento': med['vencimiento'], 'dias_restantes': dias})
-        except:
-            pass
+                alertas['proximos_vencer'].append({'id': med['id'], 'nombre': med['nombre'], 'vencimiento': med['fecha_vencimiento'], 'dias_restantes': dias})
     
     return jsonify({
         'exito': True,
@@ -1386,6 +1786,7 @@ def obtener_alertas():
 # ==================== RAZAS ====================
 
 @app.route('/api/razas', methods=['GET'])
+@con_etag('razas.json', max_age=300)
 def obtener_razas():
     """Obtiene todas las razas de perros y gatos."""
     razas = cargar_razas()
@@ -1398,6 +1799,7 @@ def obtener_razas():
     })
 
 @app.route('/api/razas/<especie>', methods=['GET'])
+@con_etag('razas.json', max_age=300)
 def obtener_razas_por_especie(especie):
     """Obtiene razas filtradas por especie (perro/gato)."""
     razas = cargar_razas()
@@ -1582,6 +1984,7 @@ def buscar_medicamentos_disponibles():
 # ==================== ENDPOINTS GENERALES ====================
 
 @app.route('/diagnosticos', methods=['GET'])
+@con_etag('data_simulada.json', max_age=300)
 def listar_diagnosticos():
     diagnosticos = cargar_datos()
     return jsonify({
@@ -1590,6 +1993,7 @@ def listar_diagnosticos():
     })
 
 @app.route('/api/sintomas', methods=['GET'])
+@con_etag('diagnosticos_veterinarios.json', max_age=300)
 def obtener_sintomas():
     """Obtiene la lista de todos los síntomas disponibles en la base de datos."""
     diagnosticos = cargar_diagnosticos_completos()
@@ -1610,6 +2014,7 @@ def obtener_sintomas():
     })
 
 @app.route('/api/servicios', methods=['GET'])
+@con_etag('inventario.json')
 def obtener_servicios():
     """Obtiene la lista de servicios adicionales (exámenes, hospitalización, cirugías, etc.)."""
     inventario = cargar_inventario()
@@ -1955,6 +2360,7 @@ def obtener_diagnostico(diag_id):
     })
 
 @app.route('/sintomas', methods=['GET'])
+@con_etag('data_simulada.json', max_age=300)
 def listar_sintomas():
     diagnosticos = cargar_datos()
     sintomas_unicos = set()
@@ -2016,11 +2422,30 @@ def pacientes_endpoint():
     if request.method == 'POST':
         return crear_paciente_rapido()
     
+    try:
+        paginacion = leer_paginacion(request.args)
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     data = cargar_pacientes()
     pacientes = data.get('pacientes', [])
+    
+    if paginacion:
+        try:
+            pagina, siguiente = paginar(pacientes, clave_id, *paginacion)
+        except ValueError as e:
+            return jsonify({'exito': False, 'mensaje': str(e)}), 400
+        return jsonify({
+            'exito': True,
+            'pacientes': proyectar(pagina, campos),
+            'total': len(pacientes),
+            'siguiente_cursor': siguiente
+        })
+    
     return jsonify({
         'exito': True,
-        'pacientes': pacientes,
+        'pacientes': proyectar(pacientes, campos),
         'total': len(pacientes)
     })
 
@@ -2030,7 +2455,7 @@ def crear_paciente_rapido():
     data = cargar_pacientes()
     
     # Generar nuevo ID
-    nuevo_id = data.get('ultimo_id', 0) + 1
+    nuevo_id = secuencias.nuevo_id_paciente()
     
     # Calcular edad desde fecha de nacimiento
     fecha_nac = req_data.get('fecha_nacimiento', '')
@@ -2056,8 +2481,8 @@ def crear_paciente_rapido():
     }
     
     data['pacientes'].append(nuevo_paciente)
-    data['ultimo_id'] = nuevo_id
-    guardar_pacientes(data)
+    data['ultimo_id'] = max(data.get('ultimo_id', 0), nuevo_id)
+    guardar_pacientes(data, modificados={nuevo_id})
     
     return jsonify({
         'exito': True,
@@ -2107,6 +2532,11 @@ def buscar_pacientes():
 @app.route('/api/pacientes/<int:paciente_id>', methods=['GET'])
 def obtener_paciente(paciente_id):
     """Obtiene la ficha completa de un paciente."""
+    try:
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     data = cargar_pacientes()
     paciente = next((p for p in data['pacientes'] if p['id'] == paciente_id), None)
     
@@ -2132,11 +2562,11 @@ def obtener_paciente(paciente_id):
                     'peso_registrado': consulta.get('peso_paciente', '')
                 })
         
-        return jsonify({
+        return con_version(jsonify({
             'exito': True,
-            'paciente': paciente,
+            'paciente': proyectar(paciente, campos),
             'historial_detallado': historial
-        })
+        }), paciente)
     
     return jsonify({'exito': False, 'mensaje': 'Paciente no encontrado'}), 404
 
@@ -2147,7 +2577,7 @@ def crear_paciente():
     data = cargar_pacientes()
     
     # Generar nuevo ID
-    nuevo_id = data.get('ultimo_id', 0) + 1
+    nuevo_id = secuencias.nuevo_id_paciente()
     
     # Calcular edad desde fecha de nacimiento
     fecha_nac = req_data.get('fecha_nacimiento', '')
@@ -2193,8 +2623,8 @@ def crear_paciente():
     }
     
     data['pacientes'].append(nuevo_paciente)
-    data['ultimo_id'] = nuevo_id
-    guardar_pacientes(data)
+    data['ultimo_id'] = max(data.get('ultimo_id', 0), nuevo_id)
+    guardar_pacientes(data, modificados={nuevo_id})
     
     return jsonify({
         'exito': True,
@@ -2210,6 +2640,8 @@ def actualizar_paciente(paciente_id):
     
     for i, p in enumerate(data['pacientes']):
         if p['id'] == paciente_id:
+            versiones.verificar_version(p, version_esperada(req_data))
+            
             # Actualizar campos
             if 'nombre' in req_data: p['nombre'] = req_data['nombre']
             if 'especie' in req_data: p['especie'] = req_data['especie']
@@ -2234,7 +2666,7 @@ def actualizar_paciente(paciente_id):
                 if 'propietario_email' in req_data: p['propietario']['email'] = req_data['propietario_email']
                 if 'propietario_direccion' in req_data: p['propietario']['direccion'] = req_data['propietario_direccion']
             
-            guardar_pacientes(data)
+            guardar_pacientes(data, modificados={paciente_id})
             return jsonify({'exito': True, 'mensaje': 'Paciente actualizado', 'paciente': p})
     
     return jsonify({'exito': False, 'mensaje': 'Paciente no encontrado'}), 404
@@ -2253,7 +2685,7 @@ def agregar_consulta_paciente(paciente_id):
                 if 'historial_consultas' not in p:
                     p['historial_consultas'] = []
                 p['historial_consultas'].append(consulta_id)
-                guardar_pacientes(data)
+                guardar_pacientes(data, modificados={paciente_id})
             return jsonify({'exito': True, 'mensaje': 'Consulta agregada al historial'})
     
     return jsonify({'exito': False, 'mensaje': 'Paciente no encontrado'}), 404
@@ -2272,6 +2704,8 @@ def actualizar_peso_paciente(paciente_id):
     
     for p in data['pacientes']:
         if p['id'] == paciente_id:
+            versiones.verificar_version(p, version_esperada(req_data))
+            
             # Actualizar peso actual
             p['peso'] = nuevo_peso
             
@@ -2285,7 +2719,7 @@ def actualizar_peso_paciente(paciente_id):
                 'registrado_por': registrado_por
             })
             
-            guardar_pacientes(data)
+            guardar_pacientes(data, modificados={paciente_id})
             
             return jsonify({
                 'exito': True,
@@ -2316,14 +2750,33 @@ def obtener_historial_peso(paciente_id):
 # ENDPOINTS DE ADMINISTRACION DE INVENTARIO
 # ============================================
 
+@app.route('/api/admin/reservas', methods=['GET'])
+def obtener_reservas_stock():
+    """Stock reservado por recetas aún no cobradas, por producto."""
+    inventario = cargar_inventario()
+    por_id = {p['id']: p for p in inventario.get('medicamentos', [])}
+    
+    resultado = []
+    for producto_id, reserva in sorted(reservas.reservado_por_producto().items()):
+        producto = por_id.get(producto_id, {})
+        stock = producto.get('stock', 0)
+        resultado.append({
+            'producto_id': producto_id,
+            'nombre': producto.get('nombre', ''),
+            'stock': stock,
+            'reservado': reserva['total'],
+            'disponible': max(0, stock - reserva['total']),
+            'consultas': reserva['consultas']
+        })
+    
+    return jsonify({'exito': True, 'reservas': resultado, 'total': len(resultado)})
+
 @app.route('/api/admin/alertas-stock', methods=['GET'])
 def obtener_alertas_stock():
     """Obtiene alertas de stock bajo, agotado y por vencer."""
-    from datetime import datetime, timedelta
-    
     inventario = cargar_inventario()
     productos = inventario.get('medicamentos', [])
-    hoy = datetime.now()
+    ahora_ts = epoch_ahora()
     
     alertas = {
         'agotados': [],
@@ -2381,35 +2834,31 @@ def obtener_alertas_stock():
         # Verificar vencimiento (solo productos fisicos)
         if categoria not in CATEGORIAS_SERVICIOS:
             fecha_venc_str = prod.get('fecha_vencimiento')
-            if fecha_venc_str:
-                try:
-                    fecha_venc = datetime.strptime(fecha_venc_str, '%Y-%m-%d')
-                    dias_para_vencer = (fecha_venc - hoy).days
-                    
-                    if dias_para_vencer < 0:
-                        alertas['vencidos'].append({
-                            'id': prod['id'],
-                            'nombre': prod['nombre'],
-                            'categoria': categoria,
-                            'fecha_vencimiento': fecha_venc_str,
-                            'dias_vencido': abs(dias_para_vencer),
-                            'stock': stock,
-                            'lote': prod.get('lote', 'N/A')
-                        })
-                        alertas['resumen']['vencidos'] += 1
-                    elif dias_para_vencer <= 60:
-                        alertas['por_vencer'].append({
-                            'id': prod['id'],
-                            'nombre': prod['nombre'],
-                            'categoria': categoria,
-                            'fecha_vencimiento': fecha_venc_str,
-                            'dias_para_vencer': dias_para_vencer,
-                            'stock': stock,
-                            'lote': prod.get('lote', 'N/A')
-                        })
-                        alertas['resumen']['por_vencer'] += 1
-                except:
-                    pass
+            if prod.get('fecha_vencimiento_ts') is not None:
+                dias_para_vencer = (prod['fecha_vencimiento_ts'] - ahora_ts) // SEGUNDOS_DIA
+                
+                if dias_para_vencer < 0:
+                    alertas['vencidos'].append({
+                        'id': prod['id'],
+                        'nombre': prod['nombre'],
+                        'categoria': categoria,
+                        'fecha_vencimiento': fecha_venc_str,
+                        'dias_vencido': abs(dias_para_vencer),
+                        'stock': stock,
+                        'lote': prod.get('lote', 'N/A')
+                    })
+                    alertas['resumen']['vencidos'] += 1
+                elif dias_para_vencer <= 60:
+                    alertas['por_vencer'].append({
+                        'id': prod['id'],
+                        'nombre': prod['nombre'],
+                        'categoria': categoria,
+                        'fecha_vencimiento': fecha_venc_str,
+                        'dias_para_vencer': dias_para_vencer,
+                        'stock': stock,
+                        'lote': prod.get('lote', 'N/A')
+                    })
+                    alertas['resumen']['por_vencer'] += 1
     
     # Ordenar
     alertas['por_vencer'].sort(key=lambda x: x['dias_para_vencer'])
@@ -2424,6 +2873,12 @@ def obtener_alertas_stock():
 @app.route('/api/admin/productos', methods=['GET'])
 def listar_productos_admin():
     """Lista todos los productos con filtros para administracion."""
+    try:
+        paginacion = leer_paginacion(request.args)
+        campos = leer_campos(request.args)
+    except ValueError as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 400
+    
     inventario = cargar_inventario()
     productos = inventario.get('medicamentos', [])
     
@@ -2457,9 +2912,21 @@ def listar_productos_admin():
         
         resultados.append(prod)
     
+    if paginacion:
+        try:
+            pagina, siguiente = paginar(resultados, clave_id, *paginacion)
+        except ValueError as e:
+            return jsonify({'exito': False, 'mensaje': str(e)}), 400
+        return jsonify({
+            'exito': True,
+            'productos': proyectar(pagina, campos),
+            'total': len(resultados),
+            'siguiente_cursor': siguiente
+        })
+    
     return jsonify({
         'exito': True,
-        'productos': resultados,
+        'productos': proyectar(resultados, campos),
         'total': len(resultados)
     })
 
@@ -2497,11 +2964,17 @@ def gestionar_producto(producto_id):
         return jsonify({'exito': False, 'mensaje': 'Producto no encontrado'}), 404
     
     if request.method == 'GET':
-        return jsonify({'exito': True, 'producto': productos[producto_idx]})
+        try:
+            campos = leer_campos(request.args)
+        except ValueError as e:
+            return jsonify({'exito': False, 'mensaje': str(e)}), 400
+        return con_version(jsonify({'exito': True, 'producto': proyectar(productos[producto_idx], campos)}),
+                           productos[producto_idx])
     
     # PUT - Actualizar producto
     datos = request.get_json()
     producto = productos[producto_idx]
+    versiones.verificar_version(producto, version_esperada(datos))
     
     # Campos actualizables
     campos_permitidos = ['nombre', 'precio_unitario', 'stock', 'stock_minimo', 
@@ -2512,8 +2985,14 @@ def gestionar_producto(producto_id):
         if campo in datos:
             producto[campo] = datos[campo]
     
+    if 'fecha_vencimiento' in datos:
+        try:
+            sellar(producto, 'fecha_vencimiento')
+        except ValueError:
+            return jsonify({'exito': False, 'mensaje': 'Fecha de vencimiento inválida (use YYYY-MM-DD)'}), 400
+    
     # Guardar
-    guardar_inventario(inventario)
+    guardar_inventario(inventario, modificados={producto_id})
     
     return jsonify({
         'exito': True,
@@ -2534,8 +3013,8 @@ def crear_producto():
     inventario = cargar_inventario()
     productos = inventario.get('medicamentos', [])
     
-    # Generar nuevo ID
-    nuevo_id = max((p['id'] for p in productos), default=0) + 1
+    # Generar nuevo ID (ver secuencias.py)
+    nuevo_id = secuencias.nuevo_id_producto()
     
     nuevo_producto = {
         'id': nuevo_id,
@@ -2554,8 +3033,13 @@ def crear_producto():
         'fecha_vencimiento': datos.get('fecha_vencimiento', '')
     }
     
+    try:
+        sellar(nuevo_producto, 'fecha_vencimiento')
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fecha de vencimiento inválida (use YYYY-MM-DD)'}), 400
+    
     productos.append(nuevo_producto)
-    guardar_inventario(inventario)
+    guardar_inventario(inventario, modificados={nuevo_id})
     
     return jsonify({
         'exito': True,
@@ -2591,43 +3075,191 @@ def ingresar_stock():
     lote = datos.get('lote', '')
     fecha_vencimiento = datos.get('fecha_vencimiento', '')
     
-    if not producto_id or cantidad <= 0:
+    if type(producto_id) is not int or type(cantidad) is not int or cantidad <= 0:
         return jsonify({'exito': False, 'mensaje': 'ID de producto y cantidad requeridos'}), 400
+    version = version_esperada(datos)
     
-    inventario = cargar_inventario()
-    productos = inventario.get('medicamentos', [])
+    try:
+        fecha_vencimiento_ts = a_epoch(fecha_vencimiento) if fecha_vencimiento else None
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fecha de vencimiento inválida (use YYYY-MM-DD)'}), 400
+    
+    # Cambio relativo: se aplica sobre el stock en disco, bajo su bloqueo
+    resultado = {}
+    def aplicar(producto):
+        versiones.verificar_version(producto, version)
+        resultado['stock_anterior'] = producto.get('stock', 0)
+        producto['stock'] = resultado['stock_anterior'] + cantidad
+        
+        # Actualizar lote y vencimiento si se proporcionan
+        if lote:
+            producto['lote'] = lote
+        if fecha_vencimiento:
+            producto['fecha_vencimiento'] = fecha_vencimiento
+            producto['fecha_vencimiento_ts'] = fecha_vencimiento_ts
+        resultado['producto'] = producto
+    
+    inventario = versiones.actualizar_registros('inventario.json', 'medicamentos', {producto_id: aplicar})
+    instantanea.actualizar('inventario.json', inventario)
+    
+    if not resultado:
+        return jsonify({'exito': False, 'mensaje': 'Producto no encontrado'}), 404
+    producto = resultado['producto']
     
-    producto_idx = next((i for i, p in enumerate(productos) if p['id'] == producto_id), None)
+    return jsonify({
+        'exito': True,
+        'mensaje': f"Stock actualizado: {resultado['stock_anterior']} -> {producto['stock']}",
+        'producto': producto
+    })
+
+# Máximo de líneas por ingreso masivo
+MAX_LINEAS_INGRESO = 1000
+
+def validar_linea_ingreso(linea, por_id, por_codigo):
+    """
+    Valida una línea de ingreso masivo y devuelve el producto y los datos a
+    aplicar; ValueError con el motivo si la línea no es válida.
+    """
+    if not isinstance(linea, dict):
+        raise ValueError('La línea debe ser un objeto')
     
-    if producto_idx is None:
-        return jsonify({'exito': False, 'mensaje': 'Producto no encontrado'}), 404
+    if linea.get('producto_id') is not None:
+        producto = por_id.get(linea['producto_id'])
+    elif linea.get('codigo_barras'):
+        producto = por_codigo.get(str(linea['codigo_barras']))
+    else:
+        raise ValueError('Indique producto_id o codigo_barras')
+    if producto is None:
+        raise ValueError('Producto no encontrado')
     
-    producto = productos[producto_idx]
-    stock_anterior = producto.get('stock', 0)
+    cantidad = linea.get('cantidad')
+    if not isinstance(cantidad, int) or isinstance(cantidad, bool) or cantidad <= 0:
+        raise ValueError('La cantidad debe ser un entero mayor a 0')
+    
+    fecha_vencimiento = linea.get('fecha_vencimiento') or ''
+    try:
+        fecha_vencimiento_ts = a_epoch(fecha_vencimiento) if fecha_vencimiento else None
+    except ValueError:
+        raise ValueError('Fecha de vencimiento inválida (use YYYY-MM-DD)')
+    
+    return producto, cantidad, str(linea.get('lote') or ''), fecha_vencimiento, fecha_vencimiento_ts
+
+@app.route('/api/admin/ingreso-stock/lote', methods=['POST'])
+def ingresar_stock_lote():
+    """
+    Ingreso masivo de stock (por ejemplo una factura de proveedor).
+    
+    Valida todas las líneas y, si no hay errores, las aplica con una sola
+    escritura de inventario.json y de movimientos_stock.json. Con
+    "parcial": true se aplican las líneas válidas y se informan las demás.
+    Los incrementos se suman al stock que hay en disco al escribir (bajo su
+    bloqueo), así no se pierde una venta hecha mientras tanto.
+    """
+    datos = request.get_json(silent=True) or {}
+    lineas = datos.get('lineas')
+    parcial = bool(datos.get('parcial', False))
+    
+    if not isinstance(lineas, list) or not lineas:
+        return jsonify({'exito': False, 'mensaje': 'Debe enviar una lista de lineas'}), 400
+    if len(lineas) > MAX_LINEAS_INGRESO:
+        return jsonify({'exito': False, 'mensaje': f'Máximo {MAX_LINEAS_INGRESO} líneas por ingreso'}), 400
+    
+    inventario = cargar_inventario()
+    productos = inventario.get('medicamentos', [])
+    por_id = {p['id']: p for p in productos}
+    por_codigo = {str(p['codigo_barras']): p for p in productos if p.get('codigo_barras')}
     
-    # Actualizar stock
-    producto['stock'] = stock_anterior + cantidad
+    validas = []
+    errores = []
+    for numero, linea in enumerate(lineas, start=1):
+        try:
+            validas.append((numero, *validar_linea_ingreso(linea, por_id, por_codigo)))
+        except ValueError as e:
+            errores.append({'linea': numero, 'mensaje': str(e)})
+    
+    if errores and not parcial:
+        return jsonify({
+            'exito': False,
+            'mensaje': f'{len(errores)} línea(s) con errores, no se aplicó ningún ingreso',
+            'errores': errores
+        }), 400
+    
+    # Líneas agrupadas por producto: cada grupo se aplica sobre el registro en disco
+    por_producto = {}
+    for valida in validas:
+        por_producto.setdefault(valida[1]['id'], []).append(valida)
+    
+    aplicadas = {}   # número de línea -> (producto escrito, stock_anterior)
+    def ingresar(lineas_producto):
+        def aplicar(producto):
+            for numero, _, cantidad, lote, fecha_vencimiento, fecha_vencimiento_ts in lineas_producto:
+                aplicadas[numero] = (producto, producto.get('stock', 0))
+                producto['stock'] = producto.get('stock', 0) + cantidad
+                if lote:
+                    producto['lote'] = lote
+                if fecha_vencimiento:
+                    producto['fecha_vencimiento'] = fecha_vencimiento
+                    producto['fecha_vencimiento_ts'] = fecha_vencimiento_ts
+        return aplicar
+    
+    if validas:
+        inventario = versiones.actualizar_registros(
+            'inventario.json', 'medicamentos',
+            {producto_id: ingresar(grupo) for producto_id, grupo in por_producto.items()}
+        )
+        instantanea.actualizar('inventario.json', inventario)
     
-    # Actualizar lote y vencimiento si se proporcionan
-    if lote:
-        producto['lote'] = lote
-    if fecha_vencimiento:
-        producto['fecha_vencimiento'] = fecha_vencimiento
+    ahora = datetime.now().isoformat()
+    movimientos = []
+    resultados = []
+    for numero, _, cantidad, lote, fecha_vencimiento, fecha_vencimiento_ts in validas:
+        if numero not in aplicadas:
+            # El producto se eliminó entre la validación y la escritura
+            errores.append({'linea': numero, 'mensaje': 'Producto no encontrado'})
+            continue
+        producto, stock_anterior = aplicadas[numero]
+        stock_nuevo = stock_anterior + cantidad
+        
+        movimiento = {
+            'id': None,   # Lo asigna agregar_movimientos()
+            'fecha': ahora,
+            'tipo': 'ingreso',
+            'producto_id': producto['id'],
+            'producto_nombre': producto.get('nombre', ''),
+            'categoria': producto.get('categoria', ''),
+            'cantidad': cantidad,
+            'stock_anterior': stock_anterior,
+            'stock_nuevo': stock_nuevo,
+            'lote': lote,
+            'fecha_vencimiento': fecha_vencimiento,
+            'proveedor': datos.get('proveedor', ''),
+            'documento': datos.get('documento', ''),
+            'usuario': datos.get('usuario', 'sistema'),
+            'observacion': datos.get('observacion', '')
+        }
+        sellar(movimiento, 'fecha')
+        movimiento['fecha_vencimiento_ts'] = fecha_vencimiento_ts
+        movimientos.append(movimiento)
+        
+        resultados.append({
+            'linea': numero,
+            'producto_id': producto['id'],
+            'nombre': producto.get('nombre', ''),
+            'stock_anterior': stock_anterior,
+            'stock_nuevo': stock_nuevo
+        })
     
-    guardar_inventario(inventario)
+    if movimientos:
+        agregar_movimientos(movimientos)
     
     return jsonify({
         'exito': True,
-        'mensaje': f'Stock actualizado: {stock_anterior} -> {producto["stock"]}',
-        'producto': producto
+        'mensaje': f'{len(resultados)} línea(s) ingresadas' + (f', {len(errores)} con errores' if errores else ''),
+        'aplicadas': len(resultados),
+        'resultados': resultados,
+        'errores': errores
     })
 
-def guardar_inventario(inventario):
-    """Guarda el inventario en el archivo JSON."""
-    ruta_archivo = os.path.join(os.path.dirname(__file__), 'inventario.json')
-    with open(ruta_archivo, 'w', encoding='utf-8') as f:
-        json.dump(inventario, f, ensure_ascii=False, indent=2)
-
 # ============================================
 # RUTAS DEL FRONTEND (Servir archivos HTML)
 # ============================================
@@ -2635,42 +3267,42 @@ def guardar_inventario(inventario):
 @app.route('/')
 def serve_home():
     """Página principal - muestra el login."""
-    return send_from_directory(FRONTEND_FOLDER, 'login.html')
+    return enviar_pagina('login.html')
 
 @app.route('/login')
 @app.route('/login.html')
 def serve_login():
     """Página de login."""
-    return send_from_directory(FRONTEND_FOLDER, 'login.html')
+    return enviar_pagina('login.html')
 
 @app.route('/index.html')
 def serve_index():
     """Panel del veterinario."""
-    return send_from_directory(FRONTEND_FOLDER, 'index.html')
+    return enviar_pagina('index.html')
 
 @app.route('/recepcion')
 @app.route('/recepcion.html')
 def serve_recepcion():
     """Panel de recepción."""
-    return send_from_directory(FRONTEND_FOLDER, 'recepcion.html')
+    return enviar_pagina('recepcion.html')
 
 @app.route('/inventario')
 @app.route('/inventario.html')
 def serve_inventario():
     """Panel de inventario."""
-    return send_from_directory(FRONTEND_FOLDER, 'inventario.html')
+    return enviar_pagina('inventario.html')
 
 @app.route('/superadmin')
 @app.route('/superadmin.html')
 def serve_superadmin():
     """Panel de superadmin."""
-    return send_from_directory(FRONTEND_FOLDER, 'superadmin.html')
+    return enviar_pagina('superadmin.html')
 
 @app.route('/landing')
 @app.route('/landing.html')
 def serve_landing_page():
     """Página de landing."""
-    return send_from_directory(FRONTEND_FOLDER, 'landing.html')
+    return enviar_pagina('landing.html')
 
 # ============================================
 # RUTA DE LA API (información del sistema)
@@ -2687,11 +3319,15 @@ def api_info():
         'endpoints': {
             'autenticacion': ['/api/login', '/api/logout', '/api/session'],
             'pacientes': ['/api/pacientes', '/api/pacientes/buscar', '/api/pacientes/nuevo', '/api/pacientes/<id>'],
-            'consultas': ['/api/consultas', '/api/consultas/pendientes', '/api/consultas/por-cobrar', '/api/consultas/nueva', '/api/consultas/<id>/diagnostico', '/api/consultas/<id>/receta', '/api/consultas/<id>/boleta'],
+            'consultas': ['/api/consultas', '/api/consultas/pendientes', '/api/consultas/por-cobrar', '/api/consultas/nueva', '/api/consultas/<id>/diagnostico', '/api/consultas/<id>/receta', '/api/consultas/<id>/boleta', '/api/consultas/stream'],
             'diagnostico': ['/diagnosticar', '/diagnosticos', '/sintomas', '/api/sintomas/buscar'],
             'inventario': ['/api/inventario', '/api/inventario/alertas', '/api/inventario/agregar', '/api/inventario/<id>/actualizar-stock'],
             'medicamentos': ['/api/medicamentos/por-diagnostico/<nombre>', '/api/medicamentos/buscar-disponibles'],
             'razas': ['/api/razas', '/api/razas/<especie>', '/api/razas/buscar', '/api/razas/<especie>/<id>'],
+            'analitica': ['/api/analytics/consultas', '/api/analytics/ingresos'],
+            'sincronizacion': ['/api/changes'],
+            'lote': ['/api/batch'],
+            'sistema': ['/api/ready', '/api/scheduler/estado', '/api/trabajos'],
             'bot': ['/api/bot/estado', '/api/bot/inventario', '/api/bot/diagnostico', '/api/bot/agendar-cita']
         },
         'estadisticas': {
@@ -2705,20 +3341,33 @@ def api_info():
 
 # ================== MOVIMIENTOS DE STOCK ==================
 
+@instantanea.memorizar('movimientos_stock.json')
 def cargar_movimientos():
     """Carga los movimientos de stock."""
     ruta = os.path.join(os.path.dirname(__file__), 'movimientos_stock.json')
     try:
-        with open(ruta, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(ruta, 'rb') as f:
+            return json_rapido.load(f)
     except FileNotFoundError:
         return {'movimientos': [], 'ultimo_id': 0}
 
-def guardar_movimientos(data):
-    """Guarda los movimientos de stock."""
-    ruta = os.path.join(os.path.dirname(__file__), 'movimientos_stock.json')
-    with open(ruta, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def agregar_movimientos(nuevos):
+    """
+    Agrega movimientos de stock asignándoles id (registrando el cambio en el diario).
+
+    Se lee, agrega y escribe bajo el bloqueo del archivo, así dos ingresos
+    simultáneos no pierden movimientos ni repiten ids.
+    """
+    with bloqueo('movimientos_stock.json'):
+        anterior = leer_json('movimientos_stock.json', default={'movimientos': [], 'ultimo_id': 0})
+        ultimo_id = anterior.get('ultimo_id', 0)
+        for movimiento in nuevos:
+            ultimo_id += 1
+            movimiento['id'] = ultimo_id
+        data = dict(anterior, movimientos=anterior.get('movimientos', []) + list(nuevos), ultimo_id=ultimo_id)
+        escribir_json('movimientos_stock.json', data)
+        diario.registrar_diferencias('movimientos_stock.json', 'movimientos', anterior, data)
+    instantanea.actualizar('movimientos_stock.json', data)
 
 
 @app.route('/api/admin/movimientos', methods=['GET'])
@@ -2734,22 +3383,29 @@ def obtener_movimientos():
     producto = request.args.get('producto', '')
     limite = request.args.get('limite', 50, type=int)
     
+    try:
+        desde_ts = a_epoch(fecha_desde) if fecha_desde else None
+        # 'hasta' es una fecha inclusive: se compara contra el inicio del día siguiente
+        hasta_ts = a_epoch(fecha_hasta[:10]) + SEGUNDOS_DIA if fecha_hasta else None
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fechas inválidas, use YYYY-MM-DD'}), 400
+    
     # Aplicar filtros
     if tipo:
         movimientos = [m for m in movimientos if m.get('tipo') == tipo]
     
-    if fecha_desde:
-        movimientos = [m for m in movimientos if m.get('fecha', '') >= fecha_desde]
+    if desde_ts is not None:
+        movimientos = [m for m in movimientos if (m.get('fecha_ts') or 0) >= desde_ts]
     
-    if fecha_hasta:
-        movimientos = [m for m in movimientos if m.get('fecha', '')[:10] <= fecha_hasta]
+    if hasta_ts is not None:
+        movimientos = [m for m in movimientos if (m.get('fecha_ts') or 0) < hasta_ts]
     
     if producto:
         producto_lower = producto.lower()
         movimientos = [m for m in movimientos if producto_lower in m.get('producto_nombre', '').lower()]
     
     # Ordenar por fecha descendente
-    movimientos = sorted(movimientos, key=lambda x: x.get('fecha', ''), reverse=True)
+    movimientos = sorted(movimientos, key=lambda x: x.get('fecha_ts') or 0, reverse=True)
     
     # Limitar resultados
     movimientos = movimientos[:limite]
@@ -2773,15 +3429,10 @@ def obtener_movimientos():
 @app.route('/api/admin/movimiento', methods=['POST'])
 def registrar_movimiento():
     """Registra un nuevo movimiento de stock."""
-    from datetime import datetime
-    
     datos = request.get_json()
-    movimientos_data = cargar_movimientos()
-    
-    nuevo_id = movimientos_data.get('ultimo_id', 0) + 1
     
     movimiento = {
-        'id': nuevo_id,
+        'id': None,   # Lo asigna agregar_movimientos()
         'fecha': datetime.now().isoformat(),
         'tipo': datos.get('tipo', 'ingreso'),
         'producto_id': datos.get('producto_id'),
@@ -2804,10 +3455,13 @@ def registrar_movimiento():
         movimiento['paciente'] = datos.get('paciente', '')
         movimiento['veterinario'] = datos.get('veterinario', '')
     
-    movimientos_data['movimientos'].append(movimiento)
-    movimientos_data['ultimo_id'] = nuevo_id
+    try:
+        sellar(movimiento, 'fecha')
+        sellar(movimiento, 'fecha_vencimiento')
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fecha de vencimiento inválida (use YYYY-MM-DD)'}), 400
     
-    guardar_movimientos(movimientos_data)
+    agregar_movimientos([movimiento])
     
     return jsonify({
         'exito': True,
@@ -2816,9 +3470,47 @@ def registrar_movimiento():
     })
 
 
-# ==================== SISTEMA DE BACKUP AUTOMÁTICO ====================
+# ==================== EXPORTACIÓN ====================
+
+@app.route('/api/exportar/<coleccion>', methods=['GET'])
+def exportar_coleccion(coleccion):
+    """
+    Descarga consultas, inventario o movimientos en NDJSON o CSV.
+    
+    Parámetros: formato=ndjson|csv (default ndjson), desde/hasta=YYYY-MM-DD
+    (consultas por fecha de registro, movimientos por fecha).
+    La respuesta se genera registro a registro (ver exportacion.py).
+    """
+    if coleccion not in exportacion.EXPORTACIONES:
+        return jsonify({'exito': False, 'mensaje': f'Colección no exportable: {coleccion}'}), 404
+    
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in exportacion.FORMATOS:
+        return jsonify({'exito': False, 'mensaje': 'Formato inválido, use ndjson o csv'}), 400
+    
+    fecha_desde = request.args.get('desde', '')
+    fecha_hasta = request.args.get('hasta', '')
+    try:
+        desde_ts = a_epoch(fecha_desde) if fecha_desde else None
+        hasta_ts = a_epoch(fecha_hasta[:10]) + SEGUNDOS_DIA if fecha_hasta else None
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fechas inválidas, use YYYY-MM-DD'}), 400
+    
+    mimetype, extension = exportacion.FORMATOS[formato]
+    nombre = f"{coleccion}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.{extension}"
+    print(f"[EXPORTACION] ⬇️ {coleccion} ({formato})")
+    
+    return Response(
+        exportacion.exportar(coleccion, formato, desde_ts, hasta_ts),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={nombre}',
+            'Cache-Control': 'no-store'
+        }
+    )
 
-BACKUP_FOLDER = os.path.join(os.path.dirname(__file__), 'backups')
+
+# ==================== SISTEMA DE BACKUP AUTOMÁTICO ====================
 
 # Archivos a incluir en el backup
 ARCHIVOS_BACKUP = [
@@ -2832,150 +3524,221 @@ ARCHIVOS_BACKUP = [
     'users.json'
 ]
 
-def crear_backup():
-    """Crea una copia de seguridad de todos los archivos JSON"""
+def crear_backup(origen='manual'):
+    """Crea un backup incremental: solo se guardan los archivos que cambiaron (ver respaldos.py)"""
     try:
-        # Crear carpeta de backups si no existe
-        if not os.path.exists(BACKUP_FOLDER):
-            os.makedirs(BACKUP_FOLDER)
-        
-        # Nombre del archivo con fecha y hora
-        fecha_hora = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        nombre_backup = f'backup_{fecha_hora}.zip'
-        ruta_backup = os.path.join(BACKUP_FOLDER, nombre_backup)
+        manifiesto = respaldos.crear(ARCHIVOS_BACKUP, origen)
         
-        # Crear archivo ZIP
-        with zipfile.ZipFile(ruta_backup, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for archivo in ARCHIVOS_BACKUP:
-                ruta_archivo = os.path.join(os.path.dirname(__file__), archivo)
-                if os.path.exists(ruta_archivo):
-                    zipf.write(ruta_archivo, archivo)
+        # Limpiar backups fuera del periodo de retención y objetos sin uso
+        respaldos.limpiar()
         
-        # Limpiar backups antiguos (mantener solo los últimos 7)
-        limpiar_backups_antiguos()
-        
-        print(f"[BACKUP] ✅ Copia de seguridad creada: {nombre_backup}")
-        return nombre_backup
+        print(f"[BACKUP] ✅ Copia de seguridad creada: {manifiesto['nombre']} "
+              f"({manifiesto['nuevos']} archivo(s) nuevo(s), {respaldos.formatear_tamano(manifiesto['bytes_nuevos'])})")
+        return manifiesto['nombre']
     except Exception as e:
         print(f"[BACKUP] ❌ Error al crear backup: {str(e)}")
         return None
 
-def limpiar_backups_antiguos(mantener=7):
-    """Elimina backups antiguos, manteniendo solo los más recientes"""
-    try:
-        if not os.path.exists(BACKUP_FOLDER):
-            return
-        
-        backups = sorted([
-            f for f in os.listdir(BACKUP_FOLDER) 
-            if f.startswith('backup_') and f.endswith('.zip')
-        ], reverse=True)
-        
-        # Eliminar los más antiguos
-        for backup_antiguo in backups[mantener:]:
-            os.remove(os.path.join(BACKUP_FOLDER, backup_antiguo))
-            print(f"[BACKUP] 🗑️ Backup antiguo eliminado: {backup_antiguo}")
-    except Exception as e:
-        print(f"[BACKUP] ❌ Error al limpiar backups: {str(e)}")
-
-def obtener_lista_backups():
-    """Obtiene la lista de backups disponibles"""
-    if not os.path.exists(BACKUP_FOLDER):
-        return []
-    
-    backups = []
-    for f in sorted(os.listdir(BACKUP_FOLDER), reverse=True):
-        if f.startswith('backup_') and f.endswith('.zip'):
-            ruta = os.path.join(BACKUP_FOLDER, f)
-            tamaño = os.path.getsize(ruta)
-            backups.append({
-                'nombre': f,
-                'fecha': f.replace('backup_', '').replace('.zip', '').replace('_', ' '),
-                'tamaño': f"{tamaño / 1024:.1f} KB"
-            })
-    return backups
+def tarea_crear_backup(parametros):
+    """Trabajo 'crear_backup' (ver trabajos.py); falla para que se reintente."""
+    nombre = crear_backup(parametros.get('origen', 'manual'))
+    if not nombre:
+        raise RuntimeError('No se pudo crear el backup')
+    return {'archivo': nombre}
 
-# Endpoint para crear backup manual
+trabajos.registrar('crear_backup', tarea_crear_backup)
+
+# Endpoint para crear backup manual (se ejecuta en segundo plano)
 @app.route('/api/backup/crear', methods=['POST'])
 def api_crear_backup():
-    nombre = crear_backup()
-    if nombre:
-        return jsonify({'exito': True, 'mensaje': 'Backup creado correctamente', 'archivo': nombre})
-    return jsonify({'exito': False, 'mensaje': 'Error al crear el backup'}), 500
+    trabajo_id = trabajos.encolar('crear_backup', {'origen': 'manual'})
+    return jsonify({
+        'exito': True,
+        'mensaje': 'Backup en cola',
+        'trabajo_id': trabajo_id,
+        'estado': 'pendiente'
+    }), 202
 
 # Endpoint para listar backups
 @app.route('/api/backup/lista', methods=['GET'])
 def api_listar_backups():
-    backups = obtener_lista_backups()
-    return jsonify({'exito': True, 'backups': backups})
+    backups = respaldos.listar()
+    return jsonify({
+        'exito': True,
+        'backups': backups,
+        'almacenamiento': respaldos.uso_disco(),
+        'retencion_dias': respaldos.DIAS_RETENCION
+    })
 
 # Endpoint para descargar un backup específico
 @app.route('/api/backup/descargar/<nombre>', methods=['GET'])
 def api_descargar_backup(nombre):
     try:
-        ruta = os.path.join(BACKUP_FOLDER, nombre)
-        if os.path.exists(ruta) and nombre.startswith('backup_') and nombre.endswith('.zip'):
+        ruta = respaldos.ruta_zip_legado(nombre)
+        if ruta:
             return send_file(ruta, as_attachment=True, download_name=nombre)
-        return jsonify({'exito': False, 'mensaje': 'Backup no encontrado'}), 404
+        
+        # Los backups incrementales se arman como ZIP mientras se envían
+        contenido = respaldos.zip_backup(nombre)
+        if contenido is None:
+            return jsonify({'exito': False, 'mensaje': 'Backup no encontrado'}), 404
+        return respuesta_zip(contenido, f'{nombre}.zip')
     except Exception as e:
         return jsonify({'exito': False, 'mensaje': str(e)}), 500
 
 # Endpoint para descargar backup instantáneo (sin guardar en servidor)
 @app.route('/api/backup/descargar-ahora', methods=['GET'])
 def api_descargar_backup_instantaneo():
-    """Genera y descarga un backup sin guardarlo en el servidor"""
-    try:
-        # Crear ZIP en memoria
-        memoria_zip = io.BytesIO()
-        with zipfile.ZipFile(memoria_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for archivo in ARCHIVOS_BACKUP:
-                ruta_archivo = os.path.join(os.path.dirname(__file__), archivo)
-                if os.path.exists(ruta_archivo):
-                    zipf.write(ruta_archivo, archivo)
-        
-        memoria_zip.seek(0)
-        fecha_hora = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        nombre = f'backup_artemisa_{fecha_hora}.zip'
-        
-        return send_file(
-            memoria_zip,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=nombre
-        )
-    except Exception as e:
-        return jsonify({'exito': False, 'mensaje': str(e)}), 500
+    """Genera y descarga un backup sin guardarlo en el servidor (comprimido mientras se envía)"""
+    fecha_hora = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    return respuesta_zip(respaldos.zip_actual(ARCHIVOS_BACKUP), f'backup_artemisa_{fecha_hora}.zip')
+
+def respuesta_zip(contenido, nombre):
+    """Respuesta en streaming para un ZIP generado por partes (ver respaldos.py)."""
+    return Response(
+        contenido,
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename={nombre}',
+            'Cache-Control': 'no-store'
+        }
+    )
+
+def restaurar_archivo(archivo, data):
+    """Reemplaza un archivo de datos con contenido restaurado."""
+    if archivo in versiones.ARCHIVOS_VERSIONADOS:
+        # Versionar contra el estado actual para que los clientes
+        # sincronizados reciban lo restaurado como cambios
+        versiones.guardar_versionado(archivo, data, versiones.ARCHIVOS_VERSIONADOS[archivo])
+    elif archivo in diario.ARCHIVOS_DIARIO:
+        diario.escribir(archivo, data)
+    else:
+        escribir_json(archivo, data)
+
+def despues_de_restaurar():
+    """Actualiza esquema, caches y agregados tras reemplazar los archivos."""
+    # Un backup antiguo puede tener un esquema anterior
+    migraciones.migrar_todo()
+    instantanea.descartar()
+    
+    # Los agregados del dashboard e ingresos dependen de consultas.json
+    estadisticas.reconstruir()
+    eventos.publicar('recarga')
 
 # Endpoint para restaurar un backup
 @app.route('/api/backup/restaurar/<nombre>', methods=['POST'])
 def api_restaurar_backup(nombre):
     try:
-        ruta_backup = os.path.join(BACKUP_FOLDER, nombre)
-        if not os.path.exists(ruta_backup) or not nombre.startswith('backup_') or not nombre.endswith('.zip'):
+        if not respaldos.existe(nombre):
             return jsonify({'exito': False, 'mensaje': 'Backup no encontrado'}), 404
         
         # Crear backup actual antes de restaurar
-        crear_backup()
+        crear_backup('antes_de_restaurar')
         
         # Extraer archivos del backup
-        with zipfile.ZipFile(ruta_backup, 'r') as zipf:
-            for archivo in ARCHIVOS_BACKUP:
-                if archivo in zipf.namelist():
-                    contenido = zipf.read(archivo)
-                    ruta_destino = os.path.join(os.path.dirname(__file__), archivo)
-                    with open(ruta_destino, 'wb') as f:
-                        f.write(contenido)
+        for archivo, contenido in respaldos.contenidos(nombre, ARCHIVOS_BACKUP):
+            restaurar_archivo(archivo, json_rapido.loads(contenido))
+        despues_de_restaurar()
         
         return jsonify({'exito': True, 'mensaje': f'Backup {nombre} restaurado correctamente'})
     except Exception as e:
         return jsonify({'exito': False, 'mensaje': str(e)}), 500
 
+# Endpoint para restaurar a una fecha y hora exactas
+@app.route('/api/backup/restaurar-a-fecha', methods=['POST'])
+def api_restaurar_a_fecha():
+    """
+    Restaura los datos al estado de un instante: el backup anterior más las
+    mutaciones del diario hasta ese momento (ver diario.py).
+    
+    Body: {"fecha": "YYYY-MM-DDTHH:MM:SS", "simular": true}
+    Con simular=true solo se informa qué cambiaría, sin escribir nada.
+    Solo se restauran los archivos con diario (consultas, pacientes,
+    inventario y movimientos); los demás (usuarios, catálogos) no se tocan
+    y se informan en 'no_restaurados'.
+    """
+    req_data = request.get_json(silent=True) or {}
+    fecha = req_data.get('fecha', '')
+    try:
+        hasta_ts = a_epoch(fecha)
+    except ValueError:
+        return jsonify({'exito': False, 'mensaje': 'Fecha inválida, use YYYY-MM-DDTHH:MM:SS'}), 400
+    if hasta_ts > epoch_ahora():
+        return jsonify({'exito': False, 'mensaje': 'La fecha no puede ser futura'}), 400
+    simular = bool(req_data.get('simular'))
+    
+    try:
+        inicio = time.perf_counter()
+        estado = respaldos.estado_en(hasta_ts, list(diario.ARCHIVOS_DIARIO))
+        if estado is None:
+            return jsonify({'exito': False, 'mensaje': 'No hay un backup anterior a esa fecha'}), 404
+        
+        cambios = {
+            archivo: diario.diferencias(leer_json(archivo), estado['datos'][archivo], lista)
+            for archivo, lista in diario.ARCHIVOS_DIARIO.items() if archivo in estado['datos']
+        }
+        # Sin diario no se puede saber su estado en esa fecha: se conservan los actuales
+        no_restaurados = [a for a in ARCHIVOS_BACKUP if a not in diario.ARCHIVOS_DIARIO]
+        
+        if not simular:
+            # Crear backup actual antes de restaurar
+            crear_backup('antes_de_restaurar')
+            for archivo, data in estado['datos'].items():
+                restaurar_archivo(archivo, data)
+            despues_de_restaurar()
+        
+        duracion_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        print(f"[BACKUP] ⏪ {'Simulación de restauración' if simular else 'Restaurado'} a {fecha} "
+              f"desde {estado['backup']} + {sum(estado['entradas'].values())} mutaciones ({duracion_ms} ms)")
+        
+        return jsonify({
+            'exito': True,
+            'simulacion': simular,
+            'mensaje': f"{'Simulación' if simular else 'Restauración'} al {fecha} desde el backup {estado['backup']}",
+            'fecha': fecha,
+            'backup': estado['backup'],
+            'mutaciones_repetidas': estado['entradas'],
+            'cambios': cambios,
+            'no_restaurados': no_restaurados,
+            'advertencia': estado['advertencia'],
+            'duracion_ms': duracion_ms
+        })
+    except Exception as e:
+        return jsonify({'exito': False, 'mensaje': str(e)}), 500
+
+# ==================== TRABAJOS EN SEGUNDO PLANO ====================
+
+@app.route('/api/trabajos', methods=['GET'])
+def listar_trabajos():
+    """Trabajos recientes; filtros opcionales estado, tipo y limite."""
+    estado = request.args.get('estado', '')
+    if estado and estado not in trabajos.ESTADOS:
+        return jsonify({'exito': False, 'mensaje': f"Estado inválido, use: {', '.join(trabajos.ESTADOS)}"}), 400
+    limite = min(max(request.args.get('limite', 50, type=int), 1), 200)
+    lista = trabajos.listar(estado or None, request.args.get('tipo') or None, limite)
+    return jsonify({'exito': True, 'trabajos': lista, 'total': len(lista)})
+
+@app.route('/api/trabajos/<int:trabajo_id>', methods=['GET'])
+def obtener_trabajo(trabajo_id):
+    """Estado y resultado de un trabajo."""
+    trabajo = trabajos.obtener(trabajo_id)
+    if trabajo is None:
+        return jsonify({'exito': False, 'mensaje': 'Trabajo no encontrado'}), 404
+    return jsonify({'exito': True, 'trabajo': trabajo})
+
+@app.route('/api/trabajos/metricas', methods=['GET'])
+def metricas_trabajos():
+    """Profundidad de la cola y latencias (espera y duración) de la última hora."""
+    ventana = min(max(request.args.get('ventana', 3600, type=int), 60), 7 * 86400)
+    return jsonify({'exito': True, 'metricas': trabajos.metricas(ventana)})
+
 # Configurar el scheduler para backups automáticos
 scheduler = BackgroundScheduler(daemon=True)
 
-# Programar backup diario a las 00:00
+# Programar backup diario a las 00:00 (lo ejecuta la cola de trabajos, con reintentos)
 scheduler.add_job(
-    func=crear_backup,
+    func=trabajos.encolar,
+    args=['crear_backup', {'origen': 'diario'}],
     trigger='cron',
     hour=0,
     minute=0,
@@ -2984,12 +3747,69 @@ scheduler.add_job(
     replace_existing=True
 )
 
-# Iniciar el scheduler
-scheduler.start()
+# Liberar cada hora las reservas de stock vencidas
+scheduler.add_job(
+    func=reservas.liberar_vencidas,
+    trigger='interval',
+    hours=1,
+    id='reservas_vencidas',
+    name='Liberar reservas de stock vencidas',
+    replace_existing=True
+)
+
+# Borrar cada día el historial de trabajos terminados
+scheduler.add_job(
+    func=trabajos.limpiar_historial,
+    trigger='cron',
+    hour=3,
+    minute=0,
+    id='trabajos_historial',
+    name='Limpiar historial de trabajos',
+    replace_existing=True
+)
+
+# Solo el worker líder inicia el scheduler (ver liderazgo.py); la cola de
+# trabajos corre en todos los workers
+liderazgo.competir(scheduler.start)
+trabajos.iniciar()
 print("[BACKUP] 📅 Sistema de backup automático configurado (00:00 diario)")
 
 # Asegurar que el scheduler se detenga cuando la app se cierre
-atexit.register(lambda: scheduler.shutdown())
+atexit.register(lambda: scheduler.shutdown() if scheduler.running else None)
+
+@app.route('/api/scheduler/estado', methods=['GET'])
+def estado_scheduler():
+    """Qué worker ejecuta las tareas programadas y sus próximas ejecuciones."""
+    tareas = []
+    if scheduler.running:
+        tareas = [{
+            'id': job.id,
+            'nombre': job.name,
+            'proxima_ejecucion': job.next_run_time.strftime('%Y-%m-%dT%H:%M:%S') if job.next_run_time else None
+        } for job in scheduler.get_jobs()]
+    return jsonify({'exito': True, **liderazgo.estado(), 'tareas': tareas})
+
+# ==================== CALENTAMIENTO ====================
+# Cada worker construye las vistas derivadas al arrancar, en paralelo y en
+# segundo plano (ver calentamiento.py). Los archivos JSON no se incluyen: los
+# cargar_* solo los conservan durante una petición (instantanea.py), así que
+# leerlos aquí no le ahorraría nada a la primera petición real.
+
+for _nombre, _cargar in [
+    ('analitica', almacen_analitico.sincronizar),
+    ('estadisticas_dashboard', estadisticas.cargar_estadisticas),
+    ('rollups_ingresos', estadisticas.cargar_rollups),
+    ('eventos', eventos.version_actual)
+]:
+    calentamiento.registrar(_nombre, _cargar)
+
+calentamiento.iniciar()
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 cuando el calentamiento de este worker terminó, 503 mientras tanto."""
+    estado = calentamiento.estado()
+    return jsonify({'exito': estado['listo'], **estado}), 200 if estado['listo'] else 503
 
 
 if __name__ == '__main__':
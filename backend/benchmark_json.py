@@ -0,0 +1,101 @@
+# =============================================================================
+# BENCHMARK JSON - json estándar vs orjson, indentado vs compacto
+# =============================================================================
+# Escala inventario.json y consultas.json replicando sus registros (con ids
+# nuevos) y mide el tiempo de serializar y parsear cada variante:
+#
+#   python benchmark_json.py                 # escalas 10, 100 y 1000
+#   python benchmark_json.py --escalas 1 10
+#
+# No modifica ningún archivo de datos: todo se hace en memoria.
+# =============================================================================
+
+import argparse
+import copy
+import json
+import time
+
+try:
+    from .persistencia import leer_json
+except ImportError:
+    from persistencia import leer_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ARCHIVOS = {
+    'inventario.json': 'medicamentos',
+    'consultas.json': 'consultas'
+}
+
+
+def escalar(data, lista, factor):
+    """Copia de `data` con la lista de registros repetida `factor` veces."""
+    originales = data.get(lista, [])
+    escalado = {k: v for k, v in data.items() if k != lista}
+    registros = []
+    siguiente_id = 1
+    for _ in range(factor):
+        for registro in originales:
+            copia = copy.copy(registro)
+            copia['id'] = siguiente_id
+            siguiente_id += 1
+            registros.append(copia)
+    escalado[lista] = registros
+    return escalado
+
+
+def variantes():
+    """(nombre, serializar, parsear) para cada combinación disponible."""
+    resultado = [
+        ('json indent=2', lambda d: json.dumps(d, ensure_ascii=False, indent=2).encode('utf-8'), json.loads),
+        ('json compacto', lambda d: json.dumps(d, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), json.loads)
+    ]
+    if orjson is not None:
+        resultado += [
+            ('orjson indent=2', lambda d: orjson.dumps(d, option=orjson.OPT_INDENT_2), orjson.loads),
+            ('orjson compacto', orjson.dumps, orjson.loads)
+        ]
+    return resultado
+
+
+def medir(funcion, argumento, repeticiones):
+    """Mejor tiempo (ms) de `repeticiones` ejecuciones."""
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(argumento)
+        transcurrido = (time.perf_counter() - inicio) * 1000
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor, resultado
+
+
+def ejecutar(escalas, repeticiones):
+    if orjson is None:
+        print("[BENCHMARK] ⚠️ orjson no está instalado: solo se mide json estándar")
+
+    for archivo, lista in ARCHIVOS.items():
+        data = leer_json(archivo)
+        if data is None:
+            print(f"[BENCHMARK] {archivo} no existe, se omite")
+            continue
+        for factor in escalas:
+            escalado = escalar(data, lista, factor)
+            print(f"\n{archivo} x{factor} ({len(escalado[lista])} registros)")
+            print(f"  {'variante':<18}{'tamaño KB':>12}{'serializar ms':>16}{'parsear ms':>14}")
+            for nombre, serializar, parsear in variantes():
+                t_serializar, contenido = medir(serializar, escalado, repeticiones)
+                t_parsear, _ = medir(parsear, contenido, repeticiones)
+                print(f"  {nombre:<18}{len(contenido) / 1024:>12.1f}{t_serializar:>16.2f}{t_parsear:>14.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compara serialización JSON sobre los datos del sistema.')
+    parser.add_argument('--escalas', type=int, nargs='+', default=[10, 100, 1000],
+                        help='factores de replicación de los registros')
+    parser.add_argument('--repeticiones', type=int, default=3,
+                        help='ejecuciones por medición (se informa la mejor)')
+    args = parser.parse_args()
+    ejecutar(args.escalas, args.repeticiones)
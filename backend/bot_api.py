@@ -17,6 +17,15 @@ import os
 import re
 import unicodedata
 
+try:
+    from . import cambios, instantanea, json_rapido, secuencias, trabajos
+    from .tiempos import sellar
+    from .versiones import guardar_versionado
+except ImportError:
+    import cambios, instantanea, json_rapido, secuencias, trabajos
+    from tiempos import sellar
+    from versiones import guardar_versionado
+
 # Crear Blueprint
 bot_api = Blueprint("bot_api", __name__)
 
@@ -32,10 +41,11 @@ def _load_json(filename, default=None):
     """Carga un archivo JSON de forma segura."""
     if default is None:
         default = {}
+    instantanea.registrar_lectura(filename)
     try:
         filepath = os.path.join(_get_base_path(), filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(filepath, 'rb') as f:
+            return json_rapido.load(f)
     except (FileNotFoundError, json.JSONDecodeError) as e:
         print(f"[bot_api] Error cargando {filename}: {e}")
         return default
@@ -448,16 +458,12 @@ def agendar_cita():
     if not tipo_cita:
         tipo_cita = config_urgencia["tipo"]
     
-    # Cargar consultas para generar ticket
-    consultas_data = _load_json("consultas.json", default={"consultas": [], "ultimo_ticket": 0})
+    # Cargar consultas
+    consultas_data = _load_json("consultas.json", default={"consultas": []})
     
     # Cargar pacientes existentes
     pacientes_data = _load_json("pacientes.json", default={"pacientes": []})
     
-    # Generar número de ticket
-    ultimo_ticket = consultas_data.get("ultimo_ticket", 0) + 1
-    año_actual = datetime.now().year
-    
     # Prefijo según urgencia
     if config_urgencia["prioridad"] <= 2:
         prefijo = "EMG"  # Emergencia
@@ -466,7 +472,8 @@ def agendar_cita():
     else:
         prefijo = "BD"   # Normal
     
-    numero_ticket = f"{prefijo}-{año_actual}-{str(ultimo_ticket).zfill(4)}"
+    # Número de ticket (ver secuencias.py)
+    numero_ticket = secuencias.nuevo_ticket(prefijo)
     
     # =========================================================================
     # CREAR O ACTUALIZAR FICHA DEL PACIENTE
@@ -528,8 +535,8 @@ def agendar_cita():
         
         print(f"[bot_api] Paciente existente actualizado: {nombre_mascota} (ID: {paciente_id})")
     else:
-        # Crear nuevo paciente
-        nuevo_id = max([p.get("id", 0) for p in pacientes_data.get("pacientes", [])] + [0]) + 1
+        # Crear nuevo paciente (id: ver secuencias.py)
+        nuevo_id = secuencias.nuevo_id_paciente()
         paciente_id = nuevo_id
         
         nuevo_paciente = {
@@ -576,7 +583,7 @@ def agendar_cita():
     # =========================================================================
     
     nueva_cita = {
-        "id": len(consultas_data.get("consultas", [])) + 1,
+        "id": secuencias.nuevo_id_consulta(),
         "numero_ticket": numero_ticket,
         "fecha_registro": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
         "estado": "en_espera",
@@ -608,6 +615,7 @@ def agendar_cita():
         "tratamiento_sugerido": None,
         "cobro": None
     }
+    sellar(nueva_cita, "fecha_registro")
     
     # Agregar consulta al historial del paciente
     if "historial_consultas" not in paciente_existente:
@@ -616,26 +624,21 @@ def agendar_cita():
     
     # Guardar la cita
     consultas_data["consultas"].append(nueva_cita)
-    consultas_data["ultimo_ticket"] = ultimo_ticket
     
     # Escribir archivos
     guardado_ok = True
     try:
-        # Guardar consultas
-        filepath_consultas = os.path.join(_get_base_path(), "consultas.json")
-        with open(filepath_consultas, 'w', encoding='utf-8') as f:
-            json.dump(consultas_data, f, ensure_ascii=False, indent=2)
-        
-        # Guardar pacientes
-        filepath_pacientes = os.path.join(_get_base_path(), "pacientes.json")
-        with open(filepath_pacientes, 'w', encoding='utf-8') as f:
-            json.dump(pacientes_data, f, ensure_ascii=False, indent=2)
+        guardar_versionado("consultas.json", consultas_data, "consultas", modificados={nueva_cita["id"]})
+        guardar_versionado("pacientes.json", pacientes_data, "pacientes", modificados={paciente_id})
             
         print(f"[bot_api] Cita guardada: {numero_ticket}, Paciente ID: {paciente_id}")
     except Exception as e:
         print(f"[bot_api] Error guardando cita/paciente: {e}")
         guardado_ok = False
     
+    if guardado_ok:
+        cambios.consulta_guardada(nueva_cita, evento='cita_bot')
+    
     # Generar mensaje según urgencia
     if config_urgencia["prioridad"] == 1:
         mensaje = f"🚨 EMERGENCIA REGISTRADA. Ticket: {numero_ticket}. Acuda INMEDIATAMENTE a la clínica."
@@ -650,6 +653,31 @@ def agendar_cita():
         mensaje = f"✅ Cita registrada exitosamente. Ticket: {numero_ticket}."
         instrucciones = "Su cita ha sido registrada. Puede acudir a la clínica en horario de atención o esperar confirmación."
     
+    datos_notificacion = {
+        "propietario": data.get("propietario"),
+        "telefono": data.get("telefono"),
+        "email": data.get("email", ""),
+        "numero_ticket": numero_ticket,
+        "nombre_mascota": data.get("nombre_mascota"),
+        "especie": data.get("especie", ""),
+        "sintomas": data.get("sintomas", ""),
+        "tiempo_espera": config_urgencia["tiempo_espera"],
+        "instrucciones": instrucciones
+    }
+    if data.get("notificacion_inline"):
+        # Compatibilidad: flujos que esperan los mensajes en la misma respuesta
+        notificacion = _renderizar_notificacion(datos_notificacion)
+    else:
+        trabajo_id = trabajos.encolar("notificacion_cita", datos_notificacion)
+        notificacion = {
+            "destinatario": datos_notificacion["propietario"],
+            "telefono": datos_notificacion["telefono"],
+            "email": datos_notificacion["email"],
+            "trabajo_id": trabajo_id,
+            "estado": "pendiente",
+            "url": f"/api/trabajos/{trabajo_id}"
+        }
+    
     return jsonify({
         "exito": guardado_ok,
         "mensaje": mensaje,
@@ -669,43 +697,57 @@ def agendar_cita():
         },
         "instrucciones": instrucciones,
         "contacto_emergencias": "(555) 123-4567",
-        # Datos para notificaciones (email/WhatsApp)
-        "notificacion": {
-            "destinatario": data.get("propietario"),
-            "telefono": data.get("telefono"),
-            "email": data.get("email", ""),
-            "asunto": f"🐾 Confirmación de cita #{numero_ticket} - BetterDoctor",
-            "mensaje_whatsapp": f"🐾 *BetterDoctor* - Confirmación de Cita\n\n¡Hola {data.get('propietario')}!\n\nTu cita ha sido registrada:\n\n🎫 *Ticket:* {numero_ticket}\n🐾 *Paciente:* {data.get('nombre_mascota')}\n📋 *Motivo:* {data.get('sintomas', 'Consulta general')}\n⏰ *Atención:* {config_urgencia['tiempo_espera']}\n\n{instrucciones}\n\n📍 Clínica Veterinaria BetterDoctor",
-            "mensaje_email_html": f"""
-                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <div style="background: linear-gradient(135deg, #0891b2, #059669); padding: 20px; border-radius: 10px 10px 0 0; text-align: center;">
-                        <h1 style="color: white; margin: 0;">🐾 BetterDoctor</h1>
-                        <p style="color: rgba(255,255,255,0.9); margin: 5px 0 0 0;">Clínica Veterinaria</p>
-                    </div>
-                    <div style="background: #f8fafc; padding: 30px; border: 1px solid #e2e8f0;">
-                        <h2 style="color: #0891b2; margin-top: 0;">¡Cita Confirmada! ✅</h2>
-                        <p>Estimado/a <strong>{data.get('propietario')}</strong>,</p>
-                        <p>Tu cita ha sido registrada exitosamente.</p>
-                        <div style="background: white; border-radius: 10px; padding: 20px; margin: 20px 0; border-left: 4px solid #0891b2;">
-                            <h3 style="margin-top: 0; color: #334155;">📋 Detalles de la cita</h3>
-                            <p><strong>🎫 Ticket:</strong> {numero_ticket}</p>
-                            <p><strong>🐾 Paciente:</strong> {data.get('nombre_mascota')} ({data.get('especie', 'Mascota')})</p>
-                            <p><strong>📝 Motivo:</strong> {data.get('sintomas', 'Consulta general')}</p>
-                            <p><strong>⏰ Atención:</strong> {config_urgencia['tiempo_espera']}</p>
-                        </div>
-                        <p style="background: #ecfeff; padding: 15px; border-radius: 8px;">{instrucciones}</p>
-                        <hr style="border: none; border-top: 1px solid #e2e8f0; margin: 20px 0;">
-                        <p style="color: #64748b; font-size: 14px;">El equipo médico de BetterDoctor estará esperando a {data.get('nombre_mascota')}.</p>
-                    </div>
-                    <div style="background: #334155; color: white; padding: 20px; border-radius: 0 0 10px 10px; text-align: center;">
-                        <p style="margin: 0;">📞 Emergencias: (555) 123-4567</p>
-                    </div>
-                </div>
-            """
-        }
+        # Datos para notificaciones (email/WhatsApp): los mensajes se arman en
+        # segundo plano y se obtienen en /api/trabajos/<id> (ver trabajos.py)
+        "notificacion": notificacion
     })
 
 
+def _renderizar_notificacion(p):
+    """
+    Arma los mensajes de confirmación de una cita (trabajo 'notificacion_cita').
+
+    `p` trae propietario, telefono, email, numero_ticket, nombre_mascota,
+    especie, sintomas, tiempo_espera e instrucciones.
+    """
+    return {
+        "destinatario": p["propietario"],
+        "telefono": p["telefono"],
+        "email": p["email"],
+        "asunto": f"🐾 Confirmación de cita #{p['numero_ticket']} - BetterDoctor",
+        "mensaje_whatsapp": f"🐾 *BetterDoctor* - Confirmación de Cita\n\n¡Hola {p['propietario']}!\n\nTu cita ha sido registrada:\n\n🎫 *Ticket:* {p['numero_ticket']}\n🐾 *Paciente:* {p['nombre_mascota']}\n📋 *Motivo:* {p['sintomas'] or 'Consulta general'}\n⏰ *Atención:* {p['tiempo_espera']}\n\n{p['instrucciones']}\n\n📍 Clínica Veterinaria BetterDoctor",
+        "mensaje_email_html": f"""
+        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+            <div style="background: linear-gradient(135deg, #0891b2, #059669); padding: 20px; border-radius: 10px 10px 0 0; text-align: center;">
+                <h1 style="color: white; margin: 0;">🐾 BetterDoctor</h1>
+                <p style="color: rgba(255,255,255,0.9); margin: 5px 0 0 0;">Clínica Veterinaria</p>
+            </div>
+            <div style="background: #f8fafc; padding: 30px; border: 1px solid #e2e8f0;">
+                <h2 style="color: #0891b2; margin-top: 0;">¡Cita Confirmada! ✅</h2>
+                <p>Estimado/a <strong>{p['propietario']}</strong>,</p>
+                <p>Tu cita ha sido registrada exitosamente.</p>
+                <div style="background: white; border-radius: 10px; padding: 20px; margin: 20px 0; border-left: 4px solid #0891b2;">
+                    <h3 style="margin-top: 0; color: #334155;">📋 Detalles de la cita</h3>
+                    <p><strong>🎫 Ticket:</strong> {p['numero_ticket']}</p>
+                    <p><strong>🐾 Paciente:</strong> {p['nombre_mascota']} ({p['especie'] or 'Mascota'})</p>
+                    <p><strong>📝 Motivo:</strong> {p['sintomas'] or 'Consulta general'}</p>
+                    <p><strong>⏰ Atención:</strong> {p['tiempo_espera']}</p>
+                </div>
+                <p style="background: #ecfeff; padding: 15px; border-radius: 8px;">{p['instrucciones']}</p>
+                <hr style="border: none; border-top: 1px solid #e2e8f0; margin: 20px 0;">
+                <p style="color: #64748b; font-size: 14px;">El equipo médico de BetterDoctor estará esperando a {p['nombre_mascota']}.</p>
+            </div>
+            <div style="background: #334155; color: white; padding: 20px; border-radius: 0 0 10px 10px; text-align: center;">
+                <p style="margin: 0;">📞 Emergencias: (555) 123-4567</p>
+            </div>
+        </div>
+        """
+    }
+
+
+trabajos.registrar("notificacion_cita", _renderizar_notificacion)
+
+
 # =============================================================================
 # ENDPOINT DE RECOMENDACIÓN DE ALIMENTOS
 # =============================================================================
@@ -0,0 +1,68 @@
+# =============================================================================
+# CACHE HTTP - ETag y GET condicional para los datos de referencia
+# =============================================================================
+# Razas, síntomas, diagnósticos y servicios solo cambian cuando cambia su
+# archivo de origen. El decorador con_etag() calcula un ETag a partir de la
+# versión de esos archivos (fecha de modificación y tamaño) antes de ejecutar
+# la vista: si el cliente envía el mismo ETag en If-None-Match se responde
+# 304 sin volver a construir ni transferir el contenido.
+# =============================================================================
+
+import hashlib
+import os
+import sys
+from functools import wraps
+
+from flask import request, make_response
+
+try:
+    from .persistencia import ruta_datos
+except ImportError:
+    from persistencia import ruta_datos
+
+
+def _version_archivo(ruta):
+    try:
+        st = os.stat(ruta)
+        return f"{st.st_mtime_ns}-{st.st_size}"
+    except FileNotFoundError:
+        return '0'
+
+
+def _cache_control(max_age):
+    if max_age:
+        return f"public, max-age={max_age}, must-revalidate"
+    return 'no-cache'
+
+
+def con_etag(*archivos, max_age=0):
+    """
+    Responde 304 si el ETag del cliente coincide con la versión actual de
+    `archivos` (nombres dentro de backend/).
+
+    El ETag incluye además el módulo de la vista, para que un despliegue que
+    cambie el formato de la respuesta invalide las copias de los clientes, y
+    la URL completa, porque cada variante (especie, query string) es distinta.
+    """
+    def decorador(vista):
+        modulo = sys.modules[vista.__module__].__file__
+
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            versiones = [_version_archivo(ruta_datos(nombre)) for nombre in archivos]
+            versiones.append(_version_archivo(modulo))
+            versiones.append(request.full_path)
+            etag = hashlib.sha1('|'.join(versiones).encode('utf-8')).hexdigest()[:20]
+
+            if request.if_none_match.contains_weak(etag):
+                respuesta = make_response('', 304)
+            else:
+                respuesta = make_response(vista(*args, **kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+
+            respuesta.set_etag(etag, weak=True)
+            respuesta.headers['Cache-Control'] = _cache_control(max_age)
+            return respuesta
+        return envoltura
+    return decorador
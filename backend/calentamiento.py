@@ -0,0 +1,89 @@
+# =============================================================================
+# CALENTAMIENTO - Carga inicial de los almacenes al arrancar cada worker
+# =============================================================================
+# Tras un deploy o cuando el hosting gratuito suspende la app por inactividad,
+# las primeras peticiones pagaban la construcción de las vistas derivadas
+# (almacén analítico, contadores del dashboard, series de ingresos), una tras
+# otra.
+#
+# Al importar app.py se registran esas cargas con registrar(nombre, funcion)
+# e iniciar() las ejecuta en paralelo en un pool de hilos, en segundo plano
+# para no retrasar el arranque del worker. /api/ready responde 503 mientras
+# el calentamiento no termina y 200 después, con el tiempo de cada almacén.
+#
+# Un error en una carga se registra pero no impide marcar el worker como
+# listo: la petición que necesite ese archivo lo volverá a intentar.
+# =============================================================================
+
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+HILOS_CALENTAMIENTO = int(os.environ.get('VETERINARIA_HILOS_CALENTAMIENTO', '4'))
+
+_tareas = {}   # nombre -> función sin argumentos
+_estado = {'pid': None, 'duracion_ms': None, 'tiempos': {}, 'errores': {}}
+_listo = threading.Event()
+_estado_lock = threading.Lock()
+
+
+def registrar(nombre, funcion):
+    """Agrega una carga al calentamiento (ej: una vista derivada)."""
+    _tareas[nombre] = funcion
+
+
+def _medir(nombre, funcion):
+    inicio = time.perf_counter()
+    try:
+        funcion()
+        error = None
+    except Exception:
+        error = traceback.format_exc().splitlines()[-1]
+    return nombre, round((time.perf_counter() - inicio) * 1000, 1), error
+
+
+def ejecutar(hilos=HILOS_CALENTAMIENTO):
+    """Ejecuta todas las cargas registradas en paralelo; devuelve el estado final."""
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, hilos), thread_name_prefix='calentamiento') as pool:
+        resultados = list(pool.map(lambda tarea: _medir(*tarea), list(_tareas.items())))
+
+    with _estado_lock:
+        _estado['tiempos'] = {nombre: ms for nombre, ms, _ in resultados}
+        _estado['errores'] = {nombre: error for nombre, _, error in resultados if error}
+        _estado['duracion_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    _listo.set()
+
+    print(f"[CALENTAMIENTO] 🔥 {len(resultados)} almacenes listos en {_estado['duracion_ms']} ms (pid {os.getpid()})")
+    for nombre, ms, error in sorted(resultados, key=lambda r: -r[1]):
+        print(f"    - {nombre}: {ms} ms" + (f" ❌ {error}" if error else ""))
+    return estado()
+
+
+def iniciar(hilos=HILOS_CALENTAMIENTO):
+    """Lanza el calentamiento en segundo plano (una vez por proceso)."""
+    with _estado_lock:
+        if _estado['pid'] == os.getpid():
+            return
+        _listo.clear()
+        _estado.update(pid=os.getpid(), duracion_ms=None, tiempos={}, errores={})
+    threading.Thread(target=ejecutar, args=(hilos,), name='calentamiento', daemon=True).start()
+
+
+def listo():
+    return _listo.is_set()
+
+
+def estado():
+    """Progreso del calentamiento de este proceso."""
+    with _estado_lock:
+        return {
+            'listo': _listo.is_set(),
+            'pid': os.getpid(),
+            'almacenes': sorted(_tareas),
+            'duracion_ms': _estado['duracion_ms'],
+            'tiempos_ms': dict(_estado['tiempos']),
+            'errores': dict(_estado['errores'])
+        }
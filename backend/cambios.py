@@ -0,0 +1,54 @@
+# =============================================================================
+# CAMBIOS - Propagación de escrituras de consultas a las vistas derivadas
+# =============================================================================
+# Los contadores del dashboard, las series de ingresos y el almacén analítico
+# se actualizan dentro de cada escritura de consultas.json, bajo su bloqueo
+# (versiones.al_escribir): las diferencias se calculan entre lo que había en
+# disco y lo que quedó, no desde la copia que leyó la petición.
+#
+# Todo endpoint que guarda una consulta (app.py y bot_api.py) llama además a
+# consulta_guardada() para publicar el evento que reciben las pantallas
+# suscritas a la cola (ver eventos.py).
+# =============================================================================
+
+try:
+    from . import estadisticas, eventos, versiones
+    from .analitica import almacen
+except ImportError:
+    import estadisticas, eventos, versiones
+    from analitica import almacen
+
+
+def _consultas_escritas(anterior, data):
+    """Aplica a los agregados las consultas que cambiaron en esta escritura."""
+    seq = anterior.get('seq_cambios', 0)
+    previas = {c.get('id'): c for c in anterior.get('consultas', [])}
+    pares = [
+        (previas.get(consulta.get('id')), consulta)
+        for consulta in data.get('consultas', []) if consulta.get('seq_cambio', 0) > seq
+    ]
+    pares += [
+        (previas[e['id']], None)
+        for e in data.get('eliminados', []) if e['seq_cambio'] > seq and e['id'] in previas
+    ]
+    if not pares:
+        return
+    estadisticas.actualizar([
+        (estadisticas.huella_consulta(antes), estadisticas.huella_consulta(despues)) for antes, despues in pares
+    ])
+    estadisticas.actualizar_ingresos([
+        (estadisticas.huella_ingreso(antes), estadisticas.huella_ingreso(despues)) for antes, despues in pares
+    ])
+
+
+versiones.al_escribir('consultas.json', _consultas_escritas)
+versiones.al_escribir('consultas.json', almacen.escrito)
+
+
+def consulta_guardada(consulta, evento='actualizada'):
+    """
+    Publica el cambio de una consulta ya persistida.
+
+    `evento` es el tipo publicado a los suscriptores (nueva, atender, ...).
+    """
+    eventos.publicar(evento, consulta)
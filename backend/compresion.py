@@ -0,0 +1,182 @@
+# =============================================================================
+# COMPRESIÓN - gzip/brotli para respuestas JSON y páginas del frontend
+# =============================================================================
+#   - comprimir_respuesta(): hook after_request que comprime las respuestas
+#     JSON mayores a UMBRAL_BYTES según el Accept-Encoding del cliente
+#   - compilar_frontend(): genera las variantes .gz (y .br si el módulo
+#     brotli está instalado) de cada página en frontend/dist, junto con un
+#     manifest.json con el hash de contenido de cada una. Se ejecuta al
+#     iniciar la app (solo recomprime lo que cambió) o con
+#     `python compresion.py` como paso de build.
+#   - enviar_pagina(): sirve la variante precomprimida que acepte el cliente,
+#     con el hash de contenido como ETag para revalidar con 304.
+# =============================================================================
+
+import gzip
+import hashlib
+import json
+import os
+
+from flask import request, send_from_directory, make_response
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin brotli solo se ofrece gzip
+    brotli = None
+
+try:
+    from .persistencia import ruta_temporal
+except ImportError:
+    from persistencia import ruta_temporal
+
+FRONTEND_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend')
+DIST_FOLDER = os.path.join(FRONTEND_FOLDER, 'dist')
+MANIFIESTO = os.path.join(DIST_FOLDER, 'manifest.json')
+
+UMBRAL_BYTES = 1024
+NIVEL_GZIP = 6
+
+_manifiesto = {}
+
+
+# -----------------------------------------------------------------------------
+# Negociación
+# -----------------------------------------------------------------------------
+
+def _codificaciones_aceptadas():
+    """Codificaciones que acepta el cliente, en orden de preferencia del servidor."""
+    aceptadas = []
+    if brotli is not None and request.accept_encodings['br']:
+        aceptadas.append('br')
+    if request.accept_encodings['gzip']:
+        aceptadas.append('gzip')
+    return aceptadas
+
+
+def _comprimir(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=5)
+    return gzip.compress(datos, compresslevel=NIVEL_GZIP)
+
+
+def comprimir_respuesta(respuesta):
+    """Comprime las respuestas JSON grandes (registrar con app.after_request)."""
+    respuesta.vary.add('Accept-Encoding')
+    if (respuesta.mimetype != 'application/json'
+            or respuesta.status_code != 200
+            or respuesta.direct_passthrough
+            or respuesta.is_streamed
+            or 'Content-Encoding' in respuesta.headers):
+        return respuesta
+
+    datos = respuesta.get_data()
+    if len(datos) < UMBRAL_BYTES:
+        return respuesta
+
+    aceptadas = _codificaciones_aceptadas()
+    if not aceptadas:
+        return respuesta
+
+    respuesta.set_data(_comprimir(datos, aceptadas[0]))
+    respuesta.headers['Content-Encoding'] = aceptadas[0]
+    return respuesta
+
+
+# -----------------------------------------------------------------------------
+# Páginas precomprimidas
+# -----------------------------------------------------------------------------
+
+def _escribir_atomico(ruta, datos):
+    ruta_tmp = ruta_temporal(ruta)
+    with open(ruta_tmp, 'wb') as f:
+        f.write(datos)
+    os.replace(ruta_tmp, ruta)
+
+
+def _compilar_pagina(nombre, anterior=None):
+    """Genera las variantes de una página; reutiliza `anterior` si no cambió."""
+    ruta = os.path.join(FRONTEND_FOLDER, nombre)
+    st = os.stat(ruta)
+    variantes = ['gzip'] + (['br'] if brotli is not None else [])
+    if (anterior and anterior['mtime_ns'] == st.st_mtime_ns
+            and anterior['tamano'] == st.st_size
+            and sorted(anterior['variantes']) == sorted(variantes)
+            and all(os.path.exists(os.path.join(DIST_FOLDER, archivo))
+                    for archivo in anterior['variantes'].values())):
+        return anterior
+
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    hash_contenido = hashlib.sha256(contenido).hexdigest()[:16]
+
+    archivos = {}
+    for codificacion in variantes:
+        extension = '.br' if codificacion == 'br' else '.gz'
+        archivos[codificacion] = nombre + extension
+        _escribir_atomico(os.path.join(DIST_FOLDER, archivos[codificacion]),
+                          _comprimir(contenido, codificacion))
+
+    return {
+        'hash': hash_contenido,
+        'mtime_ns': st.st_mtime_ns,
+        'tamano': st.st_size,
+        'variantes': archivos
+    }
+
+
+def compilar_frontend():
+    """Precomprime las páginas del frontend que cambiaron desde la última vez."""
+    os.makedirs(DIST_FOLDER, exist_ok=True)
+    try:
+        with open(MANIFIESTO, 'r', encoding='utf-8') as f:
+            anterior = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        anterior = {}
+
+    manifiesto = {}
+    for nombre in sorted(os.listdir(FRONTEND_FOLDER)):
+        if nombre.endswith('.html'):
+            manifiesto[nombre] = _compilar_pagina(nombre, anterior.get(nombre))
+
+    if manifiesto != anterior:
+        _escribir_atomico(MANIFIESTO, json.dumps(manifiesto, indent=2).encode('utf-8'))
+        print(f"[FRONTEND] ✅ {len(manifiesto)} páginas precomprimidas en {DIST_FOLDER}")
+
+    _manifiesto.clear()
+    _manifiesto.update(manifiesto)
+    return manifiesto
+
+
+def enviar_pagina(nombre):
+    """Sirve una página del frontend con la mejor variante precomprimida."""
+    info = _manifiesto.get(nombre)
+    if info is not None:
+        # En desarrollo la página puede editarse con la app corriendo
+        try:
+            if os.stat(os.path.join(FRONTEND_FOLDER, nombre)).st_mtime_ns != info['mtime_ns']:
+                info = _manifiesto[nombre] = _compilar_pagina(nombre, info)
+        except OSError:
+            info = None
+    if info is None:
+        return send_from_directory(FRONTEND_FOLDER, nombre)
+
+    if request.if_none_match.contains_weak(info['hash']):
+        respuesta = make_response('', 304)
+    else:
+        codificacion = next((c for c in _codificaciones_aceptadas() if c in info['variantes']), None)
+        if codificacion is None:
+            respuesta = send_from_directory(FRONTEND_FOLDER, nombre, conditional=False, etag=False)
+        else:
+            respuesta = send_from_directory(DIST_FOLDER, info['variantes'][codificacion],
+                                            mimetype='text/html', conditional=False, etag=False)
+            respuesta.headers['Content-Encoding'] = codificacion
+
+    respuesta.set_etag(info['hash'], weak=True)
+    respuesta.vary.add('Accept-Encoding')
+    # Las páginas son puntos de entrada con URL fija: se revalidan siempre
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+
+if __name__ == '__main__':
+    compilar_frontend()
@@ -0,0 +1,210 @@
+# =============================================================================
+# DIARIO - Registro de mutaciones para restaurar a una fecha y hora exactas
+# =============================================================================
+# Cada escritura de consultas, pacientes, inventario y movimientos de stock
+# agrega una línea al diario del día con el estado completo de los registros
+# que cambió:
+#
+#   diario/AAAA-MM-DD.ndjson
+#   {"ts": 1760870400.25, "archivo": "consultas.json", "registros": [...],
+#    "eliminados": [ids], "campos": {claves de nivel superior que cambiaron}}
+#
+# 'ts' son segundos epoch de la hora local (como los <campo>_ts, ver
+# tiempos.py). Las colecciones versionadas se registran desde versiones.py;
+# los demás archivos se escriben con escribir(), que compara con lo que había.
+#
+# Para volver al estado de un instante T se parte del backup anterior a T
+# (ver respaldos.py) y se repiten las entradas hasta T con aplicar(). Como
+# cada entrada trae registros completos, repetir una que ya estaba incluida
+# en el backup no cambia el resultado: la repetición empieza un margen antes
+# del backup para no perder escrituras hechas mientras se creaba.
+# =============================================================================
+
+import calendar
+import os
+from datetime import datetime, timedelta
+
+try:
+    from . import json_rapido
+    from .persistencia import leer_json, escribir_json, ruta_datos, bloqueo
+    from .tiempos import desde_epoch
+except ImportError:
+    import json_rapido
+    from persistencia import leer_json, escribir_json, ruta_datos, bloqueo
+    from tiempos import desde_epoch
+
+CARPETA_DIARIO = 'diario'
+
+# archivo -> clave de la lista de registros
+ARCHIVOS_DIARIO = {
+    'consultas.json': 'consultas',
+    'inventario.json': 'medicamentos',
+    'pacientes.json': 'pacientes',
+    'movimientos_stock.json': 'movimientos'
+}
+
+# Claves que guardar_versionado() recalcula al escribir: no hace falta repetirlas
+CAMPOS_DERIVADOS = ('eliminados', 'seq_cambios', 'seq_minimo_eliminados')
+CAMPOS_CONTROL = ('seq_cambio', 'version')   # Por registro; no cuentan como cambio en diferencias()
+
+
+def _ruta_dia(dia):
+    return ruta_datos(os.path.join(CARPETA_DIARIO, f'{dia.isoformat()}.ndjson'))
+
+
+def _campos(anterior, data, lista):
+    anterior = anterior or {}
+    return {
+        clave: valor for clave, valor in data.items()
+        if clave != lista and clave not in CAMPOS_DERIVADOS and anterior.get(clave) != valor
+    }
+
+
+# -----------------------------------------------------------------------------
+# Escritura
+# -----------------------------------------------------------------------------
+
+def registrar(archivo, registros, eliminados=(), campos=None):
+    """Agrega una entrada al diario (llamar bajo el bloqueo del archivo, tras escribirlo)."""
+    if not registros and not eliminados and not campos:
+        return
+    os.makedirs(ruta_datos(CARPETA_DIARIO), exist_ok=True)
+    with bloqueo(CARPETA_DIARIO):
+        ahora = datetime.now()
+        entrada = {
+            'ts': calendar.timegm(ahora.timetuple()) + ahora.microsecond / 1e6,
+            'archivo': archivo,
+            'registros': list(registros),
+            'eliminados': list(eliminados),
+            'campos': campos or {}
+        }
+        with open(_ruta_dia(ahora.date()), 'ab') as f:
+            f.write(json_rapido.dumps_bytes(entrada, indentar=False) + b'\n')
+
+
+def registrar_versionado(archivo, lista, anterior, data):
+    """Registra lo que cambió guardar_versionado(): registros con seq_cambio nuevo."""
+    seq = (anterior or {}).get('seq_cambios', 0)
+    registrar(
+        archivo,
+        [r for r in data.get(lista, []) if r.get('seq_cambio', 0) > seq],
+        [e['id'] for e in data.get('eliminados', []) if e['seq_cambio'] > seq],
+        _campos(anterior, data, lista)
+    )
+
+
+def registrar_diferencias(archivo, lista, anterior, data):
+    """Registra los registros de `data` que difieren de `anterior` (comparando por id)."""
+    previos = {r.get('id'): r for r in (anterior or {}).get(lista, [])}
+    ids = set()
+    registros = []
+    for registro in data.get(lista, []):
+        ids.add(registro.get('id'))
+        if previos.get(registro.get('id')) != registro:
+            registros.append(registro)
+    registrar(archivo, registros, [i for i in previos if i not in ids], _campos(anterior, data, lista))
+
+
+def escribir(nombre, data):
+    """escribir_json() de un archivo no versionado, registrando el cambio en el diario."""
+    with bloqueo(nombre):
+        anterior = leer_json(nombre)
+        escribir_json(nombre, data)
+        registrar_diferencias(nombre, ARCHIVOS_DIARIO[nombre], anterior, data)
+
+
+# -----------------------------------------------------------------------------
+# Lectura y repetición
+# -----------------------------------------------------------------------------
+
+def entradas(desde_ts, hasta_ts):
+    """Genera, en el orden en que se escribieron, las entradas con desde_ts <= ts <= hasta_ts."""
+    dia = desde_epoch(desde_ts).date()
+    ultimo = desde_epoch(hasta_ts).date()
+    while dia <= ultimo:
+        try:
+            f = open(_ruta_dia(dia), 'rb')
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            with f:
+                for linea in f:
+                    try:
+                        entrada = json_rapido.loads(linea)
+                    except ValueError:
+                        continue  # Línea cortada por una caída a mitad de escritura
+                    if desde_ts <= entrada['ts'] <= hasta_ts:
+                        yield entrada
+        dia += timedelta(days=1)
+
+
+def primer_dia():
+    """Fecha del día más antiguo del diario (None si está vacío)."""
+    carpeta = ruta_datos(CARPETA_DIARIO)
+    if not os.path.isdir(carpeta):
+        return None
+    dias = sorted(f[:-7] for f in os.listdir(carpeta) if f.endswith('.ndjson'))
+    return datetime.strptime(dias[0], '%Y-%m-%d').date() if dias else None
+
+
+def aplicar(estados, desde_ts, hasta_ts):
+    """
+    Repite sobre `estados` ({archivo: data}, se modifica) las entradas del
+    diario entre desde_ts y hasta_ts. Devuelve {archivo: entradas aplicadas}.
+    """
+    indices = {
+        archivo: {r.get('id'): r for r in data.get(ARCHIVOS_DIARIO[archivo], [])}
+        for archivo, data in estados.items() if archivo in ARCHIVOS_DIARIO
+    }
+    aplicadas = dict.fromkeys(indices, 0)
+    for entrada in entradas(desde_ts, hasta_ts):
+        registros = indices.get(entrada['archivo'])
+        if registros is None:
+            continue
+        for registro in entrada['registros']:
+            registros[registro.get('id')] = registro
+        for registro_id in entrada['eliminados']:
+            registros.pop(registro_id, None)
+        estados[entrada['archivo']].update(entrada['campos'])
+        aplicadas[entrada['archivo']] += 1
+
+    for archivo, registros in indices.items():
+        estados[archivo][ARCHIVOS_DIARIO[archivo]] = list(registros.values())
+    return aplicadas
+
+
+def _sin_control(registro):
+    return {clave: valor for clave, valor in registro.items() if clave not in CAMPOS_CONTROL}
+
+
+def diferencias(actual, nuevo, lista):
+    """Resumen de lo que cambiaría al reemplazar `actual` por `nuevo`."""
+    previos = {r.get('id'): r for r in (actual or {}).get(lista, [])}
+    ids = set()
+    creados = modificados = 0
+    for registro in nuevo.get(lista, []):
+        ids.add(registro.get('id'))
+        previo = previos.get(registro.get('id'))
+        if previo is None:
+            creados += 1
+        elif previo != registro and _sin_control(previo) != _sin_control(registro):
+            modificados += 1
+    return {
+        'creados': creados,
+        'modificados': modificados,
+        'eliminados': sum(1 for i in previos if i not in ids)
+    }
+
+
+def limpiar_antes(ts):
+    """Borra los días del diario anteriores al día de `ts`; devuelve cuántos borró."""
+    carpeta = ruta_datos(CARPETA_DIARIO)
+    if not os.path.isdir(carpeta):
+        return 0
+    limite = desde_epoch(ts).date().isoformat()
+    borrados = 0
+    for f in os.listdir(carpeta):
+        if f.endswith('.ndjson') and f[:-7] < limite:
+            os.remove(os.path.join(carpeta, f))
+            borrados += 1
+    return borrados
@@ -0,0 +1,245 @@
+# =============================================================================
+# ESTADÍSTICAS - Contadores incrementales del dashboard y series de ingresos
+# =============================================================================
+# Mantiene agregados precalculados para no tener que recorrer las consultas:
+#
+#   - estadisticas_dashboard.json: contadores por día y por mes que usa
+#     /api/dashboard/estadisticas
+#   - rollups_ingresos.json: totales cobrados por hora, día y mes (consulta
+#     vs medicamentos, por método de pago) que usa /api/analytics/ingresos
+#
+# Cada escritura de consultas.json informa, todavía bajo su bloqueo, la
+# "huella" de cada consulta cambiada tal como estaba en disco y como quedó
+# (ver cambios.py); la diferencia se aplica sobre los agregados. Así dos
+# escrituras simultáneas de la misma consulta no aplican dos veces la misma
+# transición. Si un archivo no existe (o se sospecha de desincronización) se
+# reconstruye desde consultas.json con reconstruir().
+# =============================================================================
+
+from datetime import datetime
+
+try:
+    from .persistencia import leer_json, escribir_json, bloqueo
+except ImportError:
+    from persistencia import leer_json, escribir_json, bloqueo
+
+ARCHIVO_ESTADISTICAS = 'estadisticas_dashboard.json'
+ARCHIVO_INGRESOS = 'rollups_ingresos.json'
+
+# Formato de la clave de cada granularidad (se comparan como texto)
+GRANULARIDADES = {
+    'hora': '%Y-%m-%dT%H',
+    'dia': '%Y-%m-%d',
+    'mes': '%Y-%m'
+}
+
+ESTADOS_POR_COBRAR = ('atendida', 'completada')
+
+
+def _estadisticas_vacias():
+    return {
+        'por_dia': {},
+        'por_mes': {},
+        'pendientes': {'cantidad': 0, 'total': 0},
+        'en_espera': 0,
+        'actualizado': None
+    }
+
+
+def huella_consulta(consulta):
+    """Resume la contribución de una consulta a los contadores."""
+    if not consulta:
+        return None
+
+    fecha = consulta.get('fecha_registro') or ''
+    try:
+        datetime.fromisoformat(fecha.replace('Z', '+00:00'))
+    except ValueError:
+        fecha = ''
+
+    cobro = consulta.get('cobro')
+    estado = consulta.get('estado')
+    return {
+        'dia': fecha[:10] or None,
+        'mes': fecha[:7] or None,
+        'en_espera': estado == 'en_espera',
+        'pagado': bool(cobro and cobro.get('pagado', False)),
+        'pendiente': (estado in ESTADOS_POR_COBRAR
+                      and cobro is not None
+                      and not cobro.get('pagado', True)),
+        'total': (cobro or {}).get('total', 0) or 0
+    }
+
+
+def _aplicar_huella(stats, huella, signo):
+    if huella['dia']:
+        dia = stats['por_dia'].setdefault(huella['dia'], {'consultas': 0})
+        dia['consultas'] += signo
+
+    if huella['mes']:
+        mes = stats['por_mes'].setdefault(huella['mes'], {
+            'consultas': 0, 'pagadas': 0, 'cobrado': 0, 'tickets': 0, 'suma_tickets': 0
+        })
+        mes['consultas'] += signo
+        if huella['pagado']:
+            mes['pagadas'] += signo
+            mes['cobrado'] += signo * huella['total']
+            if huella['total'] > 0:
+                mes['tickets'] += signo
+                mes['suma_tickets'] += signo * huella['total']
+
+    if huella['pendiente']:
+        stats['pendientes']['cantidad'] += signo
+        stats['pendientes']['total'] += signo * huella['total']
+
+    if huella['en_espera']:
+        stats['en_espera'] += signo
+
+
+def cargar_estadisticas():
+    """Obtiene los contadores, reconstruyéndolos si aún no existen."""
+    stats = leer_json(ARCHIVO_ESTADISTICAS)
+    if stats is None:
+        with bloqueo(ARCHIVO_ESTADISTICAS):
+            stats = _reconstruir_sin_bloqueo()
+    return stats
+
+
+def actualizar(cambios):
+    """Aplica sobre los contadores los cambios [(huella_antes, huella_despues)] de consultas."""
+    cambios = [(antes, despues) for antes, despues in cambios if antes != despues]
+    if not cambios:
+        return
+    with bloqueo(ARCHIVO_ESTADISTICAS):
+        stats = leer_json(ARCHIVO_ESTADISTICAS)
+        if stats is None:
+            # Sin contadores previos: la reconstrucción ya incluye estos cambios
+            _reconstruir_sin_bloqueo()
+            return
+        for huella_antes, huella_despues in cambios:
+            if huella_antes:
+                _aplicar_huella(stats, huella_antes, -1)
+            if huella_despues:
+                _aplicar_huella(stats, huella_despues, 1)
+        stats['actualizado'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        escribir_json(ARCHIVO_ESTADISTICAS, stats)
+
+
+def _reconstruir_sin_bloqueo():
+    consultas = leer_json('consultas.json', default={}).get('consultas', [])
+    stats = _estadisticas_vacias()
+    for consulta in consultas:
+        _aplicar_huella(stats, huella_consulta(consulta), 1)
+    stats['actualizado'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    escribir_json(ARCHIVO_ESTADISTICAS, stats)
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# Series de ingresos (rollups por hora, día y mes)
+# -----------------------------------------------------------------------------
+
+def _rollups_vacios():
+    rollups = {granularidad: {} for granularidad in GRANULARIDADES}
+    rollups['actualizado'] = None
+    return rollups
+
+
+def huella_ingreso(consulta):
+    """Resume el cobro de una consulta pagada (None si no está pagada)."""
+    if not consulta:
+        return None
+    cobro = consulta.get('cobro')
+    if not cobro or not cobro.get('pagado'):
+        return None
+    try:
+        fecha = datetime.fromisoformat(consulta.get('fecha_cierre') or '')
+    except ValueError:
+        return None
+    return {
+        'fecha': fecha.strftime('%Y-%m-%dT%H:%M:%S'),
+        'metodo_pago': cobro.get('metodo_pago') or 'Sin especificar',
+        'consulta': cobro.get('consulta', 0) or 0,
+        'medicamentos': cobro.get('medicamentos', 0) or 0,
+        'total': cobro.get('total', 0) or 0
+    }
+
+
+def _aplicar_ingreso(rollups, huella, signo):
+    fecha = datetime.fromisoformat(huella['fecha'])
+    for granularidad, formato in GRANULARIDADES.items():
+        tramo = rollups[granularidad].setdefault(fecha.strftime(formato), {
+            'cobros': 0, 'consulta': 0, 'medicamentos': 0, 'total': 0, 'por_metodo': {}
+        })
+        tramo['cobros'] += signo
+        tramo['consulta'] = round(tramo['consulta'] + signo * huella['consulta'], 2)
+        tramo['medicamentos'] = round(tramo['medicamentos'] + signo * huella['medicamentos'], 2)
+        tramo['total'] = round(tramo['total'] + signo * huella['total'], 2)
+        metodo = huella['metodo_pago']
+        tramo['por_metodo'][metodo] = round(tramo['por_metodo'].get(metodo, 0) + signo * huella['total'], 2)
+        if tramo['cobros'] == 0:
+            del rollups[granularidad][fecha.strftime(formato)]
+
+
+def cargar_rollups():
+    """Obtiene las series de ingresos, reconstruyéndolas si aún no existen."""
+    rollups = leer_json(ARCHIVO_INGRESOS)
+    if rollups is None:
+        with bloqueo(ARCHIVO_INGRESOS):
+            rollups = _reconstruir_ingresos_sin_bloqueo()
+    return rollups
+
+
+def actualizar_ingresos(cambios):
+    """Aplica sobre las series de ingresos los cambios [(huella_antes, huella_despues)] de cobro."""
+    cambios = [(antes, despues) for antes, despues in cambios if antes != despues]
+    if not cambios:
+        return
+    with bloqueo(ARCHIVO_INGRESOS):
+        rollups = leer_json(ARCHIVO_INGRESOS)
+        if rollups is None:
+            _reconstruir_ingresos_sin_bloqueo()
+            return
+        for huella_antes, huella_despues in cambios:
+            if huella_antes:
+                _aplicar_ingreso(rollups, huella_antes, -1)
+            if huella_despues:
+                _aplicar_ingreso(rollups, huella_despues, 1)
+        rollups['actualizado'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        escribir_json(ARCHIVO_INGRESOS, rollups)
+
+
+def _reconstruir_ingresos_sin_bloqueo():
+    consultas = leer_json('consultas.json', default={}).get('consultas', [])
+    rollups = _rollups_vacios()
+    for consulta in consultas:
+        huella = huella_ingreso(consulta)
+        if huella:
+            _aplicar_ingreso(rollups, huella, 1)
+    rollups['actualizado'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    escribir_json(ARCHIVO_INGRESOS, rollups)
+    return rollups
+
+
+def serie_ingresos(granularidad, desde=None, hasta=None):
+    """Tramos de una granularidad con clave entre desde y hasta (datetimes, inclusive)."""
+    formato = GRANULARIDADES[granularidad]
+    clave_desde = desde.strftime(formato) if desde else None
+    clave_hasta = hasta.strftime(formato) if hasta else None
+
+    serie = []
+    for clave, tramo in sorted(cargar_rollups()[granularidad].items()):
+        if clave_desde and clave < clave_desde:
+            continue
+        if clave_hasta and clave > clave_hasta:
+            break
+        serie.append({'periodo': clave, **tramo})
+    return serie
+
+
+def reconstruir():
+    """Recalcula todos los agregados desde el historial de consultas."""
+    with bloqueo(ARCHIVO_INGRESOS):
+        _reconstruir_ingresos_sin_bloqueo()
+    with bloqueo(ARCHIVO_ESTADISTICAS):
+        return _reconstruir_sin_bloqueo()
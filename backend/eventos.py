@@ -0,0 +1,194 @@
+# =============================================================================
+# EVENTOS - Notificación de cambios en la cola de consultas
+# =============================================================================
+# Cada escritura de una consulta publica un evento (nueva, atender,
+# diagnostico, devolver, cobrar, cita_portal, cita_bot...) en un log
+# append-only compartido por todos los workers:
+#
+#   eventos_consultas.log   una línea JSON por evento, con 'seq' creciente
+#
+# Los lectores (stream SSE, long-poll) siguen el archivo desde su último
+# offset. Dentro del mismo proceso los publicadores despiertan a los
+# lectores con una Condition; los eventos escritos por otros workers se
+# detectan revisando el tamaño del archivo cada INTERVALO_REVISION segundos,
+# sin volver a leer consultas.json.
+#
+# Cada stream SSE o long-poll ocupa un hilo de gunicorn mientras dura la
+# conexión: como mucho MAX_ESPERAS a la vez por proceso, para que siempre
+# queden hilos libres para el resto de las peticiones (ver tomar_espera()).
+# =============================================================================
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    from .persistencia import ruta_datos, ruta_temporal, bloqueo
+except ImportError:
+    from persistencia import ruta_datos, ruta_temporal, bloqueo
+
+ARCHIVO_EVENTOS = 'eventos_consultas.log'
+TAMANO_MAXIMO = 1024 * 1024   # Al superarlo se conservan solo los últimos eventos
+EVENTOS_CONSERVADOS = 1000
+INTERVALO_REVISION = 1.0      # Segundos entre revisiones de eventos de otros workers
+INTERVALO_PING = 15           # Comentario keep-alive del stream SSE
+MAX_ESPERAS = int(os.environ.get('VETERINARIA_MAX_ESPERAS', '8'))  # Streams + long-polls abiertos por proceso
+
+_condicion = threading.Condition()
+_version = {'firma': None, 'seq': 0}
+_esperas = threading.BoundedSemaphore(MAX_ESPERAS)
+
+
+def _firma():
+    try:
+        st = os.stat(ruta_datos(ARCHIVO_EVENTOS))
+        return (st.st_ino, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def _ultimo_seq_en_disco():
+    """Seq de la última línea completa del log (0 si está vacío)."""
+    try:
+        with open(ruta_datos(ARCHIVO_EVENTOS), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            lineas = f.read().splitlines()
+    except FileNotFoundError:
+        return 0
+    for linea in reversed(lineas):
+        try:
+            return json.loads(linea)['seq']
+        except (ValueError, KeyError):
+            continue
+    return 0
+
+
+def version_actual():
+    """Seq del último evento publicado por cualquier worker."""
+    firma = _firma()
+    if firma != _version['firma']:
+        _version['seq'] = _ultimo_seq_en_disco()
+        _version['firma'] = firma
+    return _version['seq']
+
+
+def _rotar_si_necesario():
+    ruta = ruta_datos(ARCHIVO_EVENTOS)
+    if os.path.getsize(ruta) <= TAMANO_MAXIMO:
+        return
+    with open(ruta, 'rb') as f:
+        lineas = f.read().splitlines(keepends=True)[-EVENTOS_CONSERVADOS:]
+    ruta_tmp = ruta_temporal(ruta)
+    with open(ruta_tmp, 'wb') as f:
+        f.writelines(lineas)
+    os.replace(ruta_tmp, ruta)
+
+
+def publicar(tipo, consulta=None):
+    """Agrega un evento al log y despierta a los lectores de este proceso."""
+    with bloqueo(ARCHIVO_EVENTOS):
+        evento = {
+            'seq': _ultimo_seq_en_disco() + 1,
+            'tipo': tipo,
+            'fecha': datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        if consulta:
+            evento.update({
+                'consulta_id': consulta.get('id'),
+                'numero_ticket': consulta.get('numero_ticket'),
+                'estado': consulta.get('estado')
+            })
+        with open(ruta_datos(ARCHIVO_EVENTOS), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(evento, ensure_ascii=False) + '\n')
+        _rotar_si_necesario()
+
+    with _condicion:
+        _condicion.notify_all()
+    return evento
+
+
+def tomar_espera():
+    """Reserva un lugar para un stream o long-poll; False si ya hay MAX_ESPERAS abiertos."""
+    return _esperas.acquire(blocking=False)
+
+
+def soltar_espera():
+    _esperas.release()
+
+
+def esperar(version, timeout):
+    """
+    Bloquea hasta que la versión sea distinta de `version` o venza `timeout`.
+
+    Devuelve la versión vigente al salir.
+    """
+    limite = time.monotonic() + timeout
+    with _condicion:
+        while True:
+            actual = version_actual()
+            restante = limite - time.monotonic()
+            if actual != version or restante <= 0:
+                return actual
+            _condicion.wait(min(INTERVALO_REVISION, restante))
+
+
+class LectorEventos:
+    """Sigue el log de eventos a partir de un seq, leyendo solo lo nuevo."""
+
+    def __init__(self, desde_seq=0):
+        self.ultimo_seq = desde_seq
+        self._inodo = None
+        self._offset = 0
+
+    def leer(self):
+        """Eventos publicados después del último leído."""
+        firma = _firma()
+        if firma is None:
+            return []
+        inodo, tamano = firma
+        if inodo != self._inodo or tamano < self._offset:
+            # Archivo nuevo o rotado: releer desde el inicio filtrando por seq
+            self._inodo, self._offset = inodo, 0
+        if tamano == self._offset:
+            return []
+
+        with open(ruta_datos(ARCHIVO_EVENTOS), 'rb') as f:
+            f.seek(self._offset)
+            bloque = f.read(tamano - self._offset)
+        # Solo líneas completas; una escritura en curso se lee la próxima vez
+        completo = bloque[:bloque.rfind(b'\n') + 1]
+        self._offset += len(completo)
+
+        eventos = []
+        for linea in completo.splitlines():
+            try:
+                evento = json.loads(linea)
+            except ValueError:
+                continue
+            if evento.get('seq', 0) > self.ultimo_seq:
+                eventos.append(evento)
+                self.ultimo_seq = evento['seq']
+        return eventos
+
+
+def eventos_desde(seq):
+    """Eventos con seq mayor a `seq` que aún conserva el log."""
+    return LectorEventos(seq).leer()
+
+
+def flujo_sse(desde_seq):
+    """Generador de la respuesta text/event-stream."""
+    version = version_actual()
+    # Un seq mayor al actual viene de un log anterior (borrado): seguir desde ahora
+    lector = LectorEventos(min(desde_seq, version))
+    yield 'retry: 3000\n\n'
+    while True:
+        for evento in lector.leer():
+            yield f"id: {evento['seq']}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+        nueva = esperar(version, INTERVALO_PING)
+        if nueva == version:
+            yield ': ping\n\n'
+        version = nueva
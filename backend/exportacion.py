@@ -0,0 +1,251 @@
+# =============================================================================
+# EXPORTACIÓN - Descarga en streaming de consultas, productos y movimientos
+# =============================================================================
+# Los archivos JSON se recorren con un parser incremental: se lee el archivo
+# por bloques y se decodifica un registro a la vez de la lista principal, sin
+# cargar el documento completo. Cada registro se escribe de inmediato como
+# una línea NDJSON o una fila CSV, así que la descarga empieza enseguida y la
+# memoria usada no depende del tamaño del historial.
+#
+# Como las escrituras son atómicas (archivo temporal + rename), el archivo
+# abierto al iniciar la exportación no cambia mientras se recorre.
+# =============================================================================
+
+import csv
+import io
+import json
+import re
+
+try:
+    from . import json_rapido
+    from .persistencia import ruta_datos
+except ImportError:
+    import json_rapido
+    from persistencia import ruta_datos
+
+TAMANO_BLOQUE = 64 * 1024   # Bytes leídos del archivo y enviados al cliente por vez
+
+_FIN_ESCALAR = re.compile(r'[\s,\]}]')
+
+# formato -> (mimetype, extensión)
+FORMATOS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv')
+}
+
+# coleccion -> archivo, lista, campo de fecha (epoch) para filtrar y columnas CSV
+EXPORTACIONES = {
+    'consultas': {
+        'archivo': 'consultas.json',
+        'lista': 'consultas',
+        'campo_fecha': 'fecha_registro_ts',
+        'columnas': [
+            'id', 'numero_ticket', 'fecha_registro', 'estado', 'origen', 'tipo_consulta',
+            'paciente_id', 'paciente.nombre', 'paciente.especie', 'paciente.raza',
+            'paciente.propietario', 'paciente.telefono', 'motivo_consulta', 'sintomas_texto',
+            'registrado_por', 'atendido_por', 'diagnostico.nombre', 'diagnostico.gravedad',
+            'fecha_atencion', 'fecha_cierre', 'cobro.total', 'cobro.metodo_pago', 'cobro.pagado'
+        ]
+    },
+    'inventario': {
+        'archivo': 'inventario.json',
+        'lista': 'medicamentos',
+        'campo_fecha': None,
+        'columnas': [
+            'id', 'nombre', 'categoria', 'precio_unitario', 'stock', 'stock_minimo',
+            'unidad', 'presentacion', 'es_servicio', 'punto_venta', 'proveedor',
+            'codigo_barras', 'lote', 'fecha_vencimiento'
+        ]
+    },
+    'movimientos': {
+        'archivo': 'movimientos_stock.json',
+        'lista': 'movimientos',
+        'campo_fecha': 'fecha_ts',
+        'columnas': [
+            'id', 'fecha', 'tipo', 'producto_id', 'producto_nombre', 'categoria', 'cantidad',
+            'stock_anterior', 'stock_nuevo', 'lote', 'fecha_vencimiento', 'proveedor',
+            'documento', 'usuario', 'observacion'
+        ]
+    }
+}
+
+
+# -----------------------------------------------------------------------------
+# Parser incremental
+# -----------------------------------------------------------------------------
+
+class _LectorJSON:
+    """Decodifica valores JSON de un archivo leyéndolo por bloques."""
+
+    ESPACIOS = ' \t\n\r'
+
+    def __init__(self, archivo, tamano_bloque):
+        self._archivo = archivo
+        self._tamano_bloque = tamano_bloque
+        self._decodificador = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._fin = False
+
+    def _leer_mas(self):
+        bloque = self._archivo.read(self._tamano_bloque)
+        if not bloque:
+            self._fin = True
+            return False
+        # Descartar lo ya consumido para que el buffer no crezca
+        self._buffer = self._buffer[self._pos:] + bloque
+        self._pos = 0
+        return True
+
+    def caracter(self):
+        """Siguiente carácter significativo (sin consumirlo); '' al final."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self.ESPACIOS:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._leer_mas():
+                return ''
+
+    def esperar(self, esperado):
+        """Consume el carácter `esperado` o falla si hay otro."""
+        encontrado = self.caracter()
+        if encontrado != esperado:
+            raise ValueError(f"JSON inválido: se esperaba '{esperado}' y se encontró '{encontrado or 'fin de archivo'}'")
+        self._pos += 1
+
+    def valor(self):
+        """Decodifica el siguiente valor completo (leyendo más si está cortado)."""
+        inicial = self.caracter()
+        if inicial and inicial not in '{["':
+            # Números y literales no tienen cierre propio: asegurar que el
+            # token completo esté en el buffer antes de decodificarlo
+            while not self._fin and not _FIN_ESCALAR.search(self._buffer, self._pos):
+                self._leer_mas()
+        while True:
+            try:
+                valor, fin = self._decodificador.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._leer_mas():
+                    continue
+                raise
+            self._pos = fin
+            return valor
+
+
+def iterar_registros(archivo, lista, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Genera uno a uno los registros de la lista `lista` de un archivo JSON.
+
+    Solo mantiene en memoria el registro actual y el bloque leído; las demás
+    claves del nivel superior se decodifican y descartan.
+    """
+    try:
+        f = open(ruta_datos(archivo), 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with f:
+        lector = _LectorJSON(f, tamano_bloque)
+        lector.esperar('{')
+        if lector.caracter() == '}':
+            return
+        while True:
+            clave = lector.valor()
+            lector.esperar(':')
+            if clave == lista:
+                lector.esperar('[')
+                if lector.caracter() == ']':
+                    lector.esperar(']')
+                else:
+                    while True:
+                        yield lector.valor()
+                        if lector.caracter() == ']':
+                            lector.esperar(']')
+                            break
+                        lector.esperar(',')
+            else:
+                lector.valor()
+            if lector.caracter() == '}':
+                return
+            lector.esperar(',')
+
+
+# -----------------------------------------------------------------------------
+# Formatos
+# -----------------------------------------------------------------------------
+
+def _valor_columna(registro, columna):
+    """Valor de una columna con notación de puntos (ej: 'paciente.nombre')."""
+    valor = registro
+    for parte in columna.split('.'):
+        if not isinstance(valor, dict):
+            return ''
+        valor = valor.get(parte)
+    if valor is None:
+        return ''
+    if isinstance(valor, (dict, list)):
+        return json_rapido.dumps(valor, indentar=False)
+    return valor
+
+
+def _lineas_ndjson(registros):
+    for registro in registros:
+        yield json_rapido.dumps(registro, indentar=False) + '\n'
+
+
+def _lineas_csv(registros, columnas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para que Excel reconozca los acentos
+    buffer.write('\ufeff')
+    escritor.writerow(columnas)
+    yield buffer.getvalue()
+    for registro in registros:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerow([_valor_columna(registro, c) for c in columnas])
+        yield buffer.getvalue()
+
+
+def _en_bloques(lineas, tamano_bloque):
+    """Agrupa las líneas en bloques de ~tamano_bloque para no enviar miles de chunks mínimos."""
+    pendientes = []
+    acumulado = 0
+    for linea in lineas:
+        pendientes.append(linea)
+        acumulado += len(linea)
+        if acumulado >= tamano_bloque:
+            yield ''.join(pendientes).encode('utf-8')
+            pendientes, acumulado = [], 0
+    if pendientes:
+        yield ''.join(pendientes).encode('utf-8')
+
+
+def exportar(coleccion, formato, desde_ts=None, hasta_ts=None):
+    """
+    Generador con el contenido de la exportación.
+
+    desde_ts / hasta_ts (epoch, hasta exclusivo) filtran por el campo de fecha
+    de la colección; se ignoran en colecciones sin fecha (inventario).
+    """
+    config = EXPORTACIONES[coleccion]
+    registros = iterar_registros(config['archivo'], config['lista'])
+
+    campo = config['campo_fecha']
+    if campo and (desde_ts is not None or hasta_ts is not None):
+        registros = (
+            r for r in registros
+            if (desde_ts is None or (r.get(campo) or 0) >= desde_ts)
+            and (hasta_ts is None or (r.get(campo) or 0) < hasta_ts)
+        )
+
+    if formato == 'csv':
+        lineas = _lineas_csv(registros, config['columnas'])
+    else:
+        lineas = _lineas_ndjson(registros)
+
+    try:
+        yield from _en_bloques(lineas, TAMANO_BLOQUE)
+    except ValueError as e:
+        # La respuesta ya comenzó: solo queda registrar el problema y cortar
+        print(f"[EXPORTACION] ❌ {config['archivo']}: {e}")
@@ -0,0 +1,76 @@
+# =============================================================================
+# INSTANTÁNEA - Datos cargados una sola vez por petición
+# =============================================================================
+# Las funciones cargar_* de app.py se decoran con @memorizar('<archivo>').
+# Cada petición abre una instantánea en flask.g (hook before_request): dentro
+# de ella cada archivo se lee y parsea una sola vez y todas las llamadas
+# reciben el mismo objeto. Las funciones guardar_* llaman a actualizar() para
+# que lecturas posteriores en la misma petición vean lo recién escrito.
+#
+# /api/batch comparte la instantánea de la petición externa con todas sus
+# sub-peticiones (los contextos anidados usan el mismo flask.g).
+#
+# Se lleva además la cuenta de lecturas reales de disco por archivo: si una
+# petición lee dos veces el mismo archivo se registra un aviso, y en modo
+# debug cada respuesta incluye la cabecera X-Lecturas-Archivos.
+# =============================================================================
+
+from collections import Counter
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+
+
+def activar():
+    """Abre una instantánea para la petición actual (si no hay una abierta)."""
+    if g.get('instantanea') is None:
+        g.instantanea = {}
+        g.lecturas = Counter()
+
+
+def descartar():
+    """Olvida lo cargado (por ejemplo tras reemplazar archivos desde un backup)."""
+    if has_app_context() and g.get('instantanea') is not None:
+        g.instantanea.clear()
+
+
+def registrar_lectura(nombre):
+    """Cuenta una lectura real de disco de `nombre` en la petición actual."""
+    if has_app_context() and g.get('lecturas') is not None:
+        g.lecturas[nombre] += 1
+
+
+def actualizar(nombre, datos):
+    """Deja en la instantánea los datos que se acaban de guardar."""
+    if has_app_context() and g.get('instantanea') is not None:
+        g.instantanea[nombre] = datos
+
+
+def memorizar(nombre):
+    """Decorador: dentro de una instantánea, el cargador lee `nombre` una vez."""
+    def decorador(cargar):
+        @wraps(cargar)
+        def envoltura():
+            datos = g.get('instantanea') if has_app_context() else None
+            if datos is None:
+                return cargar()
+            if nombre not in datos:
+                registrar_lectura(nombre)
+                datos[nombre] = cargar()
+            return datos[nombre]
+        return envoltura
+    return decorador
+
+
+def revisar_lecturas(respuesta):
+    """Hook after_request: avisa de archivos leídos más de una vez."""
+    lecturas = g.get('lecturas')
+    if not lecturas:
+        return respuesta
+    repetidas = {nombre: n for nombre, n in lecturas.items() if n > 1}
+    if repetidas:
+        detalle = ', '.join(f"{nombre} x{n}" for nombre, n in repetidas.items())
+        print(f"[INSTANTANEA] ⚠️ {request.method} {request.path} leyó más de una vez: {detalle}")
+    if current_app.debug:
+        respuesta.headers['X-Lecturas-Archivos'] = ', '.join(f"{nombre}={n}" for nombre, n in lecturas.items())
+    return respuesta
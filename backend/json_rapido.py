@@ -0,0 +1,95 @@
+# =============================================================================
+# JSON RÁPIDO - Serialización con orjson (si está instalado) o la stdlib
+# =============================================================================
+#   - dumps() / loads() / load(): reemplazos de json.* usados por la
+#     persistencia y los cargar_* de app.py
+#   - ProveedorJSON: proveedor de Flask (app.json) para jsonify()
+#
+# El formato en disco por defecto sigue siendo indentado (indent=2) para que
+# los archivos sean legibles; con VETERINARIA_JSON_COMPACTO=1 se escriben sin
+# indentación, lo que reduce el tamaño ~30% y acelera la escritura.
+# `python benchmark_json.py` compara ambas bibliotecas y formatos.
+# =============================================================================
+
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Opcional: sin orjson se usa el módulo json estándar
+    orjson = None
+
+COMPACTO = os.environ.get('VETERINARIA_JSON_COMPACTO', '').lower() in ('1', 'true', 'si')
+
+
+def dumps_bytes(data, indentar=None):
+    """Serializa a bytes UTF-8; indentar=None usa el modo configurado en disco."""
+    if indentar is None:
+        indentar = not COMPACTO
+    if orjson is not None:
+        opciones = orjson.OPT_NON_STR_KEYS
+        if indentar:
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=opciones)
+    if indentar:
+        texto = json.dumps(data, ensure_ascii=False, indent=2)
+    else:
+        texto = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return texto.encode('utf-8')
+
+
+def dumps(data, indentar=None):
+    """Como dumps_bytes() pero devuelve str."""
+    return dumps_bytes(data, indentar).decode('utf-8')
+
+
+def loads(texto):
+    """Parsea str o bytes."""
+    if orjson is not None:
+        return orjson.loads(texto)
+    return json.loads(texto)
+
+
+def load(f):
+    """Reemplazo de json.load(f)."""
+    return loads(f.read())
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    """
+    Proveedor de Flask que usa orjson cuando está disponible.
+
+    Mantiene el comportamiento del proveedor por defecto: claves ordenadas
+    según sort_keys, fechas en formato HTTP y el resto de tipos especiales
+    resueltos con DefaultJSONProvider.default.
+    """
+
+    def _opciones(self, indent=None):
+        opciones = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            opciones |= orjson.OPT_SORT_KEYS
+        if indent:
+            opciones |= orjson.OPT_INDENT_2
+        return opciones
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'indent', 'separators', 'sort_keys', 'default', 'ensure_ascii'}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default,
+                            option=self._opciones(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indentar = (self.compact is None and self._app.debug) or self.compact is False
+        indent = 2 if indentar else None
+        cuerpo = orjson.dumps(obj, default=self.default, option=self._opciones(indent)) + b'\n'
+        return self._app.response_class(cuerpo, mimetype=self.mimetype)
@@ -0,0 +1,102 @@
+# =============================================================================
+# LIDERAZGO - Un solo worker ejecuta las tareas programadas
+# =============================================================================
+# Con varios workers de gunicorn cada uno importa app.py; si todos iniciaran
+# el BackgroundScheduler, el backup de las 00:00 (y cualquier otra tarea
+# programada) correría una vez por worker.
+#
+# El líder es el proceso que tiene el bloqueo exclusivo (flock) de
+# .lider_scheduler.lock. Lo toma el primero que llega y lo conserva mientras
+# viva, porque el descriptor nunca se cierra; los demás reintentan cada
+# INTERVALO_ELECCION segundos. Si el líder muere el sistema operativo libera
+# el bloqueo y otro worker lo toma en el siguiente intento (failover).
+#
+# El archivo contiene el pid del líder actual, solo como información.
+# =============================================================================
+
+import json
+import os
+import threading
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): un solo proceso, siempre líder
+    fcntl = None
+
+try:
+    from .persistencia import ruta_datos
+except ImportError:
+    from persistencia import ruta_datos
+
+ARCHIVO_LIDER = '.lider_scheduler.lock'
+INTERVALO_ELECCION = 5
+
+_estado = {'lider': False, 'desde': None, 'archivo': None}
+_estado_lock = threading.Lock()
+
+
+def _intentar(al_ganar):
+    """Toma el liderazgo si está libre; devuelve True si este proceso es líder."""
+    with _estado_lock:
+        if _estado['lider']:
+            return True
+        desde = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        if fcntl is not None:
+            archivo = open(ruta_datos(ARCHIVO_LIDER), 'a+')
+            try:
+                fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                archivo.close()
+                return False
+            # Mantener el descriptor abierto: cerrarlo liberaría el liderazgo
+            archivo.seek(0)
+            archivo.truncate()
+            archivo.write(json.dumps({'pid': os.getpid(), 'desde': desde}))
+            archivo.flush()
+            _estado['archivo'] = archivo
+        _estado['lider'] = True
+        _estado['desde'] = desde
+
+    print(f"[LIDER] 👑 El proceso {os.getpid()} ejecutará las tareas programadas")
+    al_ganar()
+    return True
+
+
+def _esperar_liderazgo(al_ganar):
+    evento = threading.Event()
+    while not _intentar(al_ganar):
+        evento.wait(INTERVALO_ELECCION)
+
+
+def competir(al_ganar):
+    """
+    Ejecuta `al_ganar` (una sola vez) cuando este proceso sea el líder.
+
+    Devuelve True si lo es de inmediato; si no, queda un hilo reintentando
+    para tomar el relevo si el líder actual termina.
+    """
+    if _intentar(al_ganar):
+        return True
+    threading.Thread(target=_esperar_liderazgo, args=(al_ganar,), name='eleccion-lider', daemon=True).start()
+    return False
+
+
+def es_lider():
+    return _estado['lider']
+
+
+def estado():
+    """Información del liderazgo vista desde este proceso."""
+    lider = None
+    try:
+        with open(ruta_datos(ARCHIVO_LIDER), 'r', encoding='utf-8') as f:
+            lider = json.loads(f.read() or 'null')
+    except (FileNotFoundError, ValueError):
+        pass
+    return {
+        'pid': os.getpid(),
+        'es_lider': _estado['lider'],
+        'lider_desde': _estado['desde'],
+        'lider': lider
+    }
@@ -0,0 +1,91 @@
+# =============================================================================
+# MIGRACIONES - Cambios de esquema de los archivos JSON
+# =============================================================================
+# Cada archivo guarda su 'version_esquema'. Al iniciar la app (o ejecutando
+# `python migraciones.py`) se aplican en orden las migraciones pendientes.
+# Todas son idempotentes y se ejecutan bajo bloqueo, de modo que varios
+# workers arrancando a la vez no las repiten.
+#
+#   v1: timestamps numéricos (<campo>_ts) para fechas de consultas,
+#       movimientos de stock y vencimientos del inventario
+#   v2: 'version' inicial en consultas, pacientes y productos (control de
+#       concurrencia, ver versiones.py)
+# =============================================================================
+
+try:
+    from .persistencia import leer_json, escribir_json, bloqueo
+    from .tiempos import sellar
+except ImportError:
+    from persistencia import leer_json, escribir_json, bloqueo
+    from tiempos import sellar
+
+
+def _sellar_lista(registros, campo):
+    """Agrega <campo>_ts a cada registro; devuelve cuántas fechas son inválidas."""
+    invalidas = 0
+    for registro in registros:
+        try:
+            sellar(registro, campo)
+        except ValueError:
+            registro[f'{campo}_ts'] = None
+            invalidas += 1
+    return invalidas
+
+
+def _v1_consultas(data):
+    return _sellar_lista(data.get('consultas', []), 'fecha_registro')
+
+
+def _v1_movimientos(data):
+    return _sellar_lista(data.get('movimientos', []), 'fecha')
+
+
+def _v1_inventario(data):
+    return _sellar_lista(data.get('medicamentos', []), 'fecha_vencimiento')
+
+
+def _v2_versiones(lista):
+    def migrar(data):
+        for registro in data.get(lista, []):
+            registro.setdefault('version', 1)
+        return 0
+    return migrar
+
+
+MIGRACIONES = {
+    'consultas.json': [(1, _v1_consultas), (2, _v2_versiones('consultas'))],
+    'movimientos_stock.json': [(1, _v1_movimientos)],
+    'inventario.json': [(1, _v1_inventario), (2, _v2_versiones('medicamentos'))],
+    'pacientes.json': [(2, _v2_versiones('pacientes'))]
+}
+
+
+def migrar_archivo(nombre):
+    """Aplica las migraciones pendientes de un archivo; devuelve las aplicadas."""
+    aplicadas = []
+    with bloqueo(nombre):
+        data = leer_json(nombre)
+        if data is None:
+            return aplicadas
+        version = data.get('version_esquema', 0)
+        for version_destino, migracion in MIGRACIONES[nombre]:
+            if version_destino <= version:
+                continue
+            invalidas = migracion(data)
+            if invalidas:
+                print(f"[MIGRACION] ⚠️ {nombre} v{version_destino}: {invalidas} fecha(s) inválida(s) sin timestamp")
+            data['version_esquema'] = version = version_destino
+            aplicadas.append(version_destino)
+        if aplicadas:
+            escribir_json(nombre, data)
+            print(f"[MIGRACION] ✅ {nombre} migrado a v{version}")
+    return aplicadas
+
+
+def migrar_todo():
+    """Migra todos los archivos con esquema versionado."""
+    return {nombre: migrar_archivo(nombre) for nombre in MIGRACIONES}
+
+
+if __name__ == '__main__':
+    migrar_todo()
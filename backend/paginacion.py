@@ -0,0 +1,80 @@
+# =============================================================================
+# PAGINACIÓN - Paginación por cursor para los listados de la API
+# =============================================================================
+# Los listados aceptan ?limite=N y ?cursor=... (ambos opcionales; sin ellos
+# se devuelve la colección completa como siempre). Cada colección se ordena
+# por una clave estable y única (termina en el id del registro), y el cursor
+# es esa clave del último elemento entregado, codificada en base64.
+#
+# A diferencia de un offset, el cursor no se desplaza si entre dos páginas
+# se agregan o eliminan registros: la página siguiente empieza justo después
+# del último elemento visto.
+# =============================================================================
+
+import base64
+import json
+from bisect import bisect_right
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+
+def codificar_cursor(clave):
+    """Convierte la clave de orden de un registro en un cursor opaco."""
+    texto = json.dumps(list(clave), separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Inversa de codificar_cursor(); ValueError si el cursor no es válido."""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        clave = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(clave, list) or not clave:
+        raise ValueError('Cursor inválido')
+    return tuple(clave)
+
+
+def leer_paginacion(args):
+    """
+    Obtiene (limite, cursor) de la query string.
+
+    Devuelve None si no se pidió paginación, para que el endpoint responda
+    con el listado completo (compatibilidad con los clientes existentes).
+    """
+    if 'limite' not in args and 'cursor' not in args:
+        return None
+    try:
+        limite = int(args.get('limite') or LIMITE_POR_DEFECTO)
+    except ValueError:
+        limite = 0
+    if limite < 1:
+        raise ValueError('El parámetro limite debe ser un entero positivo')
+    cursor = args.get('cursor') or None
+    return min(limite, LIMITE_MAXIMO), decodificar_cursor(cursor) if cursor else None
+
+
+def paginar(registros, clave, limite, cursor=None):
+    """
+    Página de `registros` en el orden de `clave` a partir de `cursor`.
+
+    Devuelve (pagina, siguiente_cursor); siguiente_cursor es None en la
+    última página.
+    """
+    claves = [clave(r) for r in registros]
+    orden = sorted(range(len(registros)), key=claves.__getitem__)
+    claves_ordenadas = [claves[i] for i in orden]
+
+    inicio = 0
+    if cursor is not None:
+        try:
+            inicio = bisect_right(claves_ordenadas, cursor)
+        except TypeError:
+            raise ValueError('Cursor inválido')
+
+    fin = inicio + limite
+    pagina = [registros[i] for i in orden[inicio:fin]]
+    siguiente = codificar_cursor(claves_ordenadas[fin - 1]) if fin < len(orden) else None
+    return pagina, siguiente
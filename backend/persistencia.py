@@ -0,0 +1,80 @@
+# =============================================================================
+# PERSISTENCIA - Utilidades compartidas de lectura/escritura de archivos JSON
+# =============================================================================
+# Lo usan los módulos que mantienen archivos derivados (contadores, secuencias,
+# etc.) y que pueden ser escritos por varios workers de gunicorn a la vez.
+#
+#   - ruta_datos(): ruta absoluta dentro del directorio backend
+#   - leer_json() / escribir_json(): lectura segura y escritura atómica
+#   - bloqueo(): exclusión mutua entre hilos y procesos sobre un archivo
+# =============================================================================
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    from . import json_rapido
+except ImportError:
+    import json_rapido
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): solo bloqueo entre hilos
+    fcntl = None
+
+_BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+_bloqueos_locales = {}
+_bloqueos_locales_lock = threading.Lock()
+
+
+def ruta_datos(nombre):
+    """Obtiene la ruta absoluta de un archivo del directorio backend."""
+    return os.path.join(_BASE_PATH, nombre)
+
+
+def leer_json(nombre, default=None):
+    """Carga un archivo JSON; devuelve `default` si no existe o está corrupto."""
+    try:
+        with open(ruta_datos(nombre), 'rb') as f:
+            return json_rapido.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def ruta_temporal(ruta):
+    """Archivo temporal para escribir `ruta` y luego renombrarlo, único por proceso e hilo."""
+    return f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def escribir_json(nombre, data):
+    """Escribe un archivo JSON de forma atómica (archivo temporal + rename)."""
+    ruta = ruta_datos(nombre)
+    ruta_tmp = ruta_temporal(ruta)
+    with open(ruta_tmp, 'wb') as f:
+        f.write(json_rapido.dumps_bytes(data))
+    os.replace(ruta_tmp, ruta)
+
+
+def _bloqueo_local(nombre):
+    with _bloqueos_locales_lock:
+        if nombre not in _bloqueos_locales:
+            _bloqueos_locales[nombre] = threading.Lock()
+        return _bloqueos_locales[nombre]
+
+
+@contextmanager
+def bloqueo(nombre):
+    """Bloqueo exclusivo asociado a `nombre` (válido entre hilos y workers)."""
+    with _bloqueo_local(nombre):
+        if fcntl is None:
+            yield
+            return
+        with open(ruta_datos(f".{nombre}.lock"), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
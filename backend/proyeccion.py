@@ -0,0 +1,56 @@
+# =============================================================================
+# PROYECCIÓN - Respuestas parciales con ?campos=
+# =============================================================================
+# Los listados y fichas aceptan ?campos=id,numero_ticket,paciente.nombre para
+# devolver solo esas claves de cada registro. Los campos anidados se indican
+# con punto; si el valor intermedio es una lista (por ejemplo
+# medicamentos_recetados.nombre) la proyección se aplica a cada elemento.
+#
+# La proyección se hace antes de serializar, así los registros descartados
+# nunca pasan por jsonify. Sin ?campos= la respuesta es la de siempre.
+# =============================================================================
+
+
+def leer_campos(args):
+    """
+    Convierte ?campos= en un árbol {clave: subárbol | None}.
+
+    Devuelve None si no se pidió proyección; ValueError si está mal formado.
+    """
+    texto = args.get('campos')
+    if texto is None:
+        return None
+
+    arbol = {}
+    for ruta in texto.split(','):
+        ruta = ruta.strip()
+        if not ruta:
+            continue
+        partes = ruta.split('.')
+        if not all(partes):
+            raise ValueError(f"Campo inválido: '{ruta}'")
+        nodo = arbol
+        for parte in partes[:-1]:
+            if nodo.get(parte, {}) is None:
+                break  # Ya se pidió el campo completo
+            nodo = nodo.setdefault(parte, {})
+        else:
+            nodo[partes[-1]] = None
+    if not arbol:
+        raise ValueError('El parámetro campos está vacío')
+    return arbol
+
+
+def proyectar(valor, arbol):
+    """Reduce un registro (o lista de registros) a las claves de `arbol`."""
+    if arbol is None:
+        return valor
+    if isinstance(valor, list):
+        return [proyectar(v, arbol) for v in valor]
+    if not isinstance(valor, dict):
+        return valor
+    return {
+        clave: valor[clave] if subarbol is None else proyectar(valor[clave], subarbol)
+        for clave, subarbol in arbol.items()
+        if clave in valor
+    }
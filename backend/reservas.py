@@ -0,0 +1,245 @@
+# =============================================================================
+# RESERVAS - Stock apartado al recetar y descontado al cobrar
+# =============================================================================
+# Al guardar un diagnóstico las cantidades recetadas quedan reservadas para
+# esa consulta; otra receta solo puede apartar lo que quede libre
+# (stock - reservado). La reserva se libera al devolver la consulta a la cola
+# o al vencer (HORAS_RESERVA), y al cobrar se convierte en venta: se descuenta
+# el stock y se borra la reserva.
+#
+# Cada producto tiene su propio archivo reservas/<producto_id>.json y su
+# propio bloqueo, así dos recetas con productos distintos nunca se esperan:
+#
+#   - entre hilos: un threading.Lock por producto
+#   - entre workers: bloqueo fcntl del byte <producto_id> de .reservas.lock
+#
+# Los bloqueos fcntl por rango pertenecen al proceso y se pierden al cerrar
+# cualquier descriptor del archivo, por eso cada proceso mantiene uno solo
+# abierto. Cuando hay varios productos se bloquean en orden de id.
+#
+# Limitación: los bloqueos por producto protegen solo los archivos de
+# reservas. El stock sigue en inventario.json, así que vender() lo descuenta
+# con versiones.actualizar_registros(), que toma el bloqueo de todo el
+# archivo y lo reescribe: dos cobros de productos distintos sí se esperan
+# durante esa escritura (corta) del inventario.
+# =============================================================================
+
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): solo bloqueo entre hilos
+    fcntl = None
+
+try:
+    from .persistencia import leer_json, escribir_json, ruta_datos
+    from .tiempos import epoch_ahora
+    from .versiones import actualizar_registros
+except ImportError:
+    from persistencia import leer_json, escribir_json, ruta_datos
+    from tiempos import epoch_ahora
+    from versiones import actualizar_registros
+
+CARPETA_RESERVAS = 'reservas'
+ARCHIVO_BLOQUEOS = '.reservas.lock'
+HORAS_RESERVA = float(os.environ.get('VETERINARIA_HORAS_RESERVA', '24'))
+
+_bloqueos_locales = {}
+_bloqueos_locales_lock = threading.Lock()
+_descriptor = {'pid': None, 'archivo': None}
+
+
+# -----------------------------------------------------------------------------
+# Bloqueo por producto
+# -----------------------------------------------------------------------------
+
+def _archivo_bloqueos():
+    with _bloqueos_locales_lock:
+        if _descriptor['pid'] != os.getpid():
+            _descriptor['archivo'] = open(ruta_datos(ARCHIVO_BLOQUEOS), 'a+')
+            _descriptor['pid'] = os.getpid()
+        return _descriptor['archivo']
+
+
+def _bloqueo_local(producto_id):
+    with _bloqueos_locales_lock:
+        if producto_id not in _bloqueos_locales:
+            _bloqueos_locales[producto_id] = threading.Lock()
+        return _bloqueos_locales[producto_id]
+
+
+@contextmanager
+def _bloqueo_producto(producto_id):
+    with _bloqueo_local(producto_id):
+        if fcntl is None:
+            yield
+            return
+        archivo = _archivo_bloqueos()
+        fcntl.lockf(archivo, fcntl.LOCK_EX, 1, producto_id)
+        try:
+            yield
+        finally:
+            fcntl.lockf(archivo, fcntl.LOCK_UN, 1, producto_id)
+
+
+@contextmanager
+def bloqueo_productos(ids):
+    """Bloquea los productos `ids` (en orden, para evitar interbloqueos)."""
+    # El id es offset del bloqueo y nombre de archivo: solo enteros no negativos
+    if any(type(producto_id) is not int or producto_id < 0 for producto_id in ids):
+        raise ValueError(f'IDs de producto inválidos: {sorted(map(repr, ids))}')
+    with ExitStack() as pila:
+        for producto_id in sorted(set(ids)):
+            pila.enter_context(_bloqueo_producto(producto_id))
+        yield
+
+
+# -----------------------------------------------------------------------------
+# Archivos de reservas
+# -----------------------------------------------------------------------------
+
+def _archivo(producto_id):
+    return os.path.join(CARPETA_RESERVAS, f'{producto_id}.json')
+
+
+def _leer(producto_id, ahora):
+    """Reservas vigentes de un producto: {consulta_id (str): {cantidad, expira}}."""
+    reservas = leer_json(_archivo(producto_id), default={})
+    return {clave: r for clave, r in reservas.items() if r.get('expira', 0) > ahora}
+
+
+def _escribir(producto_id, reservas):
+    if reservas:
+        os.makedirs(ruta_datos(CARPETA_RESERVAS), exist_ok=True)
+        escribir_json(_archivo(producto_id), reservas)
+        return
+    try:
+        os.remove(ruta_datos(_archivo(producto_id)))
+    except FileNotFoundError:
+        pass
+
+
+def _stock_en_disco():
+    inventario = leer_json('inventario.json', default={})
+    return {p['id']: p.get('stock', 0) for p in inventario.get('medicamentos', [])}
+
+
+# -----------------------------------------------------------------------------
+# Operaciones
+# -----------------------------------------------------------------------------
+
+def reservar(consulta_id, items, anteriores=()):
+    """
+    Aparta stock para la receta de una consulta.
+
+    items: {producto_id: cantidad}. Reemplaza la reserva previa de la
+    consulta (`anteriores` son los productos de la receta anterior). Si no
+    alcanza se reserva lo que haya libre. Devuelve
+    {producto_id: {'disponible': libre antes de reservar, 'reservado': n}}.
+    """
+    clave = str(consulta_id)
+    ahora = epoch_ahora()
+    expira = ahora + int(HORAS_RESERVA * 3600)
+    resultado = {}
+
+    with bloqueo_productos(set(items) | set(anteriores)):
+        stock = _stock_en_disco()
+        for producto_id in sorted(set(items) | set(anteriores)):
+            reservas = _leer(producto_id, ahora)
+            reservas.pop(clave, None)
+            if producto_id in items and producto_id in stock:
+                apartado = sum(r['cantidad'] for r in reservas.values())
+                disponible = max(0, stock[producto_id] - apartado)
+                cantidad = min(items[producto_id], disponible)
+                if cantidad > 0:
+                    reservas[clave] = {'cantidad': cantidad, 'expira': expira}
+                resultado[producto_id] = {'disponible': disponible, 'reservado': cantidad}
+            _escribir(producto_id, reservas)
+    return resultado
+
+
+def liberar(consulta_id, ids):
+    """Libera la reserva de una consulta sobre los productos `ids`."""
+    clave = str(consulta_id)
+    ahora = epoch_ahora()
+    with bloqueo_productos(ids):
+        for producto_id in sorted(set(ids)):
+            reservas = _leer(producto_id, ahora)
+            if reservas.pop(clave, None) is not None:
+                _escribir(producto_id, reservas)
+
+
+def vender(consulta_id, vendidos, reservados=()):
+    """
+    Convierte la reserva de una consulta en venta.
+
+    vendidos: {producto_id: cantidad} a descontar del stock; `reservados`
+    son los productos que la consulta tenía apartados (se liberan aunque al
+    cobrar se hayan quitado de la receta). Devuelve el inventario escrito.
+
+    El descuento de stock pasa por el bloqueo de inventario.json (ver la
+    limitación en el encabezado del módulo).
+    """
+    clave = str(consulta_id)
+    ahora = epoch_ahora()
+    ids = set(vendidos) | set(reservados)
+
+    def descontar(cantidad):
+        def aplicar(producto):
+            producto['stock'] = max(0, producto.get('stock', 0) - cantidad)
+        return aplicar
+
+    with bloqueo_productos(ids):
+        inventario = actualizar_registros(
+            'inventario.json', 'medicamentos',
+            {producto_id: descontar(cantidad) for producto_id, cantidad in vendidos.items()}
+        )
+        for producto_id in sorted(ids):
+            reservas = _leer(producto_id, ahora)
+            if reservas.pop(clave, None) is not None:
+                _escribir(producto_id, reservas)
+    return inventario
+
+
+def reservado_por_producto():
+    """{producto_id: {'total': n, 'consultas': {consulta_id: cantidad}}} de las reservas vigentes."""
+    carpeta = ruta_datos(CARPETA_RESERVAS)
+    if not os.path.isdir(carpeta):
+        return {}
+    ahora = epoch_ahora()
+    resultado = {}
+    for nombre in os.listdir(carpeta):
+        if not nombre.endswith('.json') or not nombre[:-5].isdigit():
+            continue
+        producto_id = int(nombre[:-5])
+        reservas = _leer(producto_id, ahora)
+        if reservas:
+            resultado[producto_id] = {
+                'total': sum(r['cantidad'] for r in reservas.values()),
+                'consultas': {int(clave): r['cantidad'] for clave, r in reservas.items()}
+            }
+    return resultado
+
+
+def liberar_vencidas():
+    """Borra las reservas vencidas (tarea programada); devuelve cuántas liberó."""
+    carpeta = ruta_datos(CARPETA_RESERVAS)
+    if not os.path.isdir(carpeta):
+        return 0
+    ahora = epoch_ahora()
+    liberadas = 0
+    for nombre in os.listdir(carpeta):
+        if not nombre.endswith('.json') or not nombre[:-5].isdigit():
+            continue
+        producto_id = int(nombre[:-5])
+        with bloqueo_productos([producto_id]):
+            todas = leer_json(_archivo(producto_id), default={})
+            vigentes = {clave: r for clave, r in todas.items() if r.get('expira', 0) > ahora}
+            if len(vigentes) != len(todas):
+                liberadas += len(todas) - len(vigentes)
+                _escribir(producto_id, vigentes)
+    if liberadas:
+        print(f"[RESERVAS] 🗑️ {liberadas} reserva(s) vencida(s) liberada(s)")
+    return liberadas
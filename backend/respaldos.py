@@ -0,0 +1,404 @@
+# =============================================================================
+# RESPALDOS - Backups incrementales direccionados por contenido
+# =============================================================================
+# Cada versión de un archivo se guarda una sola vez, comprimida y nombrada por
+# el SHA-256 de su contenido; un backup es solo un manifiesto que indica qué
+# versión tenía cada archivo en ese momento:
+#
+#   backups/objetos/<2 hex>/<sha256>.gz   contenido de un archivo (gzip)
+#   backups/manifiestos/<nombre>.json     {archivo: {hash, tamano, mtime_ns}}
+#
+# Un backup nocturno en el que solo cambió consultas.json escribe un objeto y
+# un manifiesto pequeño. Los archivos cuya fecha de modificación y tamaño
+# coinciden con el backup anterior ni siquiera se vuelven a leer.
+#
+# Las descargas se arman como ZIP en streaming (zip_en_streaming): cada archivo
+# se lee y comprime por bloques y lo comprimido se envía de inmediato, así la
+# memoria usada no depende del tamaño de los datos.
+#
+# estado_en() reconstruye los datos de cualquier instante combinando el backup
+# anterior con el diario de mutaciones (ver diario.py).
+#
+# La retención es por antigüedad (DIAS_RETENCION, conservando siempre los
+# MINIMO_RESPALDOS más recientes); al borrar manifiestos se eliminan los
+# objetos que ya no usa ninguno y los días del diario previos al backup más
+# antiguo. Los backups ZIP completos del sistema
+# anterior (backups/backup_*.zip) se siguen listando y restaurando.
+# =============================================================================
+
+import calendar
+import gzip
+import hashlib
+import os
+import time
+import zipfile
+from datetime import datetime
+
+try:
+    from . import diario, json_rapido
+    from .persistencia import leer_json, escribir_json, ruta_datos, ruta_temporal, bloqueo
+    from .tiempos import epoch_ahora
+except ImportError:
+    import diario, json_rapido
+    from persistencia import leer_json, escribir_json, ruta_datos, ruta_temporal, bloqueo
+    from tiempos import epoch_ahora
+
+CARPETA_RESPALDOS = 'backups'
+CARPETA_OBJETOS = os.path.join(CARPETA_RESPALDOS, 'objetos')
+CARPETA_MANIFIESTOS = os.path.join(CARPETA_RESPALDOS, 'manifiestos')
+DIAS_RETENCION = int(os.environ.get('VETERINARIA_DIAS_BACKUP', '180'))
+MINIMO_RESPALDOS = 7
+MARGEN_DIARIO = 60          # Segundos del diario repetidos antes del backup (escrituras durante su creación)
+NIVEL_COMPRESION = 6
+TAMANO_BLOQUE = 64 * 1024   # Bytes leídos por vez y tamaño mínimo de cada parte enviada
+
+
+def formatear_tamano(n):
+    if n >= 1024 * 1024:
+        return f"{n / (1024 * 1024):.1f} MB"
+    return f"{n / 1024:.1f} KB"
+
+
+# -----------------------------------------------------------------------------
+# Objetos
+# -----------------------------------------------------------------------------
+
+def _ruta_objeto(hash_contenido):
+    return ruta_datos(os.path.join(CARPETA_OBJETOS, hash_contenido[:2], f'{hash_contenido}.gz'))
+
+
+def _guardar_objeto(contenido):
+    """Guarda el contenido si no existía; devuelve (hash, bytes escritos en disco)."""
+    hash_contenido = hashlib.sha256(contenido).hexdigest()
+    ruta = _ruta_objeto(hash_contenido)
+    if os.path.exists(ruta):
+        return hash_contenido, 0
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    comprimido = gzip.compress(contenido, compresslevel=NIVEL_COMPRESION, mtime=0)
+    ruta_tmp = ruta_temporal(ruta)
+    with open(ruta_tmp, 'wb') as f:
+        f.write(comprimido)
+    os.replace(ruta_tmp, ruta)
+    return hash_contenido, len(comprimido)
+
+
+def abrir_objeto(hash_contenido):
+    """Archivo (binario, ya descomprimido) con el contenido de un objeto."""
+    return gzip.open(_ruta_objeto(hash_contenido), 'rb')
+
+
+def leer_objeto(hash_contenido):
+    with abrir_objeto(hash_contenido) as f:
+        return f.read()
+
+
+# -----------------------------------------------------------------------------
+# Manifiestos
+# -----------------------------------------------------------------------------
+
+def _nombres_manifiestos():
+    carpeta = ruta_datos(CARPETA_MANIFIESTOS)
+    if not os.path.isdir(carpeta):
+        return []
+    return sorted((f[:-5] for f in os.listdir(carpeta) if f.startswith('backup_') and f.endswith('.json')), reverse=True)
+
+
+def obtener(nombre):
+    """Manifiesto de un backup incremental (None si no existe)."""
+    if not nombre.startswith('backup_') or os.sep in nombre or '/' in nombre:
+        return None
+    return leer_json(os.path.join(CARPETA_MANIFIESTOS, f'{nombre}.json'))
+
+
+def crear(archivos, origen='manual'):
+    """
+    Crea un backup de `archivos` (relativos al directorio backend).
+
+    Devuelve el manifiesto, con 'nuevos' (objetos escritos) y 'bytes_nuevos'.
+    """
+    os.makedirs(ruta_datos(CARPETA_MANIFIESTOS), exist_ok=True)
+    with bloqueo('backups'):
+        anteriores = _nombres_manifiestos()
+        previo = (obtener(anteriores[0]) or {}).get('archivos', {}) if anteriores else {}
+
+        ahora = datetime.now()
+        nombre = f"backup_{ahora.strftime('%Y-%m-%d_%H-%M-%S')}"
+        if nombre in anteriores:
+            nombre = f"{nombre}_{int(time.time() * 1000) % 1000:03d}"
+
+        entradas = {}
+        nuevos = bytes_nuevos = 0
+        for archivo in archivos:
+            # Bajo el bloqueo del archivo, ninguna escritura queda a medias
+            # entre el archivo y su entrada en el diario
+            with bloqueo(archivo):
+                try:
+                    f = open(ruta_datos(archivo), 'rb')
+                except FileNotFoundError:
+                    continue
+                with f:
+                    info = os.fstat(f.fileno())
+                    anterior = previo.get(archivo)
+                    if (anterior and anterior.get('mtime_ns') == info.st_mtime_ns
+                            and anterior.get('tamano') == info.st_size
+                            and os.path.exists(_ruta_objeto(anterior['hash']))):
+                        entradas[archivo] = anterior
+                        continue
+                    hash_contenido, escritos = _guardar_objeto(f.read())
+            entradas[archivo] = {'hash': hash_contenido, 'tamano': info.st_size, 'mtime_ns': info.st_mtime_ns}
+            if escritos:
+                nuevos += 1
+                bytes_nuevos += escritos
+
+        # La fecha se toma después de leer los archivos: nada de lo respaldado
+        # es posterior a 'fecha_ts' (epoch local con fracción, como el diario)
+        tomado = datetime.now()
+        manifiesto = {
+            'nombre': nombre,
+            'fecha': tomado.strftime('%Y-%m-%d %H:%M:%S'),
+            'fecha_ts': calendar.timegm(tomado.timetuple()) + tomado.microsecond / 1e6,
+            'origen': origen,
+            'archivos': entradas,
+            'nuevos': nuevos,
+            'bytes_nuevos': bytes_nuevos
+        }
+        escribir_json(os.path.join(CARPETA_MANIFIESTOS, f'{nombre}.json'), manifiesto)
+    return manifiesto
+
+
+def ruta_zip_legado(nombre):
+    """Ruta de un backup ZIP del sistema anterior (None si no existe)."""
+    if not (nombre.startswith('backup_') and nombre.endswith('.zip')) or os.sep in nombre or '/' in nombre:
+        return None
+    ruta = ruta_datos(os.path.join(CARPETA_RESPALDOS, nombre))
+    return ruta if os.path.exists(ruta) else None
+
+
+def existe(nombre):
+    return obtener(nombre) is not None or ruta_zip_legado(nombre) is not None
+
+
+def contenidos(nombre, archivos=None):
+    """Genera (archivo, bytes) de cada archivo de un backup (incremental o ZIP)."""
+    manifiesto = obtener(nombre)
+    if manifiesto is not None:
+        for archivo, entrada in manifiesto['archivos'].items():
+            if archivos is None or archivo in archivos:
+                yield archivo, leer_objeto(entrada['hash'])
+        return
+    ruta = ruta_zip_legado(nombre)
+    if ruta is None:
+        raise FileNotFoundError(nombre)
+    with zipfile.ZipFile(ruta, 'r') as zipf:
+        for archivo in zipf.namelist():
+            if archivos is None or archivo in archivos:
+                yield archivo, zipf.read(archivo)
+
+
+def listar():
+    """Backups disponibles, del más reciente al más antiguo."""
+    backups = []
+    for nombre in _nombres_manifiestos():
+        manifiesto = obtener(nombre)
+        if manifiesto is None:
+            continue
+        backups.append({
+            'nombre': nombre,
+            'fecha': manifiesto['fecha'],
+            'tipo': 'incremental',
+            'origen': manifiesto.get('origen'),
+            'archivos': len(manifiesto['archivos']),
+            'tamaño': formatear_tamano(sum(e['tamano'] for e in manifiesto['archivos'].values())),
+            'nuevo': formatear_tamano(manifiesto.get('bytes_nuevos', 0))
+        })
+
+    carpeta = ruta_datos(CARPETA_RESPALDOS)
+    if os.path.isdir(carpeta):
+        for f in os.listdir(carpeta):
+            if f.startswith('backup_') and f.endswith('.zip'):
+                backups.append({
+                    'nombre': f,
+                    'fecha': f.replace('backup_', '').replace('.zip', '').replace('_', ' '),
+                    'tipo': 'zip',
+                    'tamaño': formatear_tamano(os.path.getsize(os.path.join(carpeta, f)))
+                })
+    backups.sort(key=lambda b: b['nombre'].replace('.zip', ''), reverse=True)
+    return backups
+
+
+def uso_disco():
+    """Objetos almacenados y espacio que ocupan (comprimidos)."""
+    objetos = total = 0
+    carpeta = ruta_datos(CARPETA_OBJETOS)
+    if os.path.isdir(carpeta):
+        for raiz, _, nombres in os.walk(carpeta):
+            for f in nombres:
+                if f.endswith('.gz'):
+                    objetos += 1
+                    total += os.path.getsize(os.path.join(raiz, f))
+    return {'objetos': objetos, 'bytes': total, 'tamaño': formatear_tamano(total)}
+
+
+# -----------------------------------------------------------------------------
+# Descarga en streaming
+# -----------------------------------------------------------------------------
+
+class _SalidaZip:
+    """Destino no posicionable para zipfile: acumula lo escrito hasta que se retira."""
+
+    def __init__(self):
+        self._partes = []
+        self.pendiente = 0
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self.pendiente += len(datos)
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b''.join(self._partes)
+        self._partes.clear()
+        self.pendiente = 0
+        return datos
+
+
+def zip_en_streaming(fuentes, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Genera un ZIP por partes.
+
+    fuentes: pares (nombre dentro del ZIP, función que abre el archivo en
+    modo binario). Como la salida no es posicionable, zipfile escribe el
+    tamaño de cada archivo después de sus datos (data descriptor).
+    """
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for nombre, abrir in fuentes:
+            try:
+                origen = abrir()
+            except FileNotFoundError:
+                print(f"[BACKUP] ⚠️ {nombre} no encontrado, se omite de la descarga")
+                continue
+            with origen, zipf.open(nombre, 'w', force_zip64=True) as destino:
+                while True:
+                    bloque = origen.read(tamano_bloque)
+                    if not bloque:
+                        break
+                    destino.write(bloque)
+                    if salida.pendiente >= tamano_bloque:
+                        yield salida.retirar()
+    # Al cerrar se escribe el directorio central
+    yield salida.retirar()
+
+
+def zip_actual(archivos):
+    """ZIP en streaming con el estado actual de `archivos`."""
+    return zip_en_streaming(
+        (archivo, lambda archivo=archivo: open(ruta_datos(archivo), 'rb')) for archivo in archivos
+    )
+
+
+def zip_backup(nombre):
+    """ZIP en streaming de un backup incremental (None si no existe)."""
+    manifiesto = obtener(nombre)
+    if manifiesto is None:
+        return None
+    return zip_en_streaming(
+        (archivo, lambda h=entrada['hash']: abrir_objeto(h))
+        for archivo, entrada in manifiesto['archivos'].items()
+    )
+
+
+# -----------------------------------------------------------------------------
+# Restauración a una fecha
+# -----------------------------------------------------------------------------
+
+def anterior_a(hasta_ts):
+    """Manifiesto del backup incremental más reciente tomado hasta `hasta_ts`."""
+    for nombre in _nombres_manifiestos():
+        manifiesto = obtener(nombre)
+        if manifiesto is not None and manifiesto.get('fecha_ts', 0) <= hasta_ts:
+            return manifiesto
+    return None
+
+
+def estado_en(hasta_ts, archivos):
+    """
+    Contenido de `archivos` en el instante `hasta_ts` (epoch local): el
+    backup anterior más las entradas del diario hasta ese momento.
+
+    Devuelve None si no hay backup anterior; si no, un dict con 'backup',
+    'datos' ({archivo: data}), 'entradas' ({archivo: entradas repetidas}) y
+    'advertencia' si el diario empieza después del backup.
+    """
+    manifiesto = anterior_a(hasta_ts)
+    if manifiesto is None:
+        return None
+
+    datos = {
+        archivo: json_rapido.loads(leer_objeto(entrada['hash']))
+        for archivo, entrada in manifiesto['archivos'].items() if archivo in archivos
+    }
+    desde_ts = manifiesto['fecha_ts'] - MARGEN_DIARIO
+    entradas = diario.aplicar(datos, desde_ts, hasta_ts)
+
+    advertencia = None
+    primer_dia = diario.primer_dia()
+    if primer_dia is None or primer_dia.isoformat() > manifiesto['fecha'][:10]:
+        advertencia = (f"El diario de mutaciones comienza {'el ' + primer_dia.isoformat() if primer_dia else 'después'}: "
+                       f"los cambios entre el backup {manifiesto['nombre']} y esa fecha no se pueden repetir")
+    return {'backup': manifiesto['nombre'], 'datos': datos, 'entradas': entradas, 'advertencia': advertencia}
+
+
+# -----------------------------------------------------------------------------
+# Retención
+# -----------------------------------------------------------------------------
+
+def limpiar(dias=DIAS_RETENCION, minimo=MINIMO_RESPALDOS):
+    """
+    Borra los backups con más de `dias` días (conservando los `minimo` más
+    recientes) y los objetos que ya no referencia ningún manifiesto.
+    Devuelve (backups borrados, objetos borrados).
+    """
+    limite = epoch_ahora() - dias * 86400
+    borrados = objetos_borrados = 0
+    with bloqueo('backups'):
+        en_uso = set()
+        mas_antiguo = None
+        for i, nombre in enumerate(_nombres_manifiestos()):
+            manifiesto = obtener(nombre)
+            if manifiesto is None:
+                continue
+            if i >= minimo and manifiesto.get('fecha_ts', 0) < limite:
+                os.remove(ruta_datos(os.path.join(CARPETA_MANIFIESTOS, f'{nombre}.json')))
+                print(f"[BACKUP] 🗑️ Backup antiguo eliminado: {nombre}")
+                borrados += 1
+                continue
+            en_uso.update(e['hash'] for e in manifiesto['archivos'].values())
+            mas_antiguo = manifiesto.get('fecha_ts', mas_antiguo)
+
+        # El diario solo sirve a partir del backup más antiguo que queda
+        if mas_antiguo is not None:
+            diario.limpiar_antes(mas_antiguo - MARGEN_DIARIO)
+
+        carpeta = ruta_datos(CARPETA_RESPALDOS)
+        if os.path.isdir(carpeta):
+            for f in os.listdir(carpeta):
+                ruta = os.path.join(carpeta, f)
+                if f.startswith('backup_') and f.endswith('.zip') and os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+                    print(f"[BACKUP] 🗑️ Backup antiguo eliminado: {f}")
+                    borrados += 1
+
+        carpeta = ruta_datos(CARPETA_OBJETOS)
+        if os.path.isdir(carpeta):
+            for raiz, _, nombres in os.walk(carpeta):
+                for f in nombres:
+                    # Solo se conserva <hash>.gz de un hash en uso; el resto
+                    # incluye temporales de un backup interrumpido
+                    if not (f.endswith('.gz') and f[:-3] in en_uso):
+                        os.remove(os.path.join(raiz, f))
+                        objetos_borrados += 1
+    return borrados, objetos_borrados
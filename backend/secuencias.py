@@ -0,0 +1,140 @@
+# =============================================================================
+# SECUENCIAS - IDs y números de ticket sin reescribir las colecciones
+# =============================================================================
+# Los contadores viven en secuencias.json, un archivo pequeño que se modifica
+# bajo bloqueo (válido entre workers), así que pedir un número no requiere
+# cargar ni guardar consultas.json:
+#
+#   consulta_id   id de cada consulta nueva (nunca se reinicia)
+#   producto_id   id de cada producto nuevo del inventario
+#   paciente_id   id de cada ficha de paciente nueva
+#   ticket        número de ticket BD/WEB/EMG/ESP, compartido por todos los
+#                 prefijos y reiniciado cada año
+#
+# Cada worker puede reservar un bloque de números de una vez
+# (VETERINARIA_BLOQUE_IDS / VETERINARIA_BLOQUE_TICKETS) y entregarlos desde
+# memoria; los números de un bloque sin usar al reiniciar quedan sin asignar.
+# Los tickets usan bloques de 1 por defecto para que sean correlativos.
+#
+# Si secuencias.json no existe, cada contador arranca desde lo que ya hay en
+# disco (id máximo de su colección y mayor número de ticket del año en curso).
+# =============================================================================
+
+import os
+import threading
+from datetime import datetime
+
+try:
+    from .persistencia import leer_json, escribir_json, bloqueo
+except ImportError:
+    from persistencia import leer_json, escribir_json, bloqueo
+
+ARCHIVO_SECUENCIAS = 'secuencias.json'
+
+
+def _inicial_consulta_id():
+    data = leer_json('consultas.json', default={})
+    return max((c.get('id', 0) for c in data.get('consultas', [])), default=0), None
+
+
+def _inicial_producto_id():
+    data = leer_json('inventario.json', default={})
+    return max((m.get('id', 0) for m in data.get('medicamentos', [])), default=0), None
+
+
+def _inicial_paciente_id():
+    data = leer_json('pacientes.json', default={})
+    maximo = max((p.get('id', 0) for p in data.get('pacientes', [])), default=0)
+    return max(maximo, data.get('ultimo_id', 0)), None
+
+
+def _inicial_ticket():
+    """Mayor número de ticket del año en curso entre las consultas (ej: BD-2025-0042 -> 42)."""
+    año = datetime.now().year
+    data = leer_json('consultas.json', default={})
+    numeros = []
+    for consulta in data.get('consultas', []):
+        partes = str(consulta.get('numero_ticket', '')).split('-')
+        if len(partes) == 3 and partes[1] == str(año) and partes[2].isdigit():
+            numeros.append(int(partes[2]))
+    return max(numeros, default=0), año
+
+
+# nombre -> configuración de la secuencia
+SECUENCIAS = {
+    'consulta_id': {
+        'anual': False,
+        'inicial': _inicial_consulta_id,
+        'bloque': int(os.environ.get('VETERINARIA_BLOQUE_IDS', '10'))
+    },
+    'producto_id': {
+        'anual': False,
+        'inicial': _inicial_producto_id,
+        'bloque': 1
+    },
+    'paciente_id': {
+        'anual': False,
+        'inicial': _inicial_paciente_id,
+        'bloque': 1
+    },
+    'ticket': {
+        'anual': True,
+        'inicial': _inicial_ticket,
+        'bloque': int(os.environ.get('VETERINARIA_BLOQUE_TICKETS', '1'))
+    }
+}
+
+_reservas = {}   # nombre -> {'año', 'siguiente', 'tope'} del bloque de este proceso
+_reservas_lock = threading.Lock()
+
+
+def _reservar(nombre, cantidad, año):
+    """Avanza la secuencia en disco `cantidad` números; devuelve el primero."""
+    config = SECUENCIAS[nombre]
+    with bloqueo(ARCHIVO_SECUENCIAS):
+        data = leer_json(ARCHIVO_SECUENCIAS, default={})
+        estado = data.get(nombre)
+        if estado is None:
+            valor, año_inicial = config['inicial']()
+            estado = {'valor': valor, 'año': año_inicial}
+        if config['anual'] and estado.get('año') != año:
+            estado = {'valor': 0, 'año': año}
+        primero = estado['valor'] + 1
+        estado['valor'] += cantidad
+        data[nombre] = estado
+        escribir_json(ARCHIVO_SECUENCIAS, data)
+    return primero
+
+
+def _tomar(nombre, año=None):
+    """Siguiente número de la secuencia, reservando un bloque nuevo si hace falta."""
+    bloque = max(1, SECUENCIAS[nombre]['bloque'])
+    with _reservas_lock:
+        reserva = _reservas.get(nombre)
+        if reserva is None or reserva['siguiente'] > reserva['tope'] or reserva['año'] != año:
+            primero = _reservar(nombre, bloque, año)
+            reserva = _reservas[nombre] = {'año': año, 'siguiente': primero, 'tope': primero + bloque - 1}
+        valor = reserva['siguiente']
+        reserva['siguiente'] += 1
+    return valor
+
+
+def nuevo_id_consulta():
+    """ID único para una consulta nueva."""
+    return _tomar('consulta_id')
+
+
+def nuevo_id_producto():
+    """ID único para un producto nuevo del inventario."""
+    return _tomar('producto_id')
+
+
+def nuevo_id_paciente():
+    """ID único para una ficha de paciente nueva."""
+    return _tomar('paciente_id')
+
+
+def nuevo_ticket(prefijo='BD'):
+    """Número de ticket del año en curso, ej: BD-2025-0042."""
+    año = datetime.now().year
+    return f"{prefijo}-{año}-{str(_tomar('ticket', año)).zfill(4)}"
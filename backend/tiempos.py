@@ -0,0 +1,48 @@
+# =============================================================================
+# TIEMPOS - Representación numérica de las fechas de los registros
+# =============================================================================
+# Las fechas se guardan como texto ISO ('2025-12-22T09:30:00' o '2026-09-17')
+# y, junto a cada una, un campo '<campo>_ts' con los segundos epoch de esa
+# hora local. Así los filtros y ordenamientos comparan enteros en lugar de
+# volver a interpretar texto en cada petición.
+#
+# Las horas son locales y sin zona horaria: se convierten con calendar.timegm
+# para que (ts // 86400) corresponda exactamente al día escrito en el texto.
+# =============================================================================
+
+import calendar
+from datetime import datetime, timedelta
+
+SEGUNDOS_DIA = 86400
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def a_epoch(fecha_iso):
+    """Convierte una fecha ISO a segundos epoch; ValueError si es inválida."""
+    if not isinstance(fecha_iso, str) or not fecha_iso:
+        raise ValueError(f"Fecha inválida: {fecha_iso!r}")
+    fecha = datetime.fromisoformat(fecha_iso.replace('Z', '+00:00'))
+    return calendar.timegm(fecha.timetuple())
+
+
+def desde_epoch(segundos):
+    """Inversa de a_epoch(): datetime sin zona a partir de segundos epoch."""
+    return _EPOCH + timedelta(seconds=int(segundos))
+
+
+def epoch_ahora():
+    """Segundos epoch de la hora local actual."""
+    return calendar.timegm(datetime.now().timetuple())
+
+
+def sellar(registro, campo):
+    """
+    Agrega registro['<campo>_ts'] a partir de registro[campo].
+
+    Un campo vacío deja el timestamp en None; una fecha mal formada lanza
+    ValueError para que el endpoint la rechace antes de guardar.
+    """
+    valor = registro.get(campo)
+    registro[f'{campo}_ts'] = a_epoch(valor) if valor else None
+    return registro
@@ -0,0 +1,326 @@
+# =============================================================================
+# TRABAJOS - Cola persistente de tareas en segundo plano
+# =============================================================================
+# Las tareas lentas (backups, notificaciones, reportes) no se ejecutan en el
+# hilo de la petición: el endpoint llama a encolar() y responde de inmediato
+# con el id del trabajo, que se consulta en /api/trabajos/<id>.
+#
+#   trabajos.db   SQLite compartido por todos los workers de gunicorn
+#
+# Cada proceso levanta HILOS_POR_PROCESO hilos que toman trabajos pendientes
+# de forma atómica (transacción IMMEDIATE), así un trabajo lo ejecuta un solo
+# hilo aunque haya varios workers. Si la tarea falla se reintenta con espera
+# exponencial hasta max_intentos. Mientras un trabajo corre, un hilo aparte
+# actualiza su 'latido' cada INTERVALO_LATIDO segundos: si deja de latir por
+# LATIDO_VENCIDO segundos su worker murió y el trabajo vuelve a la cola (o
+# queda fallido si ya agotó sus intentos). Un trabajo largo que sigue vivo
+# nunca se ejecuta dos veces.
+#
+# Las tareas se registran con registrar(tipo, funcion): la función recibe el
+# dict de parámetros y lo que devuelve (serializable a JSON) queda como
+# resultado del trabajo.
+# =============================================================================
+
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+try:
+    from . import json_rapido
+    from .persistencia import ruta_datos
+except ImportError:
+    import json_rapido
+    from persistencia import ruta_datos
+
+ARCHIVO_TRABAJOS = 'trabajos.db'
+HILOS_POR_PROCESO = int(os.environ.get('VETERINARIA_HILOS_TRABAJOS', '2'))
+MAX_INTENTOS = 3
+ESPERA_REINTENTO = 5              # Segundos; se duplica en cada intento
+INTERVALO_LATIDO = 15             # Segundos entre latidos de un trabajo en curso
+LATIDO_VENCIDO = 90               # Un trabajo en curso sin latir más tiempo que esto se da por abandonado
+INTERVALO_SONDEO = 1.0            # Revisión de trabajos encolados por otros workers
+DIAS_HISTORIAL = 7                # Los trabajos terminados se borran después de esto
+
+ESTADOS = ('pendiente', 'en_curso', 'completado', 'fallido')
+
+_tareas = {}
+_aviso = threading.Event()
+_hilos = []
+_hilos_lock = threading.Lock()
+_local = threading.local()
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    parametros TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    max_intentos INTEGER NOT NULL,
+    resultado TEXT,
+    error TEXT,
+    creado REAL NOT NULL,
+    disponible_desde REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    worker TEXT,
+    latido REAL
+);
+CREATE INDEX IF NOT EXISTS trabajos_cola ON trabajos (estado, disponible_desde, id);
+"""
+
+
+# -----------------------------------------------------------------------------
+# Conexión
+# -----------------------------------------------------------------------------
+
+def _conexion():
+    """Una conexión por hilo (sqlite3 no comparte conexiones entre hilos)."""
+    conexion = getattr(_local, 'conexion', None)
+    if conexion is None or getattr(_local, 'pid', None) != os.getpid():
+        conexion = sqlite3.connect(ruta_datos(ARCHIVO_TRABAJOS), timeout=30, isolation_level=None)
+        conexion.row_factory = sqlite3.Row
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.executescript(_ESQUEMA)
+        _agregar_latido(conexion)
+        _local.conexion = conexion
+        _local.pid = os.getpid()
+    return conexion
+
+
+def _agregar_latido(conexion):
+    """Bases creadas antes de que existiera la columna 'latido'."""
+    columnas = {fila['name'] for fila in conexion.execute('PRAGMA table_info(trabajos)')}
+    if 'latido' in columnas:
+        return
+    try:
+        conexion.execute('ALTER TABLE trabajos ADD COLUMN latido REAL')
+    except sqlite3.OperationalError:
+        pass  # Otro proceso la agregó al mismo tiempo
+
+
+def _a_dict(fila):
+    if fila is None:
+        return None
+    trabajo = dict(fila)
+    trabajo['parametros'] = json_rapido.loads(trabajo['parametros'])
+    if trabajo['resultado'] is not None:
+        trabajo['resultado'] = json_rapido.loads(trabajo['resultado'])
+    return trabajo
+
+
+# -----------------------------------------------------------------------------
+# API
+# -----------------------------------------------------------------------------
+
+def registrar(tipo, funcion, max_intentos=MAX_INTENTOS):
+    """Asocia un tipo de trabajo con la función que lo ejecuta."""
+    _tareas[tipo] = {'funcion': funcion, 'max_intentos': max_intentos}
+
+
+def encolar(tipo, parametros=None, max_intentos=None):
+    """Agrega un trabajo a la cola; devuelve su id."""
+    if tipo not in _tareas:
+        raise ValueError(f'Tipo de trabajo desconocido: {tipo}')
+    ahora = time.time()
+    cursor = _conexion().execute(
+        'INSERT INTO trabajos (tipo, parametros, max_intentos, creado, disponible_desde) VALUES (?, ?, ?, ?, ?)',
+        (tipo, json_rapido.dumps(parametros or {}, indentar=False),
+         max_intentos or _tareas[tipo]['max_intentos'], ahora, ahora)
+    )
+    _aviso.set()
+    return cursor.lastrowid
+
+
+def obtener(trabajo_id):
+    """Estado de un trabajo (None si no existe)."""
+    fila = _conexion().execute('SELECT * FROM trabajos WHERE id = ?', (trabajo_id,)).fetchone()
+    return _a_dict(fila)
+
+
+def listar(estado=None, tipo=None, limite=50):
+    """Trabajos más recientes, opcionalmente filtrados por estado y tipo."""
+    condiciones, valores = [], []
+    if estado:
+        condiciones.append('estado = ?')
+        valores.append(estado)
+    if tipo:
+        condiciones.append('tipo = ?')
+        valores.append(tipo)
+    donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    filas = _conexion().execute(
+        f'SELECT * FROM trabajos {donde} ORDER BY id DESC LIMIT ?', (*valores, limite)
+    ).fetchall()
+    return [_a_dict(f) for f in filas]
+
+
+def metricas(ventana_segundos=3600):
+    """Profundidad de la cola y latencias de los trabajos terminados en la ventana."""
+    conexion = _conexion()
+    ahora = time.time()
+    por_estado = dict.fromkeys(ESTADOS, 0)
+    for fila in conexion.execute('SELECT estado, COUNT(*) AS n FROM trabajos GROUP BY estado'):
+        por_estado[fila['estado']] = fila['n']
+
+    mas_antiguo = conexion.execute(
+        "SELECT MIN(creado) AS creado FROM trabajos WHERE estado = 'pendiente'"
+    ).fetchone()['creado']
+
+    filas = conexion.execute(
+        'SELECT tipo, estado, creado, iniciado, terminado FROM trabajos WHERE terminado >= ?',
+        (ahora - ventana_segundos,)
+    ).fetchall()
+    esperas = sorted(f['iniciado'] - f['creado'] for f in filas if f['iniciado'])
+    duraciones = sorted(f['terminado'] - f['iniciado'] for f in filas if f['iniciado'])
+
+    def percentil(valores, p):
+        if not valores:
+            return None
+        return round(valores[min(len(valores) - 1, int(len(valores) * p))] * 1000, 1)
+
+    return {
+        'profundidad': por_estado['pendiente'],
+        'por_estado': por_estado,
+        'espera_mas_antigua_s': round(ahora - mas_antiguo, 1) if mas_antiguo else 0,
+        'ventana_s': ventana_segundos,
+        'terminados': len(filas),
+        'fallidos': sum(1 for f in filas if f['estado'] == 'fallido'),
+        'espera_ms': {'p50': percentil(esperas, 0.5), 'p95': percentil(esperas, 0.95)},
+        'duracion_ms': {'p50': percentil(duraciones, 0.5), 'p95': percentil(duraciones, 0.95)},
+        'hilos_activos': sum(1 for h in _hilos if h.is_alive())
+    }
+
+
+# -----------------------------------------------------------------------------
+# Ejecución
+# -----------------------------------------------------------------------------
+
+def _tomar(worker):
+    """Marca como en curso el próximo trabajo disponible y lo devuelve."""
+    conexion = _conexion()
+    ahora = time.time()
+    conexion.execute('BEGIN IMMEDIATE')
+    try:
+        # Recuperar trabajos de workers que murieron a mitad de ejecución
+        vencido = ahora - LATIDO_VENCIDO
+        conexion.execute(
+            "UPDATE trabajos SET estado = 'fallido', terminado = ?, "
+            "error = 'El worker terminó sin completar el trabajo' "
+            "WHERE estado = 'en_curso' AND COALESCE(latido, iniciado) < ? AND intentos >= max_intentos",
+            (ahora, vencido)
+        )
+        conexion.execute(
+            "UPDATE trabajos SET estado = 'pendiente', worker = NULL "
+            "WHERE estado = 'en_curso' AND COALESCE(latido, iniciado) < ?",
+            (vencido,)
+        )
+        fila = conexion.execute(
+            "SELECT * FROM trabajos WHERE estado = 'pendiente' AND disponible_desde <= ? "
+            "ORDER BY id LIMIT 1",
+            (ahora,)
+        ).fetchone()
+        if fila is not None:
+            conexion.execute(
+                "UPDATE trabajos SET estado = 'en_curso', intentos = intentos + 1, iniciado = ?, latido = ?, worker = ? "
+                "WHERE id = ?",
+                (ahora, ahora, worker, fila['id'])
+            )
+        conexion.execute('COMMIT')
+    except Exception:
+        conexion.execute('ROLLBACK')
+        raise
+    return _a_dict(fila)
+
+
+def _latir(trabajo_id, fin):
+    """Marca el trabajo como vivo hasta que `fin` se active."""
+    while not fin.wait(INTERVALO_LATIDO):
+        try:
+            _conexion().execute(
+                "UPDATE trabajos SET latido = ? WHERE id = ? AND estado = 'en_curso'",
+                (time.time(), trabajo_id)
+            )
+        except sqlite3.Error as e:
+            print(f"[TRABAJOS] ⚠️ No se pudo registrar el latido de #{trabajo_id}: {e}")
+
+
+def _terminar(trabajo, resultado=None, error=None):
+    conexion = _conexion()
+    ahora = time.time()
+    if error is None:
+        conexion.execute(
+            "UPDATE trabajos SET estado = 'completado', resultado = ?, error = NULL, terminado = ? WHERE id = ?",
+            (json_rapido.dumps(resultado, indentar=False), ahora, trabajo['id'])
+        )
+        return
+
+    intentos = trabajo['intentos'] + 1
+    if intentos < trabajo['max_intentos']:
+        conexion.execute(
+            "UPDATE trabajos SET estado = 'pendiente', error = ?, disponible_desde = ?, worker = NULL WHERE id = ?",
+            (error, ahora + ESPERA_REINTENTO * 2 ** (intentos - 1), trabajo['id'])
+        )
+        print(f"[TRABAJOS] ⚠️ {trabajo['tipo']} #{trabajo['id']} falló (intento {intentos}/{trabajo['max_intentos']}), se reintentará")
+    else:
+        conexion.execute(
+            "UPDATE trabajos SET estado = 'fallido', error = ?, terminado = ? WHERE id = ?",
+            (error, ahora, trabajo['id'])
+        )
+        print(f"[TRABAJOS] ❌ {trabajo['tipo']} #{trabajo['id']} falló definitivamente: {error.splitlines()[-1]}")
+
+
+def ejecutar_pendientes(worker='manual'):
+    """Ejecuta trabajos hasta vaciar la cola disponible; devuelve cuántos procesó."""
+    procesados = 0
+    while True:
+        trabajo = _tomar(worker)
+        if trabajo is None:
+            return procesados
+        tarea = _tareas.get(trabajo['tipo'])
+        if tarea is None:
+            _terminar(trabajo, error=f"Tipo de trabajo desconocido: {trabajo['tipo']}")
+        else:
+            fin = threading.Event()
+            threading.Thread(target=_latir, args=(trabajo['id'], fin), name=f"latido-{trabajo['id']}", daemon=True).start()
+            try:
+                _terminar(trabajo, resultado=tarea['funcion'](trabajo['parametros']))
+            except Exception:
+                _terminar(trabajo, error=traceback.format_exc())
+            finally:
+                fin.set()
+        procesados += 1
+
+
+def _bucle(worker):
+    while True:
+        try:
+            ejecutar_pendientes(worker)
+        except Exception as e:
+            print(f"[TRABAJOS] ❌ Error en {worker}: {e}")
+        _aviso.wait(INTERVALO_SONDEO)
+        _aviso.clear()
+
+
+def iniciar(hilos=HILOS_POR_PROCESO):
+    """Levanta los hilos de este proceso (idempotente)."""
+    with _hilos_lock:
+        if any(h.is_alive() for h in _hilos):
+            return
+        _hilos.clear()
+        for i in range(hilos):
+            worker = f"{os.getpid()}-{i + 1}"
+            hilo = threading.Thread(target=_bucle, args=(worker,), name=f"trabajos-{worker}", daemon=True)
+            hilo.start()
+            _hilos.append(hilo)
+    print(f"[TRABAJOS] ⚙️ {hilos} hilo(s) de trabajos en segundo plano (pid {os.getpid()})")
+
+
+def limpiar_historial(dias=DIAS_HISTORIAL):
+    """Borra los trabajos terminados hace más de `dias` días."""
+    cursor = _conexion().execute(
+        "DELETE FROM trabajos WHERE estado IN ('completado', 'fallido') AND terminado < ?",
+        (time.time() - dias * 86400,)
+    )
+    return cursor.rowcount
@@ -0,0 +1,237 @@
+# =============================================================================
+# VERSIONES - Secuencia de cambios por colección para sincronización delta
+# =============================================================================
+# consultas.json, inventario.json y pacientes.json llevan un contador
+# 'seq_cambios' que crece con cada registro creado, modificado o eliminado:
+#
+#   - cada registro guarda en 'seq_cambio' el valor del contador la última
+#     vez que cambió
+#   - los eliminados quedan en 'eliminados' como [{id, seq_cambio}]; solo
+#     se conservan los últimos ELIMINADOS_CONSERVADOS y 'seq_minimo_eliminados'
+#     guarda el seq del más reciente descartado: quien sincronizó antes de
+#     ese número recibe la colección completa
+#
+# guardar_versionado() compara lo que se va a escribir con lo que hay en
+# disco y asigna los nuevos números bajo bloqueo, así que los endpoints no
+# necesitan saber qué registros tocaron. /api/changes?desde=<seq> devuelve
+# solo lo que cambió después de ese número.
+#
+# Además cada registro lleva 'version' (1 al crearse, +1 en cada cambio) para
+# control de concurrencia optimista:
+#
+#   - el cliente envía la versión que está editando (If-Match o 'version'
+#     en el body) y verificar_version() rechaza la escritura si ya no es la
+#     vigente
+#   - los endpoints que indican qué registros modificaron
+#     (guardar_versionado(..., modificados={id})) fallan con ConflictoVersion
+#     si otro worker cambió esos registros entre la lectura y la escritura;
+#     los demás registros desactualizados se toman de disco y los creados
+#     por otros workers se conservan, en lugar de pisarlos
+#
+# Lo que cambia cada escritura queda además en el diario de mutaciones
+# (ver diario.py), y las vistas derivadas que se registran con al_escribir()
+# reciben el contenido anterior y el escrito, todavía bajo el bloqueo.
+# =============================================================================
+
+import copy
+
+try:
+    from . import diario
+    from .persistencia import leer_json, escribir_json, bloqueo
+except ImportError:
+    import diario
+    from persistencia import leer_json, escribir_json, bloqueo
+
+# coleccion -> (archivo, clave de la lista de registros)
+COLECCIONES = {
+    'consultas': ('consultas.json', 'consultas'),
+    'inventario': ('inventario.json', 'medicamentos'),
+    'pacientes': ('pacientes.json', 'pacientes')
+}
+
+ARCHIVOS_VERSIONADOS = {archivo: lista for archivo, lista in COLECCIONES.values()}
+
+ELIMINADOS_CONSERVADOS = 1000
+
+_al_escribir = {}   # archivo -> [funcion(anterior, data)]
+
+
+class ConflictoVersion(Exception):
+    """El registro cambió desde que se leyó; `registro` es la copia vigente."""
+
+    def __init__(self, registro):
+        super().__init__(f"El registro {registro.get('id')} fue modificado por otro usuario, recargue e intente de nuevo")
+        self.registro = registro
+        self.version_actual = registro.get('version', 1)
+
+
+class VersionInvalida(ValueError):
+    """If-Match o 'version' con un valor que no es un número de versión."""
+
+
+def leer_version(valor):
+    """Versión esperada a partir de If-Match ('3', '"3"', 'W/"3"') o del body; None si no hay."""
+    if valor is None or valor == '' or valor == '*':
+        return None
+    if isinstance(valor, bool):
+        raise VersionInvalida('Versión inválida')
+    if isinstance(valor, int):
+        return valor
+    texto = str(valor).strip()
+    if texto.startswith('W/'):
+        texto = texto[2:]
+    try:
+        return int(texto.strip('"'))
+    except ValueError:
+        raise VersionInvalida(f'Versión inválida: {valor}')
+
+
+def verificar_version(registro, esperada):
+    """Falla con ConflictoVersion si el cliente editó una versión anterior."""
+    if esperada is not None and registro.get('version', 1) != esperada:
+        raise ConflictoVersion(registro)
+
+
+def _fusionar(data, lista, previos, modificados):
+    """
+    Ajusta `data` a lo que otros workers escribieron desde que se leyó.
+
+    Solo los registros de `modificados` pueden pisar una versión más nueva
+    (y en ese caso es un conflicto); el resto se toma de disco.
+    """
+    registros = data.setdefault(lista, [])
+    presentes = set()
+    for i, registro in enumerate(registros):
+        presentes.add(registro.get('id'))
+        previo = previos.get(registro.get('id'))
+        if previo is None or previo.get('version', 1) == registro.get('version', 1):
+            continue
+        if registro.get('id') in modificados:
+            raise ConflictoVersion(previo)
+        registros[i] = dict(previo)
+    for id_previo, previo in previos.items():
+        if id_previo not in presentes:
+            registros.append(dict(previo))
+
+
+def _versionar(data, lista, anterior, modificados=None):
+    """Asigna seq_cambio y version a los registros que difieren de `anterior`."""
+    anterior = anterior or {}
+    previos = {r.get('id'): r for r in anterior.get(lista, [])}
+    seq = anterior.get('seq_cambios', 0)
+
+    if modificados is not None:
+        _fusionar(data, lista, previos, modificados)
+
+    ids = set()
+    for registro in data.get(lista, []):
+        ids.add(registro.get('id'))
+        registro.pop('seq_cambio', None)
+        previo = previos.get(registro.get('id'))
+        seq_previo = previo.pop('seq_cambio', 0) if previo is not None else None
+        if previo == registro:
+            registro['seq_cambio'] = seq_previo
+        else:
+            seq += 1
+            registro['seq_cambio'] = seq
+            registro['version'] = previo.get('version', 1) + 1 if previo is not None else 1
+
+    eliminados = [e for e in anterior.get('eliminados', []) if e['id'] not in ids]
+    for id_previo in previos:
+        if id_previo not in ids:
+            seq += 1
+            eliminados.append({'id': id_previo, 'seq_cambio': seq})
+
+    minimo = anterior.get('seq_minimo_eliminados', 0)
+    if len(eliminados) > ELIMINADOS_CONSERVADOS:
+        descartados = eliminados[:-ELIMINADOS_CONSERVADOS]
+        eliminados = eliminados[-ELIMINADOS_CONSERVADOS:]
+        minimo = max(minimo, max(e['seq_cambio'] for e in descartados))
+
+    data['eliminados'] = eliminados
+    data['seq_cambios'] = seq
+    if minimo:
+        data['seq_minimo_eliminados'] = minimo
+
+
+def al_escribir(nombre, funcion):
+    """
+    Registra `funcion(anterior, data)` para cada escritura versionada de `nombre`.
+
+    Se llama bajo el bloqueo del archivo, ya escrito: `anterior` es lo que
+    había en disco y `data` lo que quedó (los registros cambiados tienen
+    seq_cambio mayor que anterior['seq_cambios']).
+    """
+    _al_escribir.setdefault(nombre, []).append(funcion)
+
+
+def _notificar(nombre, anterior, data):
+    for funcion in _al_escribir.get(nombre, ()):
+        try:
+            funcion(anterior or {}, data)
+        except Exception as e:
+            # El archivo ya se escribió: la vista derivada se puede reconstruir
+            print(f"[VERSIONES] ❌ Error actualizando vista derivada de {nombre}: {e}")
+
+
+def guardar_versionado(nombre, data, lista, modificados=None):
+    """
+    Escribe una colección versionada (reemplaza al json.dump directo).
+
+    `modificados`: ids de los registros que cambió la petición; activa la
+    detección de conflictos (ver _fusionar). None mantiene el comportamiento
+    anterior: lo escrito reemplaza lo que haya en disco.
+    """
+    with bloqueo(nombre):
+        anterior = leer_json(nombre)
+        _versionar(data, lista, anterior, modificados)
+        escribir_json(nombre, data)
+        diario.registrar_versionado(nombre, lista, anterior, data)
+        _notificar(nombre, anterior, data)
+
+
+def actualizar_registros(nombre, lista, cambios):
+    """
+    Aplica `cambios` ({id: funcion(registro)}) sobre lo que hay en disco.
+
+    Para modificaciones relativas (ej: descontar stock) que no deben partir
+    de una copia leída antes: se lee, modifica y escribe bajo el mismo
+    bloqueo. Devuelve el contenido escrito.
+    """
+    with bloqueo(nombre):
+        anterior = leer_json(nombre, default={})
+        data = copy.deepcopy(anterior)
+        for registro in data.get(lista, []):
+            funcion = cambios.get(registro.get('id'))
+            if funcion is not None:
+                funcion(registro)
+        _versionar(data, lista, anterior)
+        escribir_json(nombre, data)
+        diario.registrar_versionado(nombre, lista, anterior, data)
+        _notificar(nombre, anterior, data)
+    return data
+
+
+def cambios_desde(coleccion, desde):
+    """
+    Registros de `coleccion` creados o modificados después de `desde`.
+
+    Si `desde` es mayor que la secuencia actual (por ejemplo el cliente
+    sincronizó contra un archivo que luego se reemplazó a mano), o anterior
+    a eliminaciones cuyo registro ya se descartó, se devuelve la colección
+    completa con completo=True para que el cliente la reemplace.
+    """
+    archivo, lista = COLECCIONES[coleccion]
+    data = leer_json(archivo, default={})
+    seq = data.get('seq_cambios', 0)
+    registros = data.get(lista, [])
+
+    if desde is None or desde > seq or desde < data.get('seq_minimo_eliminados', 0):
+        return {'seq': seq, 'completo': True, 'cambios': registros, 'eliminados': []}
+
+    return {
+        'seq': seq,
+        'completo': False,
+        'cambios': [r for r in registros if r.get('seq_cambio', 0) > desde],
+        'eliminados': [e['id'] for e in data.get('eliminados', []) if e['seq_cambio'] > desde]
+    }